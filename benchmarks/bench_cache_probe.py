@@ -0,0 +1,71 @@
+"""
+Benchmark: DAG construction with and without the bulk cache index
+
+Builds a Pipeline of independent Tasks, half of which already have a result in the
+cache, once probing the cache with a stat per Task and once with the set built by a
+single Cache.scan(). Reports total construction time and time spent probing.
+
+Usage:
+python bench_cache_probe.py [num_tasks]
+
+Run it with mpirun to see the effect of every rank probing the same directory:
+mpirun -n 4 python bench_cache_probe.py 10000
+"""
+
+import os, sys, time, pickle, tempfile, json
+from ndustria import Pipeline
+
+def build(pipe, num_tasks):
+
+    @pipe.AddFunction()
+    def work(i):
+        return i
+
+    return [work(i) for i in range(num_tasks)]
+
+
+def construct(cache_dir, num_tasks, use_index):
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+    pipe = Pipeline(name="bench_cache_probe", cache_dir=cache_dir, log_level="warning", parallel=True)
+
+    if not use_index:
+        pipe.cache.index = None
+
+    pipe.comm.Barrier()
+    start = time.perf_counter()
+    tasks = build(pipe, num_tasks)
+    elapsed = time.perf_counter() - start
+
+    probe = sum(t.metrics.times["probe"] for t in tasks)
+    return pipe, tasks, elapsed, probe
+
+
+def main():
+    num_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    cache_dir = os.path.join(tempfile.gettempdir(), "ndustria_bench_cache_probe")
+
+    # fill half of the cache with results so both hits and misses get probed
+    pipe, tasks, _, _ = construct(cache_dir, num_tasks, use_index=True)
+    if pipe.isRoot():
+        for t in tasks[::2]:
+            with open(pipe.cache.getFullPathToTask(t), "wb") as f:
+                pickle.dump(0, f)
+    pipe.comm.Barrier()
+
+    results = {"num_tasks": num_tasks, "ranks": pipe.getCommSize()}
+    for label, use_index in [("stat_per_task", False), ("scan_index", True)]:
+        pipe, tasks, elapsed, probe = construct(cache_dir, num_tasks, use_index)
+        results[label] = {
+            "construction_s": elapsed,
+            "probe_s": probe,
+            "us_per_task": 1e6 * elapsed / num_tasks,
+        }
+
+    if pipe.isRoot():
+        print(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: startup time of "import ndustria" and of the ndustria command line tool
+
+Runs each in a fresh interpreter with "python -X importtime" and reports the cumulative
+import time along with the slowest modules. Fails (exit code 1) if any of the heavy
+dependencies that should only be imported on demand show up, or if importing ndustria
+takes longer than the budget, so it can be used to guard against startup regressions.
+
+Usage:
+python bench_import.py [--budget-ms 150] [--repeat 5] [--json results.json]
+"""
+
+import argparse, json, os, subprocess, sys
+
+# Modules that must only be imported when the feature needing them is used
+HEAVY_MODULES = [
+    "mpi4py",
+    "line_profiler",
+    "numpy",
+    "tabulate",
+    "tracemalloc",
+    "matplotlib",
+]
+
+NDUSTRIA_CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "ndustria")
+
+
+def importTimes(command):
+    """Runs a python command with -X importtime and returns {module: cumulative microseconds}"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        capture_output=True,
+        text=True
+    )
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative_us)
+
+    return times
+
+
+def topLevel(times, module):
+    return times.get(module, 0) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", type=str, default="")
+    args = parser.parse_args()
+
+    commands = {
+        "import ndustria": (["-c", "import ndustria"], "ndustria"),
+        "ndustria --help": ([NDUSTRIA_CLI, "--help"], None),
+    }
+
+    results = {}
+    failed = False
+
+    for label, (command, root_module) in commands.items():
+
+        runs = [importTimes(command) for _ in range(args.repeat)]
+
+        # best of n to reduce noise from the filesystem cache
+        times = min(runs, key=lambda t: topLevel(t, root_module) if root_module else sum(t.values()))
+
+        heavy = sorted(set(
+            m.split(".")[0] for m in times if m.split(".")[0] in HEAVY_MODULES
+        ))
+        slowest = sorted(times.items(), key=lambda kv: -kv[1])[:10]
+
+        results[label] = {
+            "import_ms": topLevel(times, root_module) if root_module else None,
+            "heavy_modules": heavy,
+            "slowest_ms": {m: t / 1000 for m, t in slowest},
+        }
+
+        print(f"\n{label}")
+        if root_module:
+            print(f"  cumulative import time: {topLevel(times, root_module):.1f} ms")
+        for m, t in slowest:
+            print(f"  {t/1000:8.1f} ms  {m}")
+
+        if len(heavy) > 0:
+            print(f"  [Error] imported heavy modules at startup: {', '.join(heavy)}")
+            failed = True
+
+        if root_module and topLevel(times, root_module) > args.budget_ms:
+            print(f"  [Error] import took longer than the {args.budget_ms} ms budget")
+            failed = True
+
+    if args.json != "":
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark: cost of adding Tasks to a Pipeline
+
+Builds DAGs of num_tasks Tasks with an empty cache and reports the registration cost in
+microseconds per Task, for
+loop       -- calling the decorated function once per Task
+map        -- adding the same Tasks in bulk with the decorated function's map()
+dependent  -- one Task per element of the first batch that depends on it, added with map()
+random     -- the random shape of shapes.py, where every Task depends on up to 3 earlier ones
+
+Usage:
+python bench_registration.py [num_tasks]
+"""
+
+import os, sys, time, tempfile, json, shutil
+from ndustria import Pipeline
+from shapes import SHAPES
+
+def newPipeline(cache_dir):
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+    return Pipeline(name="bench_registration", cache_dir=cache_dir, log_level="warning")
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    num_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    cache_dir = os.path.join(tempfile.gettempdir(), "ndustria_bench_registration")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results = {"num_tasks": num_tasks}
+
+    pipe = newPipeline(cache_dir)
+
+    @pipe.AddFunction()
+    def work(i, scale=1.0):
+        return i * scale
+
+    @pipe.AddFunction()
+    def post(x, i):
+        return x
+
+    _, elapsed = timed(lambda: [work(i, scale=2.0) for i in range(num_tasks)])
+    results["loop_us_per_task"] = 1e6 * elapsed / num_tasks
+
+    pipe = newPipeline(cache_dir)
+    tasks, elapsed = timed(lambda: work.map(range(num_tasks), scale=2.0))
+    results["map_us_per_task"] = 1e6 * elapsed / num_tasks
+
+    _, elapsed = timed(lambda: post.map(tasks, range(num_tasks)))
+    results["dependent_us_per_task"] = 1e6 * elapsed / num_tasks
+
+    pipe = newPipeline(cache_dir)
+    tasks, elapsed = timed(lambda: SHAPES["random"](pipe, num_tasks, 8))
+    results["random_us_per_task"] = 1e6 * elapsed / len(tasks)
+
+    print(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Scheduler and cache benchmark suite
+
+Builds synthetic Pipelines of the shapes in shapes.py for every combination of shape,
+number of Tasks and result size, and measures:
+
+construction   -- time to build the DAG with an empty cache, per Task
+hashing        -- time spent computing Task hashcodes
+makespan       -- wall clock time of pipe.run() with an empty cache
+overhead       -- makespan minus the time spent computing and in the cache, per Task.
+                  This is the cost of ndustria's own scheduling
+save / load    -- cache write and read throughput in MB/s
+warm           -- time to build the DAG again once every result is cached
+
+Results are written as JSON so they can be compared across versions.
+
+Usage:
+python run_benchmarks.py --shapes chain fanout --sizes 100 1000 --result-bytes 1024 1048576 --output results.json
+
+Run under MPI to benchmark the parallel executor:
+mpirun -n 4 python run_benchmarks.py --parallel --output results_mpi.json
+"""
+
+import argparse, json, os, platform, shutil, sys, tempfile, time
+
+from ndustria import Pipeline
+from shapes import SHAPES
+
+
+def newPipeline(cache_dir, parallel):
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+    return Pipeline(name="bench", cache_dir=cache_dir, parallel=parallel, log_level="warning")
+
+
+def checkComplete(tasks, message):
+    """Raises RuntimeError if any of the Tasks isn't done"""
+    missing = sum(1 for t in tasks if not t.done())
+    if missing > 0:
+        raise RuntimeError(f"{message}, {missing} of {len(tasks)} are not done")
+
+
+def benchmark(shape, num_tasks, result_bytes, parallel, cache_dir):
+
+    pipe = newPipeline(cache_dir, parallel)
+    if pipe.isRoot():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    pipe.comm.Barrier()
+
+    # cold construction, empty cache
+    pipe = newPipeline(cache_dir, parallel)
+    pipe.comm.Barrier()
+    start = time.perf_counter()
+    tasks = SHAPES[shape](pipe, num_tasks, result_bytes)
+    construction = time.perf_counter() - start
+
+    # hashing, recomputed from scratch in dependency order
+    for t in tasks:
+        t.hashcode = ""
+    start = time.perf_counter()
+    for t in tasks:
+        t.getHashCode()
+    hashing = time.perf_counter() - start
+
+    # end to end
+    pipe.comm.Barrier()
+    start = time.perf_counter()
+    pipe.run()
+    makespan = time.perf_counter() - start
+
+    # a run that stopped short would pass for a fast one
+    checkComplete(tasks, f"{shape} with {num_tasks} Tasks did not complete every Task")
+
+    compute = sum(t.metrics.times["compute"] for t in tasks)
+    cache_time = sum(
+        t.metrics.times[phase] for t in tasks for phase in ["load", "serialize", "write"]
+    )
+    saved_bytes = sum(t.metrics.bytes["serialize"] for t in tasks)
+    save_time = sum(t.metrics.times["serialize"] for t in tasks)
+
+    # warm construction, every result cached
+    pipe = newPipeline(cache_dir, parallel)
+    pipe.comm.Barrier()
+    start = time.perf_counter()
+    tasks = SHAPES[shape](pipe, num_tasks, result_bytes)
+    warm = time.perf_counter() - start
+    checkComplete(tasks, f"{shape} with {num_tasks} Tasks did not find every result in the cache")
+
+    # load every result back
+    for t in tasks:
+        t.result = None
+    start = time.perf_counter()
+    for t in tasks:
+        t.getResult()
+    load_time = time.perf_counter() - start
+    loaded_bytes = sum(t.metrics.bytes["load"] for t in tasks)
+
+    def mb_per_s(nbytes, seconds):
+        return nbytes / 1e6 / seconds if seconds > 0 else None
+
+    n = len(tasks)
+    return {
+        "shape": shape,
+        "num_tasks": n,
+        "result_bytes": result_bytes,
+        "construction_s": construction,
+        "construction_us_per_task": 1e6 * construction / n,
+        "hashing_s": hashing,
+        "hashing_us_per_task": 1e6 * hashing / n,
+        "makespan_s": makespan,
+        "overhead_us_per_task": 1e6 * max(makespan - compute - cache_time, 0) / n,
+        "save_mb_per_s": mb_per_s(saved_bytes, save_time),
+        "load_mb_per_s": mb_per_s(loaded_bytes, load_time),
+        "warm_construction_s": warm,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shapes", nargs="+", default=list(SHAPES.keys()), choices=list(SHAPES.keys()))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--result-bytes", nargs="+", type=int, default=[1024, 1024**2])
+    parser.add_argument("--parallel", action="store_true", help="use the MPI executor, run with mpirun")
+    parser.add_argument("--cache-dir", type=str, default=os.path.join(tempfile.gettempdir(), "ndustria_bench"))
+    parser.add_argument("--label", type=str, default="", help="tag stored with the results, e.g. a version or commit")
+    parser.add_argument("--output", type=str, default="benchmark_results.json")
+    args = parser.parse_args()
+
+    pipe = newPipeline(args.cache_dir, args.parallel)
+    root = pipe.isRoot()
+    ranks = pipe.getCommSize()
+
+    results = []
+    for shape in args.shapes:
+        for num_tasks in args.sizes:
+            for result_bytes in args.result_bytes:
+                r = benchmark(shape, num_tasks, result_bytes, args.parallel, args.cache_dir)
+                results.append(r)
+                if root: print(
+                    f"{shape:8s} n={r['num_tasks']:<8d} bytes={result_bytes:<10d} "
+                    f"build={r['construction_us_per_task']:.1f}us/task "
+                    f"makespan={r['makespan_s']:.3f}s "
+                    f"overhead={r['overhead_us_per_task']:.1f}us/task",
+                    file=sys.stderr
+                )
+
+    if not root:
+        return
+
+    report = {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "executor": "mpi" if args.parallel else "serial",
+        "ranks": ranks,
+        "results": results,
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Synthetic Pipeline shapes used by the benchmarks
+
+Each builder adds roughly num_tasks Tasks to a Pipeline and returns the list of all Tasks it
+created. Every Task returns a payload of result_bytes bytes so cache throughput can be measured
+independently of the DAG shape.
+
+fanout  -- one root Task feeding num_tasks-1 independent children
+chain   -- a single line of num_tasks Tasks, each depending on the previous one
+diamond -- repeated split/join layers: one Task fans out to `width` Tasks that join back into one
+nbody   -- the nbody tutorial's parameter sweep: initial conditions, simulation and analysis for
+           each parameter value, with one summary Task over all analyses
+random  -- a random DAG where every Task depends on up to max_parents earlier Tasks
+"""
+
+import random
+
+def payload(seed, result_bytes):
+    """A result of result_bytes bytes that is unique to seed"""
+    return seed.to_bytes(8, "little") + bytes(max(result_bytes - 8, 0))
+
+def source(i, result_bytes):
+    return payload(i, result_bytes)
+
+def step(parent, i, result_bytes):
+    return payload(i, result_bytes)
+
+def join(parents, i, result_bytes):
+    return payload(i, result_bytes)
+
+def create_initial_conditions(param, result_bytes):
+    return payload(param, result_bytes)
+
+def run_simulation(ics, param, result_bytes):
+    return payload(param, result_bytes)
+
+def do_analysis(sim, param, result_bytes):
+    return payload(param, result_bytes)
+
+def summarize(analyses, result_bytes):
+    return payload(len(analyses), result_bytes)
+
+
+def fanout(pipe, num_tasks, result_bytes):
+    source_task = pipe.AddFunction()(source)
+    step_task = pipe.AddFunction()(step)
+
+    root = source_task(0, result_bytes)
+    return [root] + [step_task(root, i, result_bytes) for i in range(1, num_tasks)]
+
+
+def chain(pipe, num_tasks, result_bytes):
+    source_task = pipe.AddFunction()(source)
+    step_task = pipe.AddFunction()(step)
+
+    tasks = [source_task(0, result_bytes)]
+    for i in range(1, num_tasks):
+        tasks.append(step_task(tasks[-1], i, result_bytes))
+    return tasks
+
+
+def diamond(pipe, num_tasks, result_bytes, width=8):
+    source_task = pipe.AddFunction()(source)
+    step_task = pipe.AddFunction()(step)
+    join_task = pipe.AddFunction()(join)
+
+    tasks = [source_task(0, result_bytes)]
+    i = 1
+    while i < num_tasks:
+        top = tasks[-1]
+        middle = [step_task(top, i + j, result_bytes) for j in range(width)]
+        tasks += middle
+        i += width
+        tasks.append(join_task(middle, i, result_bytes))
+        i += 1
+    return tasks
+
+
+def nbody(pipe, num_tasks, result_bytes):
+    ics_task = pipe.AddFunction()(create_initial_conditions)
+    sim_task = pipe.AddFunction()(run_simulation)
+    analysis_task = pipe.AddFunction()(do_analysis)
+    summary_task = pipe.AddFunction()(summarize)
+
+    tasks = []
+    analyses = []
+    for param in range(max((num_tasks - 1) // 3, 1)):
+        ics = ics_task(param, result_bytes)
+        sim = sim_task(ics, param, result_bytes)
+        analysis = analysis_task(sim, param, result_bytes)
+        tasks += [ics, sim, analysis]
+        analyses.append(analysis)
+
+    tasks.append(summary_task(analyses, result_bytes))
+    return tasks
+
+
+def random_dag(pipe, num_tasks, result_bytes, max_parents=3, seed=91415):
+    source_task = pipe.AddFunction()(source)
+    join_task = pipe.AddFunction()(join)
+
+    rng = random.Random(seed)
+
+    tasks = []
+    for i in range(num_tasks):
+        num_parents = rng.randint(0, min(max_parents, len(tasks)))
+        if num_parents == 0:
+            tasks.append(source_task(i, result_bytes))
+        else:
+            # prefer recent Tasks so the DAG has some depth
+            window = tasks[-max(10 * max_parents, 1):]
+            parents = rng.sample(window, min(num_parents, len(window)))
+            tasks.append(join_task(parents, i, result_bytes))
+    return tasks
+
+
+SHAPES = {
+    "fanout": fanout,
+    "chain": chain,
+    "diamond": diamond,
+    "nbody": nbody,
+    "random": random_dag,
+}
@@ -0,0 +1,356 @@
+"""
+Packing cached results into an archive and unpacking them into another cache
+
+Archives are plain tar files (readable with `tar -tf`) that are written and read as a stream,
+so packing never copies the cache first. Each cached file is stored as a gzip compressed
+member named results/<file>.gz, chunks/<file>/... for chunked arrays, or artifacts/<file>/...
+for the files in a Task's output directory. Files are compressed
+in blocks of BLOCK_BYTES on a pool of threads, and since every block is a complete gzip stream
+the members can also be decompressed by any gzip tool.
+
+The pax headers of each member record the digest and size of the original file, the Task it
+belongs to and the compressed size of each block, so unpacking can decompress blocks in
+parallel and verify every file before it enters the cache. A MANIFEST.json member at the end
+lists everything in the archive. Identical results are stored once: later Tasks with the
+same result get a hard link member (extracted by tar as a link too) that names the first one
+in its ndustria.same_as header.
+
+Unpacking is resumable: files already in the destination cache with the right digest are
+skipped, and files only become visible once they are complete. The chunks and output files of
+a result are written before the result itself.
+"""
+
+import gzip, io, json, os, shutil, tarfile, threading, time, zlib
+from collections import deque
+from .Cache import newDigest, CHUNK_DIR
+from .Artifact import ARTIFACT_DIR
+from .File import directoryManifest, manifestDigest
+from .Logger import log, error
+
+BLOCK_BYTES = 16*1024**2
+"""Size of the blocks files are compressed in"""
+
+SPOOL_BYTES = 64*1024**2
+"""Compressed members larger than this are buffered in a temporary file while they're packed"""
+
+def orderedMap(pool, function, items, window):
+    """Like pool.map(function, data for (data, extra) in items), but reads at most window items 
+    ahead of the one being consumed. Yields (result, extra) in order
+    """
+    pending = deque()
+    for data, extra in items:
+        pending.append((pool.submit(function, data), extra))
+        if len(pending) > window:
+            future, extra = pending.popleft()
+            yield future.result(), extra
+
+    while len(pending) > 0:
+        future, extra = pending.popleft()
+        yield future.result(), extra
+
+
+def archiveEntries(cache, tasks):
+    """Lists (name in archive, path on disk, Task string, name of an earlier member with the same 
+    content or None) of the files holding the results of tasks"""
+    entries = []
+    seen = set()
+
+    # first member holding each result, by the digest of its blob
+    members = {}
+
+    for task in tasks:
+        fname = task.getFilename()
+        if fname is None or fname == "no_result" or fname in seen:
+            continue
+
+        # results that aren't files in the cache itself
+        path = cache.getFullPathToTask(task)
+        if os.path.dirname(path) != cache.path or not os.path.isfile(path):
+            continue
+        seen.add(fname)
+
+        arcname = f"results/{fname}"
+
+        # identical results are links to the same blob, which is only packed once
+        entry = cache.table.get(fname)
+        digest = entry[2] if entry is not None and len(entry) > 2 else None
+        if digest is not None and digest in members:
+            entries.append((arcname, path, task.getString(), members[digest]))
+            continue
+        if digest is not None:
+            members[digest] = arcname
+
+        for owned_dir in (os.path.join(cache.chunk_path, fname), os.path.join(cache.artifact_path, fname)):
+            if not os.path.isdir(owned_dir):
+                continue
+            for dirpath, dirnames, filenames in sorted(os.walk(owned_dir)):
+                for name in sorted(filenames):
+                    full = os.path.join(dirpath, name)
+                    rel = os.path.relpath(full, cache.path).replace(os.sep, "/")
+                    entries.append((rel, full, None, None))
+
+        entries.append((arcname, path, task.getString(), None))
+
+    return entries
+
+
+def packArchive(cache, tasks, save_to, workers=4, level=6):
+    """Writes the cached results of tasks to the archive save_to. Returns the number of files packed"""
+    from concurrent.futures import ThreadPoolExecutor
+    from tempfile import SpooledTemporaryFile
+
+    entries = archiveEntries(cache, tasks)
+    references = [e for e in entries if e[3] is not None]
+    entries = [e for e in entries if e[3] is None]
+
+    def readBlocks():
+        """Yields (raw block, (entry index, (digest, size) after the last block)) in archive order"""
+        for i, (arcname, path, task_string, same_as) in enumerate(entries):
+            digest = newDigest()
+            size = 0
+            with open(path, "rb") as f:
+                block = f.read(BLOCK_BYTES)
+                while True:
+                    digest.update(block)
+                    size += len(block)
+                    next_block = f.read(BLOCK_BYTES)
+                    last = len(next_block) == 0
+                    yield block, (i, (digest.hexdigest(), size) if last else None)
+                    if last:
+                        break
+                    block = next_block
+
+    tmp_fname = f"{save_to}.partial"
+    manifest = []
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ndustria-pack") as pool, \
+         tarfile.open(tmp_fname, "w", format=tarfile.PAX_FORMAT) as tar:
+
+        spool = None
+        block_sizes = []
+
+        def writeBlock(i, compressed, info):
+            nonlocal spool, block_sizes
+            if spool is None:
+                spool = SpooledTemporaryFile(max_size=SPOOL_BYTES)
+                block_sizes = []
+
+            spool.write(compressed)
+            block_sizes.append(len(compressed))
+
+            if info is None:
+                return
+
+            arcname, path, task_string, same_as = entries[i]
+            digest, size = info
+
+            member = tarfile.TarInfo(f"{arcname}.gz")
+            member.size = spool.tell()
+            member.mtime = int(time.time())
+            member.pax_headers = {
+                "ndustria.digest": digest,
+                "ndustria.size": str(size),
+                "ndustria.blocks": ",".join(str(b) for b in block_sizes),
+            }
+            if task_string is not None:
+                member.pax_headers["ndustria.task"] = task_string
+
+            spool.seek(0)
+            tar.addfile(member, spool)
+            spool.close()
+            spool = None
+
+            manifest.append({"name": arcname, "digest": digest, "size": size, "task": task_string})
+            packed[arcname] = (digest, size)
+
+        # compress up to 2*workers blocks ahead of the one being written
+        compress = lambda block: gzip.compress(block, level)
+        packed = {}
+        for compressed, (i, info) in orderedMap(pool, compress, readBlocks(), 2 * workers):
+            writeBlock(i, compressed, info)
+
+        # results identical to one packed above only name it, after it in the archive
+        for arcname, path, task_string, same_as in references:
+            digest, size = packed[same_as]
+
+            member = tarfile.TarInfo(f"{arcname}.gz")
+            member.type = tarfile.LNKTYPE
+            member.linkname = f"{same_as}.gz"
+            member.mtime = int(time.time())
+            member.pax_headers = {
+                "ndustria.digest": digest,
+                "ndustria.size": str(size),
+                "ndustria.same_as": f"{same_as}.gz",
+                "ndustria.task": task_string,
+            }
+            tar.addfile(member)
+
+            manifest.append({"name": arcname, "digest": digest, "size": size, "task": task_string, "same_as": same_as})
+
+        manifest_bytes = json.dumps(manifest, indent=1).encode()
+        member = tarfile.TarInfo("MANIFEST.json")
+        member.size = len(manifest_bytes)
+        member.mtime = int(time.time())
+        tar.addfile(member, io.BytesIO(manifest_bytes))
+
+    os.replace(tmp_fname, save_to)
+    return len(manifest)
+# end packArchive
+
+
+def unpackArchive(cache, archive, workers=4):
+    """Adds the results in an archive to the cache, verifying each against its digest.
+
+    Returns (number of files added, number already present, number that failed verification).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    added = skipped = failed = 0
+
+    # results whose chunks or output files failed to unpack, which must not enter the cache either
+    broken = set()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ndustria-unpack") as pool, \
+         tarfile.open(archive, "r|") as tar:
+
+        for member in tar:
+
+            if member.name == "MANIFEST.json" or not member.name.endswith(".gz"):
+                continue
+
+            name = member.name[:-len(".gz")]
+            digest = member.pax_headers["ndustria.digest"]
+            size = int(member.pax_headers["ndustria.size"])
+
+            is_result = name.startswith("results/")
+            if is_result:
+                fname = name[len("results/"):]
+                dest = os.path.join(cache.path, fname)
+            elif name.startswith(f"{CHUNK_DIR}/") or name.startswith(f"{ARTIFACT_DIR}/"):
+                dest = os.path.join(cache.path, *name.split("/"))
+            else:
+                continue
+
+            # guard against names escaping the cache
+            if not os.path.abspath(dest).startswith(cache.path + os.sep):
+                error(f"Skipping {member.name} in {archive}, it points outside the cache", fatal=False)
+                continue
+
+            owner = name.split("/")[1]
+            if is_result and owner in broken:
+                error(f"{name} in {archive} was not unpacked because some of its chunks are damaged", fatal=False)
+                failed += 1
+                continue
+
+            if alreadyUnpacked(cache, name, dest, digest, size):
+                skipped += 1
+                continue
+
+            same_as = member.pax_headers.get("ndustria.same_as")
+            if is_result and same_as is not None:
+                if unpackReference(cache, member, fname, dest, digest, size):
+                    added += 1
+                else:
+                    error(f"{name} in {archive} refers to {same_as}, which was not unpacked", fatal=False)
+                    failed += 1
+                continue
+
+            # decompress the blocks in parallel, hash and write them in order
+            block_sizes = [int(b) for b in member.pax_headers["ndustria.blocks"].split(",")]
+            f = tar.extractfile(member)
+            blocks = ((f.read(n), None) for n in block_sizes)
+
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            tmp_fname = os.path.join(
+                cache.blob_path if is_result else os.path.dirname(dest),
+                f".tmp-{os.getpid()}-{threading.get_ident()}"
+            )
+
+            check = newDigest()
+            try:
+                with open(tmp_fname, "wb") as out:
+                    for data, _ in orderedMap(pool, gzip.decompress, blocks, 2 * workers):
+                        check.update(data)
+                        out.write(data)
+            except (OSError, EOFError, zlib.error):
+                # damaged compressed data, counted as a digest mismatch below
+                pass
+
+            if check.hexdigest() != digest:
+                os.remove(tmp_fname)
+                error(f"{name} in {archive} does not match its digest and was not unpacked", fatal=False)
+                broken.add(owner)
+                failed += 1
+                continue
+
+            if is_result:
+                cache.storeBlob(tmp_fname, digest, dest)
+                if cache.index is not None:
+                    cache.index.add(fname)
+                # recorded right away, so an interrupted unpack skips it when it's run again
+                with cache.table_lock:
+                    cache.recordEntry(fname, (member.pax_headers.get("ndustria.task", fname), size, digest) + outputFiles(cache, fname))
+            else:
+                os.replace(tmp_fname, dest)
+
+            added += 1
+
+    cache.fingerprints.flush()
+    cache.writeCacheInfo()
+
+    log(f"Unpacked {archive}: {added} files added, {skipped} already in the cache, {failed} failed")
+    return added, skipped, failed
+# end unpackArchive
+
+
+def unpackReference(cache, member, fname, dest, digest, size):
+    """Adds a result packed as a reference to an identical one earlier in the archive, from the
+    blob that one was stored as. Returns False if it isn't in the cache"""
+    original = os.path.join(cache.path, member.pax_headers["ndustria.same_as"][len("results/"):-len(".gz")])
+
+    tmp_fname = os.path.join(cache.blob_path, f".tmp-{os.getpid()}-{threading.get_ident()}")
+    for source in (os.path.join(cache.blob_path, digest), original):
+        try:
+            os.link(source, tmp_fname)
+            break
+        except FileNotFoundError:
+            continue
+        except OSError:
+            # no hardlinks on this filesystem
+            shutil.copyfile(source, tmp_fname)
+            break
+    else:
+        return False
+
+    cache.storeBlob(tmp_fname, digest, dest)
+    if cache.index is not None:
+        cache.index.add(fname)
+    with cache.table_lock:
+        cache.recordEntry(fname, (member.pax_headers.get("ndustria.task", fname), size, digest))
+    return True
+
+
+def outputFiles(cache, fname):
+    """Cache table fields recording the files in the output directory of a result, if it has one"""
+    artifact_dir = os.path.join(cache.artifact_path, fname)
+    if not os.path.isdir(artifact_dir):
+        return ()
+
+    manifest = directoryManifest(artifact_dir, cache.fingerprints)
+    return ((os.path.relpath(artifact_dir, cache.path), manifestDigest(manifest)), manifest)
+
+
+def alreadyUnpacked(cache, name, dest, digest, size):
+    """True if a previous unpack already put this file in the cache"""
+    try:
+        if os.stat(dest).st_size != size:
+            return False
+    except FileNotFoundError:
+        return False
+
+    if name.startswith("results/"):
+        entry = cache.table.get(name[len("results/"):])
+        return entry is not None and len(entry) > 2 and entry[2] == digest
+
+    # chunks and output files are renamed into place once complete
+    return True
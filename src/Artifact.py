@@ -0,0 +1,104 @@
+"""
+Output directories managed by the cache
+
+Tasks that produce large files, e.g. multi-GB HDF5 snapshots, shouldn't return their data to
+be pickled. With AddFunction(artifacts=True) each Task gets a directory of its own inside the
+cache as the keyword argument output_dir, writes its files there and returns their paths:
+
+    @pipe.AddFunction(artifacts=True)
+    def run_simulation(ics, output_dir):
+        path = os.path.join(output_dir, "snapshots.hdf5")
+        ...                                     # write the file
+        return path
+
+Tasks using the result receive the path, and the files are never copied or pickled. The
+directory is emptied before the Task runs, and once it returns the size and fingerprint of
+every file in it are recorded in the cache table. If the files are changed or deleted later,
+the Task is run again the next time its result is needed.
+
+Paths into the directory are pickled relative to the cache and resolved against the directory
+of the Cache loading the result (see ResultUnpickler), so they stay valid when the cache is
+moved or packed into an archive. Removing the
+result removes the directory, and `ndustria --gc` removes directories without a result.
+"""
+
+import functools, os, pickle
+from .File import File
+
+ARTIFACT_DIR = "artifacts"
+"""Subdirectory of the cache holding the output directories of Tasks"""
+
+
+class ArtifactPath:
+    """Stands in for a path into an output directory in a pickled result.
+
+    Unpickles straight into the full path, as a str or a File like the original.
+    """
+
+    def __init__(self, relpath, as_file=False):
+        self.relpath = relpath
+        self.as_file = as_file
+
+    def __reduce__(self):
+        return (resolvePath, (self.relpath, self.as_file))
+
+
+def resolvePath(relpath, as_file=False, root=None):
+    """Full path of relpath in the cache directory root. Given root by ResultUnpickler"""
+    if root is None:
+        raise pickle.UnpicklingError(f"{relpath} is a path into a cache, results holding it must be loaded by a Cache")
+
+    path = os.path.join(root, *relpath.split("/"))
+    return File(path) if as_file else path
+
+
+class ResultUnpickler(pickle.Unpickler):
+    """Unpickles results, resolving the paths into output directories they hold against root"""
+
+    def __init__(self, f, root):
+        super().__init__(f)
+        self.root = root
+
+    def find_class(self, module, name):
+        if module == __name__ and name == "resolvePath":
+            return functools.partial(resolvePath, root=self.root)
+        return super().find_class(module, name)
+
+
+def storedResult(result, artifact_dir, cache_path):
+    """Returns result with every path into artifact_dir, also inside lists, tuples and dicts,
+    replaced by an ArtifactPath. The result itself is returned if there are none
+    """
+    prefix = artifact_dir + os.sep
+
+    def replace(value):
+        if isinstance(value, (str, File)):
+            path = os.path.abspath(os.fspath(value))
+            if path == artifact_dir or path.startswith(prefix):
+                relpath = os.path.relpath(path, cache_path).replace(os.sep, "/")
+                return ArtifactPath(relpath, isinstance(value, File))
+            return value
+
+        if type(value) in (list, tuple):
+            replaced = [replace(v) for v in value]
+            if all(r is v for r, v in zip(replaced, value)):
+                return value
+            return type(value)(replaced)
+
+        if type(value) == dict:
+            replaced = {k: replace(v) for k, v in value.items()}
+            if all(replaced[k] is v for k, v in value.items()):
+                return value
+            return replaced
+
+        return value
+
+    return replace(result)
+# end storedResult
+
+
+def artifactBytes(entry):
+    """Total size of the files in the output directory of a cache table entry"""
+    if len(entry) < 5 or entry[4] is None:
+        return 0
+    return sum(size for size, fingerprint in entry[4].values())
@@ -0,0 +1,460 @@
+"""
+Backends for sharing cached results between machines
+
+The Cache always keeps results in a local directory. A Pipeline created with remote_cache set
+also looks for results in a shared backend, and uploads the results it computes there. Results
+found remotely are downloaded into the local cache the first time they're needed, so the local
+directory acts as a read-through cache in front of the backend.
+
+Backends are content addressed like the local cache: each result is stored once as a blob named
+by its digest, and a ref named by the Task's cache key points at the blob. Two analysts that
+produce the same result share the blob.
+
+FileBackend   -- a directory, e.g. on a filesystem mounted at several sites
+HTTPBackend   -- a server speaking the small HTTP protocol below
+MockCacheServer -- an in memory implementation of that protocol, for testing and local use
+
+HTTP protocol:
+GET    /refs                    JSON list of all keys
+POST   /refs/query              body {"keys": [...]}, returns {"present": [...]}
+GET    /refs/<key>              digest of the blob the key points to, 404 if missing
+PUT    /refs/<key>              body is the digest, the blob must already exist
+DELETE /refs/<key>
+HEAD   /blobs/<digest>          Content-Length is the size of the blob
+GET    /blobs/<digest>          supports "Range: bytes=<first>-<last>"
+PUT    /blobs/<digest>          uploads a blob in one request
+PUT    /uploads/<digest>/<n>    uploads part n of a blob
+POST   /uploads/<digest>?parts=<N>  joins parts 0..N-1 into the blob
+Blobs are verified against their digest before they are stored.
+"""
+
+import json, os, shutil, threading
+from .Cache import newDigest
+
+class CacheBackend:
+    """Interface of a shared store of cached results. Keys are Task cache keys"""
+
+    def exists(self, key):
+        return key in self.existsMany([key])
+
+    def existsMany(self, keys):
+        """Returns the set of keys that have a result in the backend"""
+        raise NotImplementedError
+
+    def digest(self, key):
+        """Returns the digest of the blob key points to, or None if the key isn't in the backend"""
+        raise NotImplementedError
+
+    def load(self, key, path):
+        """Downloads the result stored under key to the file path and returns its digest"""
+        raise NotImplementedError
+
+    def save(self, key, path, digest):
+        """Uploads the file path with the given digest and stores it under key"""
+        raise NotImplementedError
+
+    def remove(self, key):
+        raise NotImplementedError
+
+    def list(self):
+        """Returns all keys in the backend"""
+        raise NotImplementedError
+# end CacheBackend
+
+
+def fileDigest(path):
+    digest = newDigest()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024**2), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileBackend(CacheBackend):
+    """Backend in a directory, laid out as refs/<key> files holding digests and blobs/<digest>"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.ref_path = os.path.join(self.path, "refs")
+        self.blob_path = os.path.join(self.path, "blobs")
+        os.makedirs(self.ref_path, exist_ok=True)
+        os.makedirs(self.blob_path, exist_ok=True)
+
+    def __repr__(self):
+        return f"FileBackend({self.path})"
+
+    def tempName(self, directory):
+        return os.path.join(directory, f".tmp-{os.getpid()}-{threading.get_ident()}")
+
+    def existsMany(self, keys):
+        with os.scandir(self.ref_path) as entries:
+            present = set(entry.name for entry in entries)
+        return set(keys) & present
+
+    def digest(self, key):
+        try:
+            with open(os.path.join(self.ref_path, key)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def load(self, key, path):
+        digest = self.digest(key)
+        if digest is None:
+            raise FileNotFoundError(f"{key} is not in {self}")
+        shutil.copyfile(os.path.join(self.blob_path, digest), path)
+        return digest
+
+    def save(self, key, path, digest):
+        blob = os.path.join(self.blob_path, digest)
+        if not os.path.exists(blob):
+            tmp = self.tempName(self.blob_path)
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, blob)
+
+        tmp = self.tempName(self.ref_path)
+        with open(tmp, "w") as f:
+            f.write(digest)
+        os.replace(tmp, os.path.join(self.ref_path, key))
+
+    def remove(self, key):
+        try:
+            os.remove(os.path.join(self.ref_path, key))
+        except FileNotFoundError:
+            pass
+
+    def list(self):
+        with os.scandir(self.ref_path) as entries:
+            return [entry.name for entry in entries if not entry.name.startswith(".tmp-")]
+# end FileBackend
+
+
+class HTTPBackend(CacheBackend):
+    """Backend on a server speaking the protocol described at the top of this file
+
+    Keyword arguments:
+    part_bytes -- Blobs larger than this are uploaded and downloaded in parts of this size, several at a time
+    workers -- Number of parts transferred in parallel
+    batch_size -- Maximum number of keys per existence query
+    timeout -- Seconds to wait for each request
+    """
+
+    def __init__(self, url, part_bytes=16*1024**2, workers=8, batch_size=1000, timeout=60):
+        self.url = url.rstrip("/")
+        self.part_bytes = part_bytes
+        self.workers = workers
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"HTTPBackend({self.url})"
+
+    def getPool(self):
+        with self.pool_lock:
+            if self.pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ndustria-transfer")
+        return self.pool
+
+    def request(self, method, path, data=None, headers={}):
+        """Sends a request and returns (status, headers, body). Returns status 404 instead of raising"""
+        import urllib.request, urllib.error
+
+        req = urllib.request.Request(self.url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return 404, e.headers, b""
+            raise
+
+    def existsMany(self, keys):
+        keys = list(keys)
+        present = set()
+        for i in range(0, len(keys), self.batch_size):
+            body = json.dumps({"keys": keys[i:i + self.batch_size]}).encode()
+            status, headers, reply = self.request(
+                "POST", "/refs/query", body, {"Content-Type": "application/json"}
+            )
+            present.update(json.loads(reply)["present"])
+        return present
+
+    def blobSize(self, digest):
+        """Size of a blob in bytes, or None if the server doesn't have it"""
+        status, headers, body = self.request("HEAD", f"/blobs/{digest}")
+        if status == 404:
+            return None
+        return int(headers["Content-Length"])
+
+    def digest(self, key):
+        status, headers, body = self.request("GET", f"/refs/{key}")
+        if status == 404:
+            return None
+        return body.decode().strip()
+
+    def load(self, key, path):
+        digest = self.digest(key)
+        if digest is None:
+            raise FileNotFoundError(f"{key} is not in {self}")
+
+        size = self.blobSize(digest)
+        if size is None:
+            raise FileNotFoundError(f"{key} points to blob {digest} which is not in {self}")
+
+        if size <= self.part_bytes:
+            status, headers, body = self.request("GET", f"/blobs/{digest}")
+            with open(path, "wb") as f:
+                f.write(body)
+        else:
+            # ranged requests in parallel, each written at its offset
+            with open(path, "wb") as f:
+                f.truncate(size)
+
+            def fetch(start):
+                last = min(start + self.part_bytes, size) - 1
+                status, headers, body = self.request(
+                    "GET", f"/blobs/{digest}", headers={"Range": f"bytes={start}-{last}"}
+                )
+                with open(path, "r+b") as f:
+                    f.seek(start)
+                    f.write(body)
+
+            list(self.getPool().map(fetch, range(0, size, self.part_bytes)))
+
+        if fileDigest(path) != digest:
+            raise IOError(f"Downloaded blob {digest} of {key} from {self} is corrupt")
+
+        return digest
+
+    def save(self, key, path, digest):
+
+        if self.blobSize(digest) is None:
+            size = os.path.getsize(path)
+
+            if size <= self.part_bytes:
+                with open(path, "rb") as f:
+                    self.request("PUT", f"/blobs/{digest}", f.read())
+            else:
+                def upload(part):
+                    with open(path, "rb") as f:
+                        f.seek(part * self.part_bytes)
+                        self.request("PUT", f"/uploads/{digest}/{part}", f.read(self.part_bytes))
+
+                num_parts = (size + self.part_bytes - 1) // self.part_bytes
+                list(self.getPool().map(upload, range(num_parts)))
+                self.request("POST", f"/uploads/{digest}?parts={num_parts}", b"")
+
+        self.request("PUT", f"/refs/{key}", digest.encode())
+
+    def remove(self, key):
+        self.request("DELETE", f"/refs/{key}")
+
+    def list(self):
+        status, headers, body = self.request("GET", "/refs")
+        return json.loads(body)
+# end HTTPBackend
+
+
+def getBackend(spec):
+    """Returns the backend for a remote_cache argument: a CacheBackend, a URL or a directory"""
+    if isinstance(spec, CacheBackend):
+        return spec
+    if spec.startswith("http://") or spec.startswith("https://"):
+        return HTTPBackend(spec)
+    return FileBackend(spec)
+
+
+class MockCacheServer:
+    """In memory HTTP cache server for tests and local use
+
+        server = MockCacheServer().start()
+        pipe = Pipeline(remote_cache=server.url)
+        ...
+        server.stop()
+
+    requests counts the requests received by method and endpoint, e.g. ("POST", "refs")
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.refs = {}
+        self.blobs = {}
+        self.parts = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        from http.server import ThreadingHTTPServer
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.makeHandler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serveForever(self):
+        from http.server import ThreadingHTTPServer
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.makeHandler())
+        self.httpd.serve_forever()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def makeHandler(self):
+        from http.server import BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=b"", headers={}):
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                if "Content-Length" not in headers:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def route(self):
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                with server.lock:
+                    counter = (self.command, parts[0])
+                    server.requests[counter] = server.requests.get(counter, 0) + 1
+                return parts, parse_qs(url.query)
+
+            def body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_GET(self):
+                parts, query = self.route()
+
+                if parts == ["refs"]:
+                    with server.lock:
+                        return self.reply(200, json.dumps(list(server.refs)).encode())
+
+                if parts[0] == "refs" and len(parts) == 2:
+                    digest = server.refs.get(parts[1])
+                    if digest is None:
+                        return self.reply(404)
+                    return self.reply(200, digest.encode())
+
+                if parts[0] == "blobs" and len(parts) == 2:
+                    blob = server.blobs.get(parts[1])
+                    if blob is None:
+                        return self.reply(404)
+
+                    byte_range = self.headers.get("Range")
+                    if byte_range is None:
+                        return self.reply(200, blob)
+
+                    first, last = byte_range.replace("bytes=", "").split("-")
+                    first, last = int(first), min(int(last), len(blob) - 1)
+                    return self.reply(206, blob[first:last + 1], {
+                        "Content-Range": f"bytes {first}-{last}/{len(blob)}",
+                        "Content-Length": str(last - first + 1),
+                    })
+
+                self.reply(404)
+
+            def do_HEAD(self):
+                parts, query = self.route()
+
+                if parts[0] == "blobs" and len(parts) == 2:
+                    blob = server.blobs.get(parts[1])
+                    if blob is None:
+                        return self.reply(404)
+                    return self.reply(200, headers={"Content-Length": str(len(blob))})
+
+                self.reply(404)
+
+            def do_PUT(self):
+                parts, query = self.route()
+                data = self.body()
+
+                if parts[0] == "refs" and len(parts) == 2:
+                    digest = data.decode().strip()
+                    if digest not in server.blobs:
+                        return self.reply(409, b"unknown blob")
+                    with server.lock:
+                        server.refs[parts[1]] = digest
+                    return self.reply(204)
+
+                if parts[0] == "blobs" and len(parts) == 2:
+                    if newDigest(data).hexdigest() != parts[1]:
+                        return self.reply(400, b"digest mismatch")
+                    with server.lock:
+                        server.blobs[parts[1]] = data
+                    return self.reply(201)
+
+                if parts[0] == "uploads" and len(parts) == 3:
+                    with server.lock:
+                        server.parts[(parts[1], int(parts[2]))] = data
+                    return self.reply(204)
+
+                self.reply(404)
+
+            def do_POST(self):
+                parts, query = self.route()
+                data = self.body()
+
+                if parts == ["refs", "query"]:
+                    keys = json.loads(data)["keys"]
+                    present = [k for k in keys if k in server.refs]
+                    return self.reply(200, json.dumps({"present": present}).encode())
+
+                if parts[0] == "uploads" and len(parts) == 2:
+                    digest = parts[1]
+                    num_parts = int(query["parts"][0])
+                    with server.lock:
+                        try:
+                            blob = b"".join(server.parts.pop((digest, i)) for i in range(num_parts))
+                        except KeyError:
+                            return self.reply(400, b"missing parts")
+                    if newDigest(blob).hexdigest() != digest:
+                        return self.reply(400, b"digest mismatch")
+                    with server.lock:
+                        server.blobs[digest] = blob
+                    return self.reply(201)
+
+                self.reply(404)
+
+            def do_DELETE(self):
+                parts, query = self.route()
+
+                if parts[0] == "refs" and len(parts) == 2:
+                    with server.lock:
+                        server.refs.pop(parts[1], None)
+                    return self.reply(204)
+
+                self.reply(404)
+
+        return Handler
+    # end makeHandler
+# end MockCacheServer
@@ -1,16 +1,159 @@
-import pickle, os
-from tabulate import tabulate
-from .Logger import log, error, setLogFile
+import pickle, os, sys, time, hashlib, shutil, threading, socket
+from .Logger import log, warn, error, setLogFile
+from .Writer import AsyncWriter
+from .File import FingerprintStore, resultFile, FINGERPRINT_FILE, directoryManifest, manifestDigest
+from .Artifact import ARTIFACT_DIR, ResultUnpickler, storedResult, artifactBytes
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks on Windows, where processes sharing a cache may lose each other's table entries
+    fcntl = None
 # from .Config import load_config
 
-# including numpy support
-import numpy as np
-
 CACHE_PATH = "./temp"
 
+def newDigest(data=b""):
+    """Hash used for the contents of cached results"""
+    return hashlib.blake2b(data, digest_size=16)
+
+class HashingWriter:
+    """File wrapper that computes the digest of everything written through it, 
+    so results can be hashed while they are pickled instead of in a second pass"""
+
+    def __init__(self, f):
+        self.f = f
+        self.hash = newDigest()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.f.write(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+# Results are stored once per unique content in this subdirectory of the cache, 
+# named by their digest. The file for each Task is a hardlink to its blob, so the 
+# link count of a blob is the number of Tasks referencing it (plus the blob itself)
+BLOB_DIR = "blobs"
+
+# Large arrays are stored in chunks in this subdirectory when chunking is turned on, 
+# in a folder named like the file of the Task they belong to. See Chunked.py
+CHUNK_DIR = "chunks"
+
+# Processes about to compute a result claim it with a file in this subdirectory, named like the
+# result, so other processes sharing the cache wait for it instead of computing it too
+CLAIM_DIR = "claims"
+
+# A claim whose file hasn't been touched for this many seconds belongs to a process that died,
+# and may be taken over. Claims are refreshed every LEASE_SECONDS/4 while they are held
+LEASE_SECONDS = 60
+
+class CorruptResultError(Exception):
+    """Raised by Cache.load for results that can't be unpickled, e.g. files truncated by a crash"""
+
+def syncFile(path):
+    """Flushes a file to disk. Works on directories too, except on Windows"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def syncTree(path):
+    """Flushes every file and directory under path to disk, and the entry of path in its parent"""
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            syncFile(os.path.join(dirpath, name))
+        syncFile(dirpath)
+    syncFile(os.path.dirname(os.path.abspath(path)))
+
+def fileDigest(digest, external_file):
+    """Digest of a result that is the path of a file, which changes with the content of the file"""
+    path, fingerprint = external_file
+    return newDigest(f"{digest}{path}{fingerprint}".encode()).hexdigest()
+
+def collectGarbage(cache_path):
+    """Removes blobs that no Task in the cache points to anymore, along with leftover temp files
+    and the chunks and output directories of Tasks without a result.
+
+    Returns the number of bytes freed.
+    """
+    blob_path = os.path.join(cache_path, BLOB_DIR)
+    if not os.path.isdir(blob_path):
+        return 0
+
+    freed = 0
+    with os.scandir(blob_path) as entries:
+        for entry in entries:
+            st = entry.stat()
+
+            # temp files of writes that never finished, give running writers an hour
+            if entry.name.startswith(".tmp-"):
+                unreferenced = time.time() - st.st_mtime > 3600
+            else:
+                unreferenced = st.st_nlink <= 1
+
+            if unreferenced:
+                try:
+                    os.remove(entry.path)
+                    freed += st.st_size
+                except FileNotFoundError:
+                    pass
+
+    # chunk folders of Tasks that were removed from the cache, or of writes that never finished
+    chunk_path = os.path.join(cache_path, CHUNK_DIR)
+    if os.path.isdir(chunk_path):
+        with os.scandir(chunk_path) as entries:
+            for entry in entries:
+                if entry.name.startswith(".tmp-"):
+                    unreferenced = time.time() - entry.stat().st_mtime > 3600
+                else:
+                    unreferenced = not os.path.exists(os.path.join(cache_path, entry.name))
+
+                if unreferenced:
+                    freed += directorySize(entry.path)
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    # output directories of Tasks without a result, skipping those of Tasks that are still running
+    artifact_path = os.path.join(cache_path, ARTIFACT_DIR)
+    if os.path.isdir(artifact_path):
+        with os.scandir(artifact_path) as entries:
+            for entry in entries:
+                unreferenced = (
+                    not os.path.exists(os.path.join(cache_path, entry.name))
+                    and not os.path.exists(os.path.join(cache_path, CLAIM_DIR, entry.name))
+                    and time.time() - entry.stat().st_mtime > 3600
+                )
+
+                if unreferenced:
+                    freed += directorySize(entry.path)
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    return freed
+# end collectGarbage
+
+def directorySize(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.stat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
 class Cache:
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, reset_log=True):
+        """Keyword arguments:
+        reset_log -- If False, the log of the last run in the cache is left alone, e.g. for maintenance commands
+        """
 
         if path == None:
             path = ""
@@ -31,7 +174,50 @@ class Cache:
             print("\nHello! It looks like ndustria has not been setup yet.\nPlease run ndustria's first time setup with 'ndustria -s'")
             exit()
 
-        self.setPath(path)
+        # names of the files in the cache directory, filled in by scan().
+        # None means exists() falls back to probing the filesystem for every Task
+        self.path = None
+        self.index = None
+
+        self.setPath(path, reset_log=reset_log)
+
+        # set by setAsync, None means results are written synchronously
+        self.writer = None
+
+        # arrays larger than this many bytes are stored in chunks, None turns chunking off
+        self.chunk_bytes = None
+
+        # shared backend set by setRemote, see Backend.py. remote_index holds the keys known
+        # to be in the backend and remote_checked every key that was looked up already
+        self.remote = None
+        self.remote_index = set()
+        self.remote_checked = set()
+        self.remote_deferred = False
+
+        # results downloaded on prefetch threads update the table too
+        self.table_lock = threading.Lock()
+
+        # results of Tasks that may have another copy running are only committed if no
+        # other copy saved them first, see Speculation.py
+        self.exclusive = set()
+
+        # files whose exclusive commit lost to another copy
+        self.lost = set()
+
+        # if True, results are flushed to disk before they are committed, so a crash
+        # can't leave a truncated result behind
+        self.fsync = True
+
+        # directories with new entries that haven't been flushed yet, see syncDirectories
+        self.unsynced = set()
+        self.unsynced_lock = threading.Lock()
+
+        # claim files held by this process by result name, and the thread keeping them fresh
+        self.claims = {}
+        self.claims_lock = threading.Lock()
+        self.heartbeat = None
+        self.token = f"{socket.gethostname()}:{os.getpid()}"
+
         self.headers = [
             "Task",
             "File size (bytes)",
@@ -40,39 +226,164 @@ class Cache:
     # end init
 
 
+    def tableLock(self):
+        """Context manager holding an exclusive lock on the table files, shared by every process using the cache"""
+        from contextlib import contextmanager
+
+        @contextmanager
+        def lock():
+            with open(f"{self.table_file}.lock", "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+        return lock()
+
+    def recordEntry(self, fname, entry):
+        """Adds an entry to the table. Called while holding table_lock.
+
+        Only the entry is appended to the journal next to the table, so saving a result costs 
+        the same however many are in the cache. writeCacheInfo() folds the journal into the 
+        table and cache_info at the end of a run.
+        """
+        self.table[fname] = entry
+
+        record = pickle.dumps((fname, entry))
+        with self.tableLock():
+            with open(self.journal_file, "ab") as journal:
+                journal.write(len(record).to_bytes(8, "little") + record)
+    # end recordEntry
+
     def writeCacheInfo(self):
+        """Saves the table, merged with the entries other processes saved since it was loaded,
+        writes cache_info and empties the journal.
+
+        Processes sharing the cache take turns with an exclusive lock on a lock file next to 
+        the table, and the new table replaces the old one atomically.
+        """
+        from tabulate import tabulate
+
+        with self.tableLock():
+            merged = self.readTable()
+            merged.update(self.table)
+            self.table = merged
+
+            table_out = []
+
+            for k,v in self.table.items():
+                table_out.append([v[0], v[1] + artifactBytes(v), k])
+
+            tmp_info = f"{self.info_file}.tmp-{os.getpid()}"
+            with open(tmp_info, "w") as info:
+                info.write(f"\nCache location: {self.path}\n\n")
+                info.write(tabulate(table_out, headers=self.headers))
+                info.write("\n")
+            os.replace(tmp_info, self.info_file)
+
+            tmp_table = f"{self.table_file}.tmp-{os.getpid()}"
+            with open(tmp_table, "wb") as cache_data:
+                pickle.dump(self.table, cache_data)
+            os.replace(tmp_table, self.table_file)
+
+            # everything in it is in the table now
+            with open(self.journal_file, "wb"):
+                pass
+    # end writeCacheInfo
 
-        table_out = []
 
-        for k,v in self.table.items():
-            table_out.append([v[0], v[1], k])
+    def scan(self, comm=None):
+        """Lists the cache directory once so exists() becomes an in memory lookup instead of a stat per Task.
 
-        with open(self.info_file, "w") as info:
-            info.write(f"\nCache location: {self.path}\n\n")
-            info.write(tabulate(table_out, headers=self.headers))
-            info.write("\n")
+        If an MPI communicator is given, only its rank 0 reads the directory and the 
+        result is broadcast to the other ranks.
+        """
+        index = None
+        if comm is None or comm.Get_rank() == 0:
+            with os.scandir(self.path) as entries:
+                index = set(entry.name for entry in entries)
 
-        with open(self.table_file, "wb") as cache_data:
-            pickle.dump(self.table, cache_data)
-    # end writeCacheInfo
+        if comm is not None:
+            index = comm.bcast(index, root=0)
 
+        self.index = index
+    # end scan
 
     def exists(self, task):
-        cache_fname = os.path.join(self.path, task.getFilename())
+        start = time.perf_counter()
 
-        cache_hit = os.path.exists(cache_fname)
-        
+        if self.index is not None:
+            cache_hit = task.getFilename() in self.index
+        else:
+            cache_fname = os.path.join(self.path, task.getFilename())
+            cache_hit = os.path.exists(cache_fname)
+
+        # the result is stale, and must not be picked up by anyone else either
+        if cache_hit and not self.fileUnchanged(task):
+            self.remove(task)
+            cache_hit = False
+
+        if not cache_hit and self.remote is not None:
+            cache_hit = self.existsRemote(task.getFilename())
+
+        task.metrics.add("probe", time.perf_counter() - start)
         return cache_hit 
     # end exists
 
+    def fileUnchanged(self, task):
+        """False if a Task's result is a file that was changed or deleted since the result was saved"""
+        entry = self.table.get(task.getFilename())
+        if entry is None or len(entry) < 4 or entry[3] is None:
+            return True
+
+        path, fingerprint = entry[3]
+        if self.fingerprints.fingerprint(os.path.join(self.path, path)) == fingerprint:
+            return True
+
+        log(f"{path}, the result of {task.getString()}, changed since it was saved, removed the cached result")
+        return False
+    # end fileUnchanged
+
+    def onDisk(self, task):
+        """Checks the filesystem directly for a Task's result, which another job may have saved 
+        after this cache was scanned. Updates the index if it's there
+        """
+        fname = task.getFilename()
+        if fname is None or not os.path.exists(os.path.join(self.path, fname)):
+            return False
+
+        if self.index is not None:
+            self.index.add(fname)
+        return True
+    # end onDisk
+
     def load(self, task):
         
         cache_fname = os.path.join(self.path, task.getFilename())
 
+        if self.remote is not None and not os.path.exists(cache_fname):
+            self.fetch(task)
+
         # if we have a previous result, serve that up
         try:
+            start = time.perf_counter()
             with open(cache_fname, 'rb') as f:
-                result = pickle.load(f)
+                try:
+                    result = ResultUnpickler(f, self.path).load()
+                except (EOFError, pickle.UnpicklingError) as e:
+                    # e.g. truncated by a crash while it was written by an older version of ndustria
+                    self.remove(task)
+                    raise CorruptResultError(f"The cached result {cache_fname} is damaged ({type(e).__name__} {e}) and was removed")
+                nbytes = f.tell()
+            task.metrics.add("load", time.perf_counter() - start, nbytes)
+
+            # results with chunked arrays need to know where to read the chunks from.
+            # If the Chunked module was never imported, unpickling didn't create any
+            chunked = sys.modules.get(f"{__package__}.Chunked")
+            if chunked is not None:
+                chunked.attachChunks(result, self.path)
         except FileNotFoundError as e:
             error(f"""No cache result found for {cache_fname}.
 Task Information:
@@ -84,48 +395,482 @@ Task Information:
             return result
     # end load
 
+    def setAsync(self, max_pending=4, max_bytes=2*1024**3):
+        """Makes save() hand results to a background writer thread. See Writer.py"""
+        if self.writer is None:
+            self.writer = AsyncWriter(self.write, max_pending=max_pending, max_bytes=max_bytes)
+    # end setAsync
+
     def save(self, task):
+        """Saves the result of a Task to the Cache, in the background if async writes are turned on"""
+        if self.writer is None:
+            self.write(task)
+        else:
+            self.writer.submit(task)
+    # end save
+
+    def wait(self):
+        """Blocks until all pending background writes have finished, and flushes their directory entries"""
+        if self.writer is not None:
+            for task, e in self.writer.wait():
+                error(f"Failed to save result to the cache: {type(e).__name__} {e}", fatal=False, task=task)
+
+        self.syncDirectories()
+    # end wait
+
+    def syncDirectories(self):
+        """Flushes the directories results were added to since the last call.
+
+        Saving a result only flushes the result itself. The entry pointing at it is flushed
+        here, once for a whole batch of results, instead of after every one.
+        """
+        with self.unsynced_lock:
+            directories, self.unsynced = self.unsynced, set()
+
+        for path in directories:
+            syncFile(path)
+    # end syncDirectories
+
+    def write(self, task):
+        try:
+            self.writeResult(task)
+        finally:
+            self.release(task)
+    # end write
+
+    def writeResult(self, task):
 
         fname = task.getFilename()
 
         if fname == "no_result":
+            task.digest = newDigest(b"no_result").hexdigest()
             return
 
         cache_fname = os.path.join(self.path, fname)
 
         result = task.getResult()
 
-        result_is_external_file = False
-        if type(result) == str:
-            result_is_external_file = True
+        start = time.perf_counter()
+
+        # Tasks that write a file and return its path are redone if the file changes
+        external_file = None
+        manifest = None
+        to_store = result
+
+        artifact_dir = self.artifactPath(task)
+        if task.artifacts and os.path.isdir(artifact_dir):
+            manifest = directoryManifest(artifact_dir, self.fingerprints)
+            external_file = (os.path.relpath(artifact_dir, self.path), manifestDigest(manifest))
+            to_store = storedResult(result, artifact_dir, self.path)
+
+            # the files are on disk before the result recording them is
+            if self.fsync:
+                syncTree(artifact_dir)
+        else:
+            path = resultFile(result)
+            if path is not None:
+                external_file = (path, self.fingerprints.fingerprint(path))
         
-        with open(cache_fname, 'wb') as f:
-            pickle.dump(task.result, f)
+        if self.chunk_bytes is not None:
+            to_store = self.writeChunks(fname, to_store)
+
+        tmp_fname = os.path.join(self.blob_path, f".tmp-{os.getpid()}-{threading.get_ident()}")
+        with open(tmp_fname, 'wb') as f:
+            writer = HashingWriter(f)
+            pickle.dump(to_store, writer)
+        task.digest = writer.hexdigest()
+
+        if not self.storeBlob(tmp_fname, task.digest, cache_fname):
+            self.lost.add(fname)
+            log(f"Result of {task.getString()} was already saved by another copy of the Task")
+            return
+
+        # the new directory entry is flushed together with the others at the next syncDirectories()
+        if self.fsync:
+            with self.unsynced_lock:
+                self.unsynced.add(self.path)
 
         file_size = os.stat(cache_fname).st_size
-        self.table[os.path.basename(cache_fname)] = (
-            task.getString(),
-            file_size,
-        )
-            
-        self.writeCacheInfo()
-        if result_is_external_file:
-            log(f"Saved result of {task.getString()} to {result}")
+        task.metrics.add("serialize", time.perf_counter() - start, file_size)
+
+        # chunks, output directories and files results point to only live on this machine, 
+        # so those results can't be shared
+        if self.remote is not None and to_store is result and external_file is None:
+            self.upload(task, cache_fname, file_size)
+
+        if self.index is not None:
+            self.index.add(os.path.basename(cache_fname))
+
+        start = time.perf_counter()
+        with self.table_lock:
+            self.recordEntry(os.path.basename(cache_fname), (
+                task.getString(),
+                file_size,
+                task.digest,
+                external_file,
+                manifest,
+            ))
+        task.metrics.add("write", time.perf_counter() - start)
+
+        if manifest is not None:
+            task.digest = fileDigest(task.digest, external_file)
+            log(f"Saved result of {task.getString()} to {cache_fname}, {len(manifest)} files in {artifact_dir}")
+        elif external_file is not None:
+            task.digest = fileDigest(task.digest, external_file)
+            log(f"Saved result of {task.getString()} to {external_file[0]}")
         else:
             log(f"Saved result of {task.getString()} to {cache_fname}")
 
-    # end save
+    # end writeResult
 
 
+    def setRemote(self, backend, defer=False):
+        """Shares results through a backend, see Backend.py.
+
+        If defer is True, exists() only consults keys already found by probeRemote() 
+        instead of querying the backend for each Task, until probeRemote is called.
+        """
+        self.remote = backend
+        self.remote_deferred = defer
+    # end setRemote
+
+    def existsRemote(self, fname):
+        if fname in self.remote_index:
+            return True
+        if self.remote_deferred or fname in self.remote_checked:
+            return False
+
+        self.remote_checked.add(fname)
+        try:
+            found = self.remote.exists(fname)
+        except Exception as e:
+            error(f"Could not query the remote cache {self.remote}: {type(e).__name__} {e}", fatal=False)
+            return False
+
+        if found:
+            self.remote_index.add(fname)
+        return found
+    # end existsRemote
+
+    def probeRemote(self, fnames):
+        """Looks up many keys in the remote cache with batched queries.
+
+        Returns the set of keys found there. Afterwards exists() queries the backend
+        directly for keys it hasn't seen yet.
+        """
+        self.remote_deferred = False
+
+        fnames = [f for f in fnames if f not in self.remote_checked]
+        if len(fnames) == 0:
+            return set()
+
+        self.remote_checked.update(fnames)
+        try:
+            found = self.remote.existsMany(fnames)
+        except Exception as e:
+            error(f"Could not query the remote cache {self.remote}: {type(e).__name__} {e}", fatal=False)
+            return set()
+
+        self.remote_index.update(found)
+        return found
+    # end probeRemote
+
+    def remoteDigest(self, fname):
+        """Digest of a result in the remote cache, or None if it can't be found there"""
+        try:
+            return self.remote.digest(fname)
+        except Exception as e:
+            error(f"Could not query the remote cache {self.remote}: {type(e).__name__} {e}", fatal=False)
+            return None
+    # end remoteDigest
+
+    def fetch(self, task):
+        """Downloads a Task's result from the remote cache into the local one"""
+        fname = task.getFilename()
+        cache_fname = os.path.join(self.path, fname)
+        tmp_fname = os.path.join(self.blob_path, f".tmp-{os.getpid()}-{threading.get_ident()}")
+
+        start = time.perf_counter()
+        try:
+            digest = self.remote.load(fname, tmp_fname)
+        except Exception as e:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            error(f"Could not download {fname} from the remote cache {self.remote}: {type(e).__name__} {e}", fatal=False, task=task)
+            return
+
+        file_size = os.stat(tmp_fname).st_size
+        self.storeBlob(tmp_fname, digest, cache_fname)
+        task.metrics.add("load", time.perf_counter() - start)
+
+        if self.index is not None:
+            self.index.add(fname)
+
+        with self.table_lock:
+            self.recordEntry(fname, (task.getString(), file_size, digest))
+
+        log(f"Downloaded result of {task.getString()} from {self.remote}")
+    # end fetch
+
+    def upload(self, task, cache_fname, file_size=0):
+        start = time.perf_counter()
+        try:
+            self.remote.save(task.getFilename(), cache_fname, task.digest)
+        except Exception as e:
+            error(f"Could not upload result to the remote cache {self.remote}: {type(e).__name__} {e}", fatal=False, task=task)
+            return
+
+        self.remote_index.add(task.getFilename())
+        task.metrics.add("upload", time.perf_counter() - start, file_size)
+    # end upload
+
+    def writeChunks(self, fname, result):
+        """Stores the large arrays in result in chunks and returns what should be pickled in its place"""
+        from .Chunked import chunkResult
+
+        final_dir = os.path.join(self.chunk_path, fname)
+        tmp_dir = os.path.join(self.chunk_path, f".tmp-{fname}-{os.getpid()}-{threading.get_ident()}")
+
+        to_store = chunkResult(result, tmp_dir, f"{CHUNK_DIR}/{fname}", self.chunk_bytes)
+
+        if to_store is result:
+            shutil.rmtree(final_dir, ignore_errors=True)
+            return result
+
+        # the chunks are in place before the pickle pointing at them is
+        if self.fsync:
+            syncTree(tmp_dir)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+        if self.fsync:
+            syncFile(self.chunk_path)
+        return to_store
+    # end writeChunks
+
+    def getDigest(self, task):
+        """Returns the digest of a Task's cached result. 
+
+        Looks it up in the cache table, or hashes the file if it isn't recorded there, 
+        e.g. because it was written by another process. Results that are only in the remote
+        cache are not downloaded, the backend knows their digest.
+        """
+        fname = task.getFilename()
+
+        if fname == "no_result":
+            return newDigest(b"no_result").hexdigest()
+
+        entry = self.table.get(fname)
+        if entry is not None and len(entry) > 3 and entry[3] is not None:
+            return fileDigest(entry[2], entry[3])
+        if entry is not None and len(entry) > 2 and entry[2] is not None:
+            return entry[2]
+
+        cache_fname = os.path.join(self.path, fname)
+        if self.remote is not None and not os.path.exists(cache_fname):
+            digest = self.remoteDigest(fname)
+            if digest is not None:
+                return digest
+
+        digest = newDigest()
+        with open(cache_fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024**2), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    # end getDigest
+
+    def storeBlob(self, tmp_fname, digest, cache_fname):
+        """Moves a freshly written result into the blob store and points cache_fname at it.
+
+        If a blob with the same digest already exists, the new copy is thrown away and the
+        Task's file becomes another link to the existing one. Falls back to a plain file if
+        the filesystem doesn't support hardlinks.
+
+        If cache_fname is in self.exclusive, only the first copy of a Task to create its 
+        commit file (see Speculation.py) stores its result, and an existing cache_fname is left alone. The 
+        new copy is thrown away otherwise.
+        Returns False if that happened, True if cache_fname now holds the new result.
+        """
+        blob = os.path.join(self.blob_path, digest)
+
+        # the data is on disk before anything points at it
+        if self.fsync:
+            syncFile(tmp_fname)
+
+        try:
+            os.link(tmp_fname, blob)
+        except FileExistsError:
+            # identical result already stored
+            pass
+        except OSError:
+            os.replace(tmp_fname, cache_fname)
+            return True
+
+        if cache_fname in self.exclusive:
+            from .Speculation import commitFile, processName
+
+            # the first copy to create the commit file wins, and names itself in it
+            try:
+                with open(commitFile(self, cache_fname), "x") as f:
+                    f.write(processName(os.getpid()))
+            except FileExistsError:
+                os.remove(tmp_fname)
+                return False
+
+            # linking fails if the entry exists, so a result saved by another process stays
+            try:
+                os.link(blob, cache_fname)
+                won = True
+            except FileExistsError:
+                won = False
+            except OSError:
+                # the blob was garbage collected in the meantime
+                os.replace(tmp_fname, cache_fname)
+                return True
+            os.remove(tmp_fname)
+            return won
+
+        # link under a temp name first so an existing entry is replaced atomically
+        entry_tmp = f"{tmp_fname}-entry"
+        try:
+            os.link(blob, entry_tmp)
+        except OSError:
+            # the blob was garbage collected in the meantime
+            os.replace(tmp_fname, cache_fname)
+            return True
+
+        os.replace(entry_tmp, cache_fname)
+        os.remove(tmp_fname)
+        return True
+    # end storeBlob
+
+    def claim(self, task):
+        """Claims the right to compute a Task's result, so other processes sharing the cache don't compute it too.
+
+        Returns True if this process now holds the claim, False if another live process does.
+        Claims are released by write() once the result is saved, or by release(). A claim 
+        that hasn't been refreshed for LEASE_SECONDS is taken over.
+        """
+        fname = task.getFilename()
+        if fname is None or fname in self.claims:
+            return True
+
+        claim_fname = os.path.join(self.claim_path, fname)
+        token = f"{self.token}:{threading.get_ident()}:{time.time()}"
+
+        for attempt in range(2):
+            try:
+                fd = os.open(claim_fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.stat(claim_fname).st_mtime
+                except FileNotFoundError:
+                    # released in the meantime
+                    continue
+
+                if age < LEASE_SECONDS:
+                    return False
+
+                # the holder died. Renaming the stale claim away succeeds for only one process
+                try:
+                    os.rename(claim_fname, f"{claim_fname}.stale-{os.getpid()}")
+                    os.remove(f"{claim_fname}.stale-{os.getpid()}")
+                    warn(f"Taking over the claim on {task.getString()} of a process that stopped responding")
+                except FileNotFoundError:
+                    pass
+                continue
+
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+
+            with self.claims_lock:
+                self.claims[fname] = (claim_fname, token)
+            self.startHeartbeat()
+            return True
+
+        return False
+    # end claim
+
+    def release(self, task):
+        """Gives up this process's claim on a Task, if it holds one"""
+        fname = task.getFilename()
+
+        with self.claims_lock:
+            held = self.claims.pop(fname, None)
+        if held is None:
+            return
+
+        claim_fname, token = held
+        try:
+            # only if it's still ours, the lease may have been taken over
+            with open(claim_fname, "r") as f:
+                if f.read() != token:
+                    return
+            os.remove(claim_fname)
+        except FileNotFoundError:
+            pass
+    # end release
+
+    def startHeartbeat(self):
+        """Starts the thread that keeps the claims of this process from going stale"""
+        if self.heartbeat is not None and self.heartbeat.is_alive():
+            return
+
+        def refresh():
+            while True:
+                time.sleep(LEASE_SECONDS / 4)
+                with self.claims_lock:
+                    held = list(self.claims.values())
+                for claim_fname, token in held:
+                    try:
+                        os.utime(claim_fname)
+                    except FileNotFoundError:
+                        pass
+
+        self.heartbeat = threading.Thread(target=refresh, name="ndustria-claims", daemon=True)
+        self.heartbeat.start()
+    # end startHeartbeat
+
     def remove(self, task):
         cache_fname = os.path.join(self.path, task.getFilename())
         try: 
             os.remove(cache_fname)
         except FileNotFoundError as e:
             pass
+
+        if self.index is not None:
+            self.index.discard(task.getFilename())
+
+        # drop the blob too if this was the last Task pointing at it
+        entry = self.table.get(task.getFilename())
+        if entry is not None and len(entry) > 2 and entry[2] is not None:
+            blob = os.path.join(self.blob_path, entry[2])
+            try:
+                if os.stat(blob).st_nlink <= 1:
+                    os.remove(blob)
+            except FileNotFoundError:
+                pass
+
+        shutil.rmtree(os.path.join(self.chunk_path, task.getFilename()), ignore_errors=True)
+        shutil.rmtree(self.artifactPath(task), ignore_errors=True)
     # end remove
 
-    def setPath(self, new_path=None):
+    def artifactPath(self, task):
+        """The output directory of a Task, see Artifact.py"""
+        return os.path.join(self.artifact_path, task.getFilename())
+
+    def artifactDir(self, task, clear=True):
+        """Creates the output directory of a Task and returns its path. Files left by an earlier run are removed if clear"""
+        path = self.artifactPath(task)
+        if clear:
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def gc(self):
+        """Removes stored results that no Task points to anymore. Returns the number of bytes freed"""
+        return collectGarbage(self.path)
+
+    def setPath(self, new_path=None, reset_log=True):
 
         # if no new path, just reset the old one
         if new_path == None:
@@ -149,19 +894,40 @@ Task Information:
         # end touchDir
 
 
+        # the index of a different directory is no use
+        if self.path != os.path.abspath(new_path):
+            self.index = None
+
         self.path = os.path.abspath(new_path)
         touchDir(self.path)
 
+        self.blob_path = os.path.join(self.path, BLOB_DIR)
+        touchDir(self.blob_path)
+
+        self.chunk_path = os.path.join(self.path, CHUNK_DIR)
+        touchDir(self.chunk_path)
+
+        self.claim_path = os.path.join(self.path, CLAIM_DIR)
+        touchDir(self.claim_path)
+
+        self.artifact_path = os.path.join(self.path, ARTIFACT_DIR)
+        touchDir(self.artifact_path)
+
         self.info_file = os.path.join(self.path, "cache_info")
         touch(self.info_file)
 
         
         self.log_file = os.path.join(self.path, "last_run.log")
-        setLogFile(self.log_file)
-        touch(self.log_file)
+        if reset_log:
+            setLogFile(self.log_file)
+            touch(self.log_file)
+
+        # fingerprints of the files Tasks take as arguments or return, see File.py
+        self.fingerprints = FingerprintStore(os.path.join(self.path, FINGERPRINT_FILE))
 
         self.table_file = os.path.join(self.path, "cache_data")
         touch(self.table_file)
+        self.journal_file = f"{self.table_file}.journal"
         self.loadTable()
 
     # end setPath
@@ -170,18 +936,57 @@ Task Information:
     def loadTable(self):
 
         try:
-            with open(self.table_file, 'rb') as f:
-                #log(f"Reloading cache state from {self.table_file}")
-                self.table = pickle.load(f)
-        except EOFError as eof:
-            # There's nothing in the file (probably because it was just created)
-            # so initialize the table to an empty dictionary and move on
-            self.table = {}
+            self.table = self.readTable()
         except FileNotFoundError as fnf:
             error(f"File not found: {self.table_file}. Exiting. ")
 
     # end loadTable
 
+    def readTable(self):
+        """Reads the table from disk, with the entries in the journal. A damaged table is treated 
+        as empty, the results it described are still in the cache"""
+        with open(self.table_file, 'rb') as f:
+            try:
+                table = pickle.load(f)
+            except EOFError:
+                # There's nothing in the file (probably because it was just created)
+                table = {}
+            except (pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                warn(f"The cache table {self.table_file} is damaged, starting a new one")
+                table = {}
+
+        table.update(self.readJournal())
+        return table
+    # end readTable
+
+    def readJournal(self):
+        """Entries appended by recordEntry() since the table was last written"""
+        entries = {}
+        try:
+            with open(self.journal_file, 'rb') as f:
+                while True:
+                    header = f.read(8)
+                    if len(header) < 8:
+                        break
+                    record = f.read(int.from_bytes(header, "little"))
+                    try:
+                        fname, entry = pickle.loads(record)
+                    except Exception:
+                        # cut off by a crash while it was appended
+                        break
+                    entries[fname] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+    # end readJournal
+
+    def sizeOf(self, task):
+        """Size of a Task's result in the cache in bytes, 0 if it isn't there"""
+        try:
+            return os.stat(self.getFullPathToTask(task)).st_size
+        except FileNotFoundError:
+            return 0
+
     def getFullPathToTask(self, task):
 
         return os.path.join(self.path, task.getFilename())
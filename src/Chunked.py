@@ -0,0 +1,254 @@
+"""
+Chunked storage of large array results
+
+When a Pipeline is created with chunk_bytes set, numpy arrays larger than chunk_bytes that a
+Task returns (directly, as values of a dict, or as attributes of an object like Simulation)
+are not pickled together with the rest of the result. Instead they are split along their
+first axis into .npy chunks of about chunk_bytes each, stored in the chunks/ folder of the
+cache, and replaced in the pickled result by a small ChunkedArray manifest.
+
+When the result is loaded, each ChunkedArray acts as a lazy proxy for the array: indexing it
+only reads the chunks that contain the requested rows (in parallel threads), and anything
+else, like attribute access, numpy functions or arithmetic, loads the full array once.
+
+    sim = run_simulation(ics, sim)     # sim.pos has shape (Nt, N, 3)
+    ...
+    sim.pos[-1]                        # only reads the chunk with the last timestep
+"""
+
+import copy, os, threading
+import numpy as np
+
+READ_THREADS = 8
+"""Number of threads used to read chunks in parallel"""
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _readPool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _pool = ThreadPoolExecutor(max_workers=READ_THREADS, thread_name_prefix="ndustria-chunks")
+    return _pool
+
+
+class ChunkedArray:
+    """Lazy proxy for an array stored in chunks along its first axis"""
+
+    def __init__(self, directory, shape, dtype, chunk_rows, digests):
+        """Arguments:
+        directory -- Folder holding the chunks, relative to the cache directory
+        shape, dtype -- Shape and dtype of the full array
+        chunk_rows -- Number of rows (entries along the first axis) per chunk
+        digests -- Digest of each chunk, so the pickled manifest changes whenever the data does
+        """
+        self.directory = directory
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self.digests = digests
+
+        # set by attachChunks when the result is loaded from the cache
+        self.root = None
+        self._full = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["root"] = None
+        state["_full"] = None
+        return state
+
+    def __repr__(self):
+        return f"ChunkedArray(shape={self.shape}, dtype={self.dtype}, chunks={len(self.digests)})"
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def chunkPath(self, i):
+        return os.path.join(self.root, self.directory, f"{i}.npy")
+
+    def readChunks(self, chunk_indices):
+        """Memory maps the given chunks, opening them on parallel threads"""
+        if self.root is None:
+            raise RuntimeError(f"{self} was not loaded from a cache")
+
+        def read(i):
+            return np.load(self.chunkPath(i), mmap_mode="r")
+
+        if len(chunk_indices) == 1:
+            return [read(chunk_indices[0])]
+        return list(_readPool().map(read, chunk_indices))
+
+    def toArray(self):
+        """Loads the full array. It is kept in memory afterwards"""
+        if self._full is None:
+            chunks = self.readChunks(list(range(len(self.digests))))
+            pool = _readPool()
+            self._full = np.concatenate(list(pool.map(np.array, chunks)), axis=0)
+        return self._full
+
+    def __array__(self, dtype=None, copy=None):
+        full = self.toArray()
+        if dtype is not None:
+            return full.astype(dtype)
+        return full
+
+    def __getitem__(self, key):
+
+        if self._full is not None:
+            return self._full[key]
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+
+        if isinstance(first, (int, np.integer)):
+            i = int(first)
+            if i < 0:
+                i += self.shape[0]
+            if i < 0 or i >= self.shape[0]:
+                raise IndexError(f"index {first} is out of bounds for axis 0 with size {self.shape[0]}")
+
+            c = i // self.chunk_rows
+            chunk = self.readChunks([c])[0]
+            return np.array(chunk[(i - c * self.chunk_rows,) + rest])
+
+        if isinstance(first, slice):
+            rows = np.arange(*first.indices(self.shape[0]))
+            if len(rows) == 0:
+                return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+
+            # chunks in the order their rows appear in the slice
+            chunk_of_row = rows // self.chunk_rows
+            needed = list(dict.fromkeys(chunk_of_row.tolist()))
+            chunks = self.readChunks(needed)
+
+            pieces = [
+                chunk[rows[chunk_of_row == c] - c * self.chunk_rows]
+                for c, chunk in zip(needed, chunks)
+            ]
+            return np.concatenate(pieces, axis=0)[(slice(None),) + rest]
+
+        # fancy indexing, Ellipsis, masks, ...
+        return self.toArray()[key]
+
+    def __iter__(self):
+        for c in range(len(self.digests)):
+            for row in self.readChunks([c])[0]:
+                yield np.array(row)
+
+    def __getattr__(self, name):
+        # only called for attributes ChunkedArray doesn't have itself
+        if name.startswith("_") or name in ("root", "directory"):
+            raise AttributeError(name)
+        return getattr(self.toArray(), name)
+# end ChunkedArray
+
+def _delegate(name):
+    def method(self, *args):
+        return getattr(self.toArray(), name)(*args)
+    method.__name__ = name
+    return method
+
+for _name in [
+    "__add__", "__radd__", "__sub__", "__rsub__", "__mul__", "__rmul__",
+    "__truediv__", "__rtruediv__", "__floordiv__", "__rfloordiv__", "__pow__", "__rpow__",
+    "__matmul__", "__rmatmul__", "__neg__", "__abs__",
+    "__lt__", "__le__", "__gt__", "__ge__", "__eq__", "__ne__",
+]:
+    setattr(ChunkedArray, _name, _delegate(_name))
+ChunkedArray.__hash__ = None
+
+
+def isLarge(value, chunk_bytes):
+    return (
+        isinstance(value, np.ndarray)
+        and value.ndim >= 1
+        and value.dtype != object
+        and value.nbytes > chunk_bytes
+    )
+
+
+def writeChunks(array, write_dir, stored_dir, chunk_bytes):
+    """Writes an array to write_dir in chunks and returns the ChunkedArray describing it"""
+    from .Cache import newDigest
+
+    os.makedirs(write_dir, exist_ok=True)
+
+    row_bytes = max(array.nbytes // max(array.shape[0], 1), 1)
+    chunk_rows = max(chunk_bytes // row_bytes, 1)
+
+    digests = []
+    for i, start in enumerate(range(0, array.shape[0], chunk_rows)):
+        chunk = np.ascontiguousarray(array[start:start + chunk_rows])
+        np.save(os.path.join(write_dir, f"{i}.npy"), chunk)
+        digests.append(newDigest(chunk.data).hexdigest())
+
+    return ChunkedArray(stored_dir, array.shape, array.dtype.str, chunk_rows, digests)
+
+
+def chunkResult(result, write_dir, stored_dir, chunk_bytes):
+    """Returns a copy of result with every large array replaced by a ChunkedArray written to write_dir.
+
+    Handles a bare array, the values of a dict and the attributes of an object.
+    Returns result itself if there is nothing to chunk. The original is never modified.
+    """
+
+    if isLarge(result, chunk_bytes):
+        return writeChunks(result, os.path.join(write_dir, "a0"), f"{stored_dir}/a0", chunk_bytes)
+
+    if isinstance(result, dict):
+        members = result
+    elif hasattr(result, "__dict__") and not isinstance(result, type):
+        members = vars(result)
+    else:
+        return result
+
+    chunked = {}
+    for i, (k, v) in enumerate(members.items()):
+        if isLarge(v, chunk_bytes):
+            chunked[k] = writeChunks(v, os.path.join(write_dir, f"a{i}"), f"{stored_dir}/a{i}", chunk_bytes)
+
+    if len(chunked) == 0:
+        return result
+
+    if isinstance(result, dict):
+        new_result = dict(result)
+        new_result.update(chunked)
+    else:
+        new_result = copy.copy(result)
+        for k, v in chunked.items():
+            setattr(new_result, k, v)
+
+    return new_result
+
+
+def attachChunks(result, root):
+    """Tells every ChunkedArray in a freshly loaded result where the cache lives"""
+
+    if isinstance(result, ChunkedArray):
+        members = [result]
+    elif isinstance(result, dict):
+        members = result.values()
+    elif hasattr(result, "__dict__") and not isinstance(result, type):
+        members = vars(result).values()
+    else:
+        return
+
+    for v in members:
+        if isinstance(v, ChunkedArray):
+            v.root = root
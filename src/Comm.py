@@ -0,0 +1,78 @@
+"""
+Communicators used by a Pipeline
+
+Parallel Pipelines use MPI.COMM_WORLD from mpi4py. Importing mpi4py initializes MPI, which
+is slow and pointless for serial runs, so serial Pipelines get a SerialComm instead: a stand
+in that implements the handful of communicator methods ndustria uses for a single process.
+
+nodeTopology() finds out which processes share a node and which CPUs they have, so Tasks
+with cores hints can be packed onto nodes without oversubscribing them.
+"""
+
+class SerialComm:
+    """Single process stand in for an MPI communicator"""
+
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return 1
+
+    def Barrier(self):
+        pass
+
+    def bcast(self, obj, root=0):
+        return obj
+
+    def gather(self, obj, root=0):
+        return [obj]
+
+    def allgather(self, obj):
+        return [obj]
+
+    def allreduce(self, obj, op=None):
+        return obj
+# end SerialComm
+
+
+def getComm(parallel):
+    """Returns MPI.COMM_WORLD for parallel Pipelines, a SerialComm otherwise"""
+
+    if not parallel:
+        return SerialComm()
+
+    from mpi4py import MPI
+    return MPI.COMM_WORLD
+
+
+def availableCpus():
+    """Ids of the CPUs this process may run on"""
+    import os
+
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def nodeTopology(comm):
+    """Finds out which processes share a node.
+
+    Returns (node index of each rank, list of the CPU ids available on each node), where the 
+    CPUs of a node are all those any of its processes may run on.
+    """
+    import socket
+
+    info = comm.allgather((socket.gethostname(), availableCpus()))
+
+    names = []
+    nodes = []
+    node_cpus = []
+    for hostname, cpus in info:
+        if hostname not in names:
+            names.append(hostname)
+            node_cpus.append(set())
+        node = names.index(hostname)
+        nodes.append(node)
+        node_cpus[node].update(cpus)
+
+    return nodes, [sorted(cpus) for cpus in node_cpus]
@@ -0,0 +1,252 @@
+"""
+Files as Task arguments and results, identified by their content
+
+Tasks are hashed by the str() of their arguments, so a plain path string only says where a
+file is, not what is in it, and a Task reading it isn't rerun when the file changes. Wrapping
+the path in File makes the content part of the hash:
+
+    @pipe.AddFunction()
+    def load_snapshot(snapshot):
+        with open(snapshot, "rb") as f:   # Files work wherever a path does
+            ...
+
+    load_snapshot(ndustria.File("/data/run42/snap_100.hdf5"))
+
+A Task that writes a file and returns its path as a File gets the same treatment: the
+fingerprint of the file is recorded with the result, and the Task is run again if the file
+was changed or deleted since. Plain str results are never taken for paths, a str that
+happens to name a file (e.g. "." or "README") is just a str.
+
+Hashing the content of large files is slow, so fingerprints are remembered in the cache by
+(device, inode, size, modification time). A file that hasn't changed costs a single stat,
+and only files that did change are read again. The fingerprints a run computes are added to
+the cache when it ends. Directories are fingerprinted by the paths and fingerprints of every
+file in them.
+"""
+
+import contextvars, os, pickle, threading, time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FINGERPRINT_FILE = "fingerprints"
+"""File in the cache directory the fingerprints are remembered in"""
+
+READ_BYTES = 8 * 1024**2
+"""Size of the blocks files are read in while they are hashed"""
+
+RACY_SECONDS = 2.0
+"""Files modified less than this many seconds ago may be modified again without their
+modification time changing, so their fingerprints aren't remembered"""
+
+
+class FingerprintStore:
+    """Content digests of files, remembered by (device, inode, size, modification time)
+
+    Fingerprints of files hashed by this process are kept in memory and only added to the
+    store on disk by flush(), once for the whole batch.
+    """
+
+    def __init__(self, path=None):
+        """Arguments:
+        path -- File the fingerprints are remembered in. If None, they are only kept in memory
+        """
+        self.path = path
+        self.entries = {}
+        self.pending = {}
+        self.loaded = None
+        self.lock = threading.Lock()
+
+    def fingerprint(self, path):
+        """Content digest of a file or directory, or "missing" if there is nothing at path"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return "missing"
+
+        if os.path.isdir(path):
+            return self.directoryFingerprint(path)
+
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+        with self.lock:
+            digest = self.entries.get(key)
+        if digest is not None:
+            return digest
+
+        # other processes may have saved it since the store was read
+        self.refresh()
+        with self.lock:
+            digest = self.entries.get(key)
+        if digest is not None:
+            return digest
+
+        digest = hashContent(path)
+
+        with self.lock:
+            self.entries[key] = digest
+            if time.time() - st.st_mtime > RACY_SECONDS:
+                self.pending[key] = digest
+        return digest
+    # end fingerprint
+
+    def refresh(self):
+        """Reads the store on disk again if it changed since it was last read"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns if self.path is not None else None
+        except FileNotFoundError:
+            mtime = None
+
+        with self.lock:
+            if mtime == self.loaded:
+                return
+            self.loaded = mtime
+
+        entries = self.read()
+        with self.lock:
+            entries.update(self.entries)
+            self.entries = entries
+    # end refresh
+
+    def flush(self):
+        """Adds the fingerprints remembered since the last flush to the store on disk"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if len(pending) == 0 or self.path is None:
+            return
+
+        with self.locked():
+            entries = self.read()
+            entries.update(pending)
+
+            tmp_fname = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_fname, "wb") as f:
+                pickle.dump(entries, f)
+            os.replace(tmp_fname, self.path)
+            loaded = os.stat(self.path).st_mtime_ns
+
+        with self.lock:
+            entries.update(self.entries)
+            self.entries = entries
+            self.loaded = loaded
+    # end flush
+
+    def directoryFingerprint(self, path):
+        return manifestDigest(directoryManifest(path, self))
+
+    def locked(self):
+        """Context manager holding an exclusive lock on the store across processes"""
+
+        @contextmanager
+        def lock():
+            if self.path is None or fcntl is None:
+                yield
+                return
+            with open(f"{self.path}.lock", "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return lock()
+
+    def read(self):
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return {}
+# end FingerprintStore
+
+
+# the store Files look their fingerprints up in, set by usingStore. Tasks use the store of the
+# Cache of their Pipeline, anything else one that's only kept in memory
+_store = contextvars.ContextVar("ndustria_fingerprints", default=None)
+_unsaved = FingerprintStore()
+
+@contextmanager
+def usingStore(store):
+    """Context manager making Files use store while they're hashed"""
+    token = _store.set(store)
+    try:
+        yield
+    finally:
+        _store.reset(token)
+
+def hashContent(path):
+    """Digest of the content of a file"""
+    from .Cache import newDigest
+
+    digest = newDigest()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprintOf(path, store=None):
+    """Fingerprint of a file or directory, looked up in store, or the one set by usingStore"""
+    if store is None:
+        store = _store.get() or _unsaved
+    return store.fingerprint(path)
+
+
+def directoryManifest(path, store=None):
+    """Size and fingerprint of every file in a directory, by path relative to it. See fingerprintOf"""
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, path).replace(os.sep, "/")
+            manifest[rel] = (os.path.getsize(full), fingerprintOf(full, store))
+    return manifest
+
+
+def manifestDigest(manifest):
+    """Fingerprint of a directory from its manifest"""
+    from .Cache import newDigest
+
+    digest = newDigest(b"directory")
+    for rel in sorted(manifest):
+        digest.update(rel.encode() + b"\0")
+        digest.update(manifest[rel][1].encode())
+    return digest.hexdigest()
+
+
+class File:
+    """A path to a file or directory whose content, not just its name, identifies it in Task hashcodes"""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+
+    def __fspath__(self):
+        return self.path
+
+    def fingerprint(self):
+        """Content digest of the file, "missing" if it doesn't exist"""
+        return fingerprintOf(self.path)
+
+    def __str__(self):
+        return f"File({self.path}@{self.fingerprint()})"
+
+    def __repr__(self):
+        return str(self)
+
+    def __eq__(self, other):
+        return isinstance(other, File) and os.path.abspath(self.path) == os.path.abspath(other.path)
+
+    def __hash__(self):
+        return hash(os.path.abspath(self.path))
+# end File
+
+
+def resultFile(result):
+    """The path of the file a Task result points to, or None if it isn't a File"""
+    if isinstance(result, File):
+        return os.path.abspath(result.path)
+    return None
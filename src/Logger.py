@@ -1,70 +1,236 @@
 """
 Creates Functions that are used to create the last_run.log file which is save in the NDUSTRIA_CACHE_DIR
+
+Messages are buffered in memory and written out in batches by a background thread
+instead of opening the log file for every line. In parallel runs every rank writes to its
+own last_run.log.rank<N> file, which the root process merges into last_run.log at the
+end of the run with mergeLogs().
 """
 
-import os
+import os, time, threading, atexit, heapq
 DEBUG = True
 VERBOSE = True
 LOG_FILE = ""
+
+# Log levels. Messages below LOG_LEVEL are dropped
+LEVEL_DEBUG   = 10
+LEVEL_INFO    = 20
+LEVEL_WARNING = 30
+LEVEL_ERROR   = 40
+LEVEL_NAMES = {
+    "debug": LEVEL_DEBUG,
+    "info": LEVEL_INFO,
+    "warning": LEVEL_WARNING,
+    "error": LEVEL_ERROR,
+}
+LOG_LEVEL = LEVEL_INFO
+
+# Buffering: the background thread writes the buffer out every FLUSH_INTERVAL seconds,
+# or sooner if more than FLUSH_LINES messages pile up
+FLUSH_INTERVAL = 1.0
+FLUSH_LINES = 10000
+
+# Summary lines (see tally) are emitted at most once every SUMMARY_INTERVAL seconds
+SUMMARY_INTERVAL = 5.0
+
+# Rank of this process. None for serial runs, in which case messages go straight to LOG_FILE
+LOG_RANK = None
+
+_buffer = []
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_wake = threading.Event()
+_flush_thread = None
+
+_tallies = {}
+_last_summary = 0.0
+
 # Convenience debugger function
-# prints stuff out to log and console with [Debug] in front of it 
+# prints stuff out to log and console with [Debug] in front of it
 # when DEBUG is set to True
-# Should be used when specifically trying to 
+# Should be used when specifically trying to
 # figure out what the fuck is going wrong
 def debug(args):
 
     if not DEBUG: return
 
     msg = "[Debug] " + str(args)
-    log(msg)
+    log(msg, level=LEVEL_DEBUG)
 
-    if VERBOSE == True:
-        print(msg)
-    
 
 # Convenience debugger function
-# prints stuff out to log with [Warning] in front of it 
+# prints stuff out to log with [Warning] in front of it
 # when DEBUG is set to True
 def warn(args):
     msg = "[Warning] " + str(args)
-    log(msg)
-
-    if VERBOSE == True:
-        print(msg)
+    log(msg, level=LEVEL_WARNING)
 
 
 # Convenience error function
-# for when you need to die but also try to explain to the user 
+# for when you need to die but also try to explain to the user
 # why you died
 # outputs to both log and console
 def error(args, fatal=True, task=None):
 
     msg = "[Error] " + str(args)
-    log(msg)
-    print(msg)
+    log(msg, level=LEVEL_ERROR)
+    if not VERBOSE:
+        print(msg)
 
     if task is not None:
         print(task)
 
+    flush()
+
     if fatal:
         exit()
 
 # Convenience error function
 # for reporting on the normal functioning of the code
-def log(msg):
-    global LOG_FILE 
+def log(msg, level=LEVEL_INFO):
+
+    if level < LOG_LEVEL:
+        return
+
+    global LOG_FILE
     if LOG_FILE == "":
         print(msg)
         return
 
-    with open(LOG_FILE, "a+") as log:
-        print(msg, file=log)
+    with _lock:
+        _buffer.append((time.time(), msg))
+        full = len(_buffer) >= FLUSH_LINES
+
+    _startFlushThread()
+    if full:
+        _wake.set()
 
     if VERBOSE == True:
         print(msg)
 
+def isEnabled(level):
+    """True if messages at this level will be logged. Use to skip building expensive messages"""
+    return level >= LOG_LEVEL
+
+def setLogLevel(level):
+    """Sets the minimum level of messages that get logged. Accepts a LEVEL_* constant or its name, e.g. "debug" """
+    global LOG_LEVEL
+    if isinstance(level, str):
+        level = LEVEL_NAMES[level.lower()]
+    LOG_LEVEL = level
+
 def setLogFile(filepath):
-    global LOG_FILE 
+    global LOG_FILE
+    flush()
     LOG_FILE = os.path.abspath(filepath)
     with open(filepath, "w") as log:
-        pass
\ No newline at end of file
+        pass
+
+def setLogRank(rank):
+    """Switches this process over to its own per rank log file, last_run.log.rank<N>"""
+    global LOG_RANK
+    flush()
+    LOG_RANK = rank
+    with open(_rankFile(rank), "w"):
+        pass
+
+def _rankFile(rank):
+    return f"{LOG_FILE}.rank{rank}"
+
+def flush():
+    """Writes all buffered messages to the log file"""
+    global _buffer
+
+    # held for the whole write so batches can't overtake each other
+    with _write_lock:
+        with _lock:
+            lines = _buffer
+            _buffer = []
+
+        if len(lines) == 0 or LOG_FILE == "":
+            return
+
+        if LOG_RANK is None:
+            with open(LOG_FILE, "a+") as log:
+                log.write("".join(f"{msg}\n" for _, msg in lines))
+        else:
+            # per rank files keep the timestamp on every line so they can be merged in order later
+            with open(_rankFile(LOG_RANK), "a+") as log:
+                log.write("".join(
+                    f"{t:.6f} " + str(msg).replace("\n", f"\n{t:.6f} ") + "\n" for t, msg in lines
+                ))
+
+def mergeLogs(num_ranks):
+    """Merges the per rank log files into LOG_FILE in timestamp order and removes them.
+
+    Should only be called by one process, after every rank has called flush().
+    """
+
+    def records(fname):
+        with open(fname, "r") as f:
+            t = 0.0
+            for line in f:
+                stamp, _, msg = line.partition(" ")
+                # continuation lines of multi line messages keep the previous timestamp
+                try:
+                    t = float(stamp)
+                except ValueError:
+                    msg = line
+                yield (t, msg)
+
+    rank_files = [_rankFile(r) for r in range(num_ranks) if os.path.isfile(_rankFile(r))]
+
+    with open(LOG_FILE, "a+") as log:
+        for _, msg in heapq.merge(*[records(f) for f in rank_files], key=lambda r: r[0]):
+            log.write(msg)
+
+    for f in rank_files:
+        os.remove(f)
+
+def tally(category, key="", count=1):
+    """Counts count events instead of logging a line for each, e.g. one per cached Task.
+
+    A running total for each category is logged at most once every SUMMARY_INTERVAL seconds.
+    Call logTallies() to log the final counts.
+    """
+    global _last_summary
+
+    counts = _tallies.setdefault(category, {})
+    counts[key] = counts.get(key, 0) + count
+
+    now = time.time()
+    if now - _last_summary > SUMMARY_INTERVAL:
+        if _last_summary != 0.0:
+            log(f"{category} {sum(counts.values())} Tasks so far")
+        _last_summary = now
+
+def logTallies():
+    """Logs one summary line per category counted with tally() and resets the counts"""
+    global _last_summary
+
+    for category, counts in _tallies.items():
+        details = ", ".join(f"{k}: {v}" for k, v in counts.items() if k != "")
+        msg = f"{category} {sum(counts.values())} Tasks"
+        if details != "":
+            msg += f" ({details})"
+        log(msg)
+
+    _tallies.clear()
+    _last_summary = 0.0
+
+def _startFlushThread():
+    global _flush_thread
+
+    if _flush_thread is not None:
+        return
+
+    def flush_loop():
+        while True:
+            _wake.wait(FLUSH_INTERVAL)
+            _wake.clear()
+            flush()
+
+    _flush_thread = threading.Thread(target=flush_loop, name="ndustria-log", daemon=True)
+    _flush_thread.start()
+
+atexit.register(flush)
@@ -0,0 +1,267 @@
+"""
+Memoization of helper functions called inside Tasks
+
+ndustria caches whole Tasks, but inside a Task the same helper is often called many times
+with the same inputs, e.g. calculate_acceleration on the same particle positions. Decorating
+the helper with Pipeline.memoize() keeps its recent results in an in-process LRU cache:
+
+    @pipe.memoize(maxsize=256, maxbytes=2*1024**3)
+    def calculate_acceleration(pos, mass):
+        ...
+
+Calls are keyed like Tasks, by the source code of the function and its arguments, except that
+arguments are hashed by content rather than by str(): numpy arrays by their dtype, shape
+and data, containers element by element and anything else by its pickle. Arrays that print
+the same but differ somewhere in the middle therefore don't collide.
+
+With spill=True, results pushed out of memory are written to the memo folder of the Cache
+instead of being dropped, and looked up there before the function is called again. They also
+survive to later runs. The folder can be deleted at any time.
+
+Hits, misses and the compute time saved are reported with the Pipeline's stats, see
+Pipeline.getMemoStats() and `ndustria --stats`.
+"""
+
+import functools, os, pickle, threading, time
+from collections import OrderedDict
+from .File import File
+
+MEMO_DIR = "memo"
+"""Subdirectory of the cache that spilled results are written to"""
+
+def contentKey(function_digest, args, kwargs):
+    """Digest identifying a call of a function, by the content of its arguments"""
+    from .Cache import newDigest
+
+    digest = newDigest(function_digest.encode())
+    hashArgument(digest, args)
+    hashArgument(digest, kwargs)
+    return digest.hexdigest()
+
+
+def hashArgument(digest, arg):
+    """Feeds the content of an argument to a digest, tagged with its type so e.g. 1 and "1" differ"""
+
+    if isinstance(arg, (str, bytes, int, float, complex, bool, type(None))):
+        data = arg if isinstance(arg, bytes) else repr(arg).encode()
+        digest.update(f"{type(arg).__name__}:{len(data)}:".encode())
+        digest.update(data)
+
+    elif isinstance(arg, (list, tuple)):
+        digest.update(f"{type(arg).__name__}:{len(arg)}:".encode())
+        for a in arg:
+            hashArgument(digest, a)
+
+    elif isinstance(arg, dict):
+        digest.update(f"dict:{len(arg)}:".encode())
+        # equal dicts built in a different order are the same argument
+        for k, v in sorted(arg.items(), key=lambda kv: repr(kv[0])):
+            hashArgument(digest, k)
+            hashArgument(digest, v)
+
+    elif isinstance(arg, (set, frozenset)):
+        digest.update(f"set:{len(arg)}:".encode())
+        for a in sorted(repr(a) for a in arg):
+            digest.update(a.encode())
+
+    elif isinstance(arg, File):
+        digest.update(f"File:{arg}".encode())
+
+    elif hasattr(arg, "__array_interface__") and hasattr(arg, "dtype") and not arg.dtype.hasobject:
+        # numpy arrays, hashed straight from their buffer
+        digest.update(f"ndarray:{arg.dtype.str}:{arg.shape}:".encode())
+        try:
+            digest.update(memoryview(arg).cast("B"))
+        except (ValueError, TypeError):
+            # not contiguous, or a dtype the buffer protocol doesn't support
+            digest.update(arg.tobytes())
+
+    else:
+        try:
+            data = pickle.dumps(arg, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # the same caveat as for Task arguments applies, see Task.py
+            data = str(arg).encode()
+        digest.update(f"{type(arg).__qualname__}:{len(data)}:".encode())
+        digest.update(data)
+# end hashArgument
+
+
+def functionDigest(function):
+    """Identifies a function by its source code, ignoring whitespace like Task hashcodes do"""
+    import hashlib
+    from .Task import functionSource
+
+    try:
+        source = functionSource(function)
+    except (OSError, TypeError):
+        source = f"{function.__module__}.{function.__qualname__}"
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+class Memoized:
+    """A function whose results are remembered in an LRU cache, optionally spilling to disk"""
+
+    def __init__(self, function, maxsize=128, maxbytes=None, spill_dir=None):
+        """Keyword arguments:
+        maxsize -- Maximum number of results kept in memory. None for no limit
+        maxbytes -- Maximum estimated size of the results kept in memory. None for no limit
+        spill_dir -- Directory results pushed out of memory are written to. None drops them
+        """
+        functools.update_wrapper(self, function)
+
+        self.function = function
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.spill_dir = spill_dir
+
+        self.digest = functionDigest(function)
+
+        # key -> (result, estimated bytes, seconds it took to compute)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.spill_hits = 0
+        self.evictions = 0
+        self.time_saved = 0.0
+
+        if self.spill_dir is not None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def __call__(self, *args, **kwargs):
+        key = contentKey(self.digest, args, kwargs)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.time_saved += entry[2]
+                return entry[0]
+
+        entry = self.loadSpilled(key)
+        if entry is not None:
+            result, seconds = entry
+            with self.lock:
+                self.spill_hits += 1
+                self.time_saved += seconds
+        else:
+            start = time.perf_counter()
+            result = self.function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.misses += 1
+
+        self.insert(key, result, seconds)
+        return result
+
+    def insert(self, key, result, seconds):
+        from .Writer import estimateSize
+
+        nbytes = estimateSize(result)
+
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (result, nbytes, seconds)
+            self.nbytes += nbytes
+
+            # the newest result always stays, even if it alone is over the limit
+            while len(self.entries) > 1 and (
+                (self.maxsize is not None and len(self.entries) > self.maxsize)
+                or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+            ):
+                old_key, (old_result, old_bytes, old_seconds) = self.entries.popitem(last=False)
+                self.nbytes -= old_bytes
+                self.evictions += 1
+                evicted.append((old_key, old_result, old_seconds))
+
+        for old_key, old_result, old_seconds in evicted:
+            self.spill(old_key, old_result, old_seconds)
+    # end insert
+
+    def spillFile(self, key):
+        return os.path.join(self.spill_dir, key)
+
+    def spill(self, key, result, seconds):
+        """Writes a result pushed out of memory to the spill directory"""
+        if self.spill_dir is None or os.path.exists(self.spillFile(key)):
+            return
+
+        tmp_fname = f"{self.spillFile(key)}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_fname, "wb") as f:
+                pickle.dump((result, seconds), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fname, self.spillFile(key))
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            # results that can't be pickled are simply dropped
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+
+    def loadSpilled(self, key):
+        """Returns (result, seconds) of a spilled result, or None"""
+        if self.spill_dir is None:
+            return None
+
+        try:
+            with open(self.spillFile(key), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError):
+            return None
+
+    def cache_clear(self):
+        """Forgets every result kept in memory. Spilled results stay on disk"""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def getStats(self):
+        """Hit and miss counts, the number of results held and the compute time saved"""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "spill_hits": self.spill_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "time_saved": self.time_saved,
+            }
+# end Memoized
+
+
+def mergeMemoStats(per_rank_stats):
+    """Adds up the memo stats {name: stats} gathered from every process"""
+    merged = {}
+    for stats in per_rank_stats:
+        for name, s in stats.items():
+            if name not in merged:
+                merged[name] = dict(s)
+                continue
+            for k, v in s.items():
+                merged[name][k] += v
+    return merged
+
+
+def formatMemoStats(memo_stats):
+    """Renders memo stats as a human readable table"""
+    from tabulate import tabulate
+
+    rows = []
+    for name, s in memo_stats.items():
+        calls = s["hits"] + s["spill_hits"] + s["misses"]
+        rate = (s["hits"] + s["spill_hits"]) / calls if calls > 0 else 0.0
+        rows.append([
+            name, calls, s["hits"], s["spill_hits"], s["misses"], f"{100 * rate:.1f}%",
+            s["evictions"], f"{s['time_saved']:.4f}"
+        ])
+
+    return tabulate(rows, headers=[
+        "Memoized function", "Calls", "Hits", "Disk hits", "Misses", "Hit rate", "Evictions", "Time saved (s)"
+    ])
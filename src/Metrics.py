@@ -0,0 +1,199 @@
+"""
+Per-Task phase metrics
+
+Every Task carries a TaskMetrics object that records how long it spent in each
+phase of its life cycle, and how many bytes moved through the Cache while doing so:
+
+probe     -- checking the Cache for an existing result (Cache.exists)
+load      -- reading a previous result back from the Cache (pickle.load)
+compute   -- running the user_function
+serialize -- writing the result to the Cache (pickle.dump)
+write     -- recording the result in the Cache table journal (Cache.recordEntry)
+upload    -- sending the result to the remote cache, if there is one (Cache.upload)
+
+At the end of Pipeline.run() the metrics of every Task are gathered on the root process
+and saved to <name>_stats.json in the cache. The summary can then be read back with
+Pipeline.getStats() or printed with "ndustria --stats <name>"
+"""
+
+import json, os
+
+PHASES = ["probe", "load", "compute", "serialize", "write", "upload"]
+"""Phases of a Task that get timed, in the order they are reported"""
+
+PERCENTILES = [50, 90, 99]
+
+class TaskMetrics:
+    """Timings (in seconds) and byte counts for each phase of a single Task"""
+
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.bytes = dict.fromkeys(PHASES, 0)
+
+        # True if the result was found in the Cache when the Task was created
+        self.cache_hit = False
+
+        # True if the user_function was run by this process
+        self.ran = False
+
+    def add(self, phase, seconds, nbytes=0):
+        """Adds time (and optionally bytes) to one of the phases"""
+        self.times[phase] += seconds
+        self.bytes[phase] += nbytes
+
+    def touched(self):
+        """True if this process did any work on behalf of the Task"""
+        return self.ran or any(t > 0 for t in self.times.values())
+
+    def toDict(self):
+        return {
+            "cache_hit": self.cache_hit,
+            "ran": self.ran,
+            "times": dict(self.times),
+            "bytes": dict(self.bytes),
+        }
+# end TaskMetrics
+
+
+def taskRecord(task, rank=0):
+    """Converts the metrics of a Task into a json friendly dictionary"""
+    record = task.metrics.toDict()
+    record["function"] = task.user_function.__name__
+    record["task"] = task.getString()
+    record["hash"] = task.getHashCode()
+    record["rank"] = rank
+    return record
+
+
+def mergeRecords(per_rank_records):
+    """Merges lists of Task records gathered from every process into one record per Task.
+
+    Phases performed on more than one process (e.g. several ranks loading the same
+    dependency) are summed so the totals reflect all the time spent on the Task.
+    """
+    merged = {}
+    for records in per_rank_records:
+        for r in records:
+            h = r["hash"]
+            if h not in merged:
+                merged[h] = r
+                continue
+
+            m = merged[h]
+            m["cache_hit"] = m["cache_hit"] or r["cache_hit"]
+            m["ran"] = m["ran"] or r["ran"]
+            if r["ran"]:
+                m["rank"] = r["rank"]
+            for phase in PHASES:
+                m["times"][phase] = m["times"].get(phase, 0.0) + r["times"].get(phase, 0.0)
+                m["bytes"][phase] = m["bytes"].get(phase, 0) + r["bytes"].get(phase, 0)
+
+    return list(merged.values())
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a list of numbers"""
+    if len(values) == 0:
+        return 0.0
+
+    ordered = sorted(values)
+    rank = int(round(p / 100 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def summarize(records):
+    """Reduces a list of Task records to per function totals, percentiles and cache hit/miss counts
+
+    Returns a dictionary keyed by function name, plus a "[total]" entry covering all Tasks.
+    """
+
+    def blank():
+        return {
+            "tasks": 0,
+            "hits": 0,
+            "misses": 0,
+            "samples": {phase: [] for phase in PHASES},
+            "bytes": {phase: 0 for phase in PHASES},
+        }
+
+    groups = {}
+    total = blank()
+    for r in records:
+        for group in [groups.setdefault(r["function"], blank()), total]:
+            group["tasks"] += 1
+            if r["cache_hit"]:
+                group["hits"] += 1
+            elif r["ran"]:
+                group["misses"] += 1
+
+            # records saved before a phase was added don't have it
+            for phase in PHASES:
+                group["samples"][phase].append(r["times"].get(phase, 0.0))
+                group["bytes"][phase] += r["bytes"].get(phase, 0)
+
+    groups["[total]"] = total
+
+    summary = {}
+    for name, group in groups.items():
+        phases = {}
+        for phase in PHASES:
+            samples = group["samples"][phase]
+            phases[phase] = {
+                "total": sum(samples),
+                "bytes": group["bytes"][phase],
+            }
+            for p in PERCENTILES:
+                phases[phase][f"p{p}"] = percentile(samples, p)
+
+        summary[name] = {
+            "tasks": group["tasks"],
+            "hits": group["hits"],
+            "misses": group["misses"],
+            "phases": phases,
+        }
+
+    return summary
+
+
+def saveStats(filepath, records, memo=None):
+    """Saves Task records and their summary, plus the stats of memoized functions if there are any (see Memo.py)"""
+    stats = {"tasks": records, "summary": summarize(records)}
+    if memo:
+        stats["memo"] = memo
+
+    with open(filepath, "w") as f:
+        json.dump(stats, f, indent=1)
+
+
+def loadStats(filepath):
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def formatSummary(summary):
+    """Renders a summary as a human readable table"""
+    from tabulate import tabulate
+
+    headers = ["Function", "Phase", "Total (s)"] + [f"p{p} (s)" for p in PERCENTILES] + ["Bytes"]
+
+    rows = []
+    for name, s in summary.items():
+        for phase in PHASES:
+            # stats saved before a phase was added don't have it
+            if phase not in s["phases"]:
+                continue
+            ph = s["phases"][phase]
+            rows.append(
+                [name, phase, f"{ph['total']:.4f}"]
+                + [f"{ph[f'p{p}']:.4f}" for p in PERCENTILES]
+                + [ph["bytes"]]
+            )
+
+    counts = [
+        [name, s["tasks"], s["hits"], s["misses"]] for name, s in summary.items()
+    ]
+
+    out = tabulate(counts, headers=["Function", "Tasks", "Cache hits", "Cache misses"])
+    out += "\n\n"
+    out += tabulate(rows, headers=headers)
+    return out
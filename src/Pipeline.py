@@ -10,15 +10,21 @@ Once all Tasks are complete, the Pipeline will exit the program.
 """
 
 import sys
-from .Task import Task, WAITING, DONE
+from .Task import Task, WAITING, DONE, callHashCode
 from .Cache import Cache
-from .Logger import log, error
-import os, sys, tracemalloc
+from .File import usingStore
+from .Prefetcher import Prefetcher
+from .Logger import (
+    log, warn, error, tally, logTallies, isEnabled, setLogLevel, setLogRank, flush, mergeLogs, LEVEL_DEBUG
+)
+from .Metrics import taskRecord, mergeRecords, summarize, saveStats
+from .Comm import getComm, nodeTopology
+from .Resources import limitResources
+from .Planner import PLAN_ENV
+from .Scheduler import scheduleIteration, nodeBarriers
+import os, sys, time, gc
 import io
 
-from mpi4py import MPI
-from line_profiler import LineProfiler
-
 import functools
 
 class Pipeline:
@@ -26,6 +32,9 @@ class Pipeline:
 
     Tasks = [] 
     """List of all Task objects in this Pipeline"""
+
+    TasksByHash = {}
+    """Index of Tasks by hashcode, so identical calls share one Task"""
     
     def __init__(self, 
                  name="",
@@ -33,7 +42,24 @@ class Pipeline:
                  dryrun=False,
                  timeit=False,
                  memcheck=False,
-                 profiling=False
+                 profiling=False,
+                 log_level="info",
+                 async_writes=False,
+                 write_queue=4,
+                 write_buffer_bytes=2*1024**3,
+                 prefetch=False,
+                 prefetch_depth=1,
+                 prefetch_workers=4,
+                 prefetch_bytes=1024**3,
+                 cache_dir=None,
+                 content_hash=False,
+                 chunk_bytes=None,
+                 remote_cache=None,
+                 speculative=False,
+                 speculative_factor=3.0,
+                 speculative_min_seconds=10.0,
+                 fsync=True,
+                 shared_cache=False
                  ):
         """Keyword arguments:
         name -- A name to give the pipeline for organizational purposes. If left blank, it will derive the name from the file used to run the code
@@ -41,6 +67,23 @@ class Pipeline:
         dryrun -- If True, skips running Tasks but does everything else, including creating log files. Used to test complex pipelines
         timeit -- If True, keeps track of wallclock time of each Task. These data will be output to a csv file in the cache. Set to True by default due to low overhead
         memcheck -- If True, collects initial, peak, and final memory usage of each Task. These data will be output to a csv file in the cache. Can have high overhead if you allocate a lot of small objects
+        async_writes -- If True, results are written to the cache by a background thread while the next Task runs. Tasks should not modify their inputs in place when this is on
+        write_queue -- Maximum number of results waiting to be written when async_writes is True
+        write_buffer_bytes -- Maximum estimated size of the results waiting to be written when async_writes is True
+        prefetch -- If True, dependency results of the running Task and the next prefetch_depth Tasks on this process are loaded from the cache in parallel background threads
+        prefetch_depth -- Number of upcoming Tasks whose dependencies get prefetched
+        prefetch_workers -- Number of threads used to load prefetched results
+        prefetch_bytes -- Maximum size on disk of results prefetched ahead of the Tasks that need them
+        content_hash -- If True, Tasks with dependencies are cached under a key derived from the digests of their dependencies' results rather than their hashcodes. A Task that reruns but produces byte-identical output then doesn't invalidate anything downstream
+        chunk_bytes -- If set, numpy arrays larger than this many bytes in Task results (directly, in a dict or as attributes of an object) are stored in chunks of about this size and loaded lazily, reading only the chunks that are indexed. Requires numpy
+        remote_cache -- A URL, a directory or a CacheBackend (see Backend.py) to share results through. Results missing locally are looked for there, downloaded when needed, and every result computed is uploaded to it
+        speculative -- If True, parallel runs start a backup copy of a Task on an idle process when it runs much longer than it did in earlier runs, and keep whichever copy finishes first. See Speculation.py
+        speculative_factor -- A Task is backed up once it has run this many times longer than expected
+        speculative_min_seconds -- Tasks are never backed up before they have run this many seconds
+        fsync -- If True, results are flushed to disk before they are committed to the cache, so a crash can't leave a damaged result behind. Turn off to save time on filesystems where flushing is slow
+        shared_cache -- If True, Tasks are claimed in the cache before they run, so other jobs using the same cache at the same time don't compute them too. Always on for parallel runs with several processes and for partitions
+        cache_dir -- Directory to keep cached results in. Defaults to the one chosen during first time setup in ~/.ndustria_config
+        log_level -- Minimum level of messages written to the log, one of "debug", "info", "warning" or "error". Use "debug" to get one line per Task while building the Pipeline
         """
 
         self.parallel=parallel
@@ -48,6 +91,14 @@ class Pipeline:
         self.timeit=timeit
         self.memcheck=memcheck
         self.profiling=profiling
+        self.content_hash=content_hash
+        self.speculative=speculative
+        self.speculative_factor=speculative_factor
+        self.speculative_min_seconds=speculative_min_seconds
+        self.shared_cache=shared_cache
+
+        # backs up straggling Tasks during run(), see Speculation.py
+        self.speculator = None
         
 
         # name the pipeline after the file that ran it w/o .py
@@ -56,16 +107,68 @@ class Pipeline:
             self.name = sys.argv[0].replace(".py","")
         else:
             self.name = name
-        self.cache = Cache()
 
-        # TODO: This should get a communicator with a subset of the processes
-        # according to how many tasks it has
-        self.comm = MPI.COMM_WORLD
+        self.prefetch_depth = prefetch_depth
+        if prefetch:
+            self.prefetcher = Prefetcher(max_workers=prefetch_workers, max_bytes=prefetch_bytes)
+        else:
+            self.prefetcher = None
+
+        # per Task metric records gathered at the end of run(), see getStats()
+        self.stats = None
+
+        # functions decorated with memoize(), and their stats gathered at the end of run()
+        self.memos = []
+        self.memo_stats = None
+
+        # partition being run, and whether Tasks are claimed in the cache before they run, see run()
+        self.partition = None
+        self.claims = False
+
+        # mpi4py is only imported (and MPI initialized) for parallel runs
+        self.comm = getComm(self.parallel)
+
+        # communicators of the groups of processes running multi-rank Tasks, by tuple of ranks
+        self.subcomms = {}
+
+        self.cache = Cache(cache_dir)
+        if async_writes:
+            self.cache.setAsync(max_pending=write_queue, max_bytes=write_buffer_bytes)
+        self.cache.chunk_bytes = chunk_bytes
+        self.cache.fsync = fsync
+
+        # Tasks are looked up in the remote cache in batches when run() starts
+        if remote_cache is not None:
+            from .Backend import getBackend
+            self.cache.setRemote(getBackend(remote_cache), defer=True)
+
+        # list the cache once up front so probing each new Task is a set lookup
+        self.cache.scan(self.comm if self.parallel else None)
+
+        setLogLevel(log_level)
+
+        # each rank logs to its own file, merged at the end of run()
+        if self.parallel and self.getCommSize() > 1:
+            setLogRank(self.getCommRank())
 
         #if self.isRoot():
             #log(f"---\nPipeline {self.name} created with cache located at {self.cache.path}\n---\n")
 
-    def AddFunction(self, rerun=False):
+    def AddFunction(self, rerun=False, ranks=1, cores=None, artifacts=False, persist=True):
+        """Decorator that turns calls of a function into Tasks of this Pipeline
+
+        Keyword arguments:
+        rerun -- If True, the Tasks are run even if their results are cached
+        ranks -- Number of MPI processes each Task runs on. If more than 1, the function is called on every process of a group with a communicator of the group as the keyword argument comm, and the result of the group's rank 0 is saved
+        cores -- Number of cores each Task uses on each of its processes. Tasks are packed so the processes of a node don't use more cores than it has, and BLAS/OpenMP threads and CPU affinity are limited to this many cores while the Task runs
+        artifacts -- If True, each Task gets a directory of its own in the cache as the keyword argument output_dir, to write files to and return their paths. See Artifact.py
+        persist -- If False, results are never saved to the cache. Each Task is run on the process of a Task that needs its result, right before that Task, and its result is dropped from memory once every Task using it on the process is done. For cheap functions with big results. Can't be combined with ranks or artifacts
+
+        The decorated function gets a map() method as well, which adds many Tasks at once, e.g. f.map(range(N), scale=2)
+        """
+        if not persist and (ranks > 1 or artifacts):
+            error("Tasks that aren't persisted run inside the Tasks that use them, so they can't have ranks or artifacts", fatal=True)
+
         def outer_wrapper(user_function):
             @functools.wraps(user_function)
             def inner_wrapper(*args, **kwargs):
@@ -74,17 +177,71 @@ class Pipeline:
                     user_function, 
                     args, 
                     kwargs,
-                    rerun=rerun
+                    rerun=rerun,
+                    ranks=ranks,
+                    cores=cores,
+                    artifacts=artifacts,
+                    persist=persist
                 )
 
+            def map(*iterables, **kwargs):
+                """Adds one Task per element of the iterables, like the builtin map, and returns them in a list.
+                Keyword arguments are passed to every Task
+                """
+                # the garbage collector would walk the growing list of Tasks over and over 
+                # while they are created, and none of them are garbage
+                paused = gc.isenabled()
+                gc.disable()
+                try:
+                    # Tasks only ever read their kwargs, so they can all share them
+                    return self._addTasks(
+                        user_function,
+                        ((args, kwargs) for args in zip(*iterables)),
+                        rerun=rerun,
+                        ranks=ranks,
+                        cores=cores,
+                        artifacts=artifacts,
+                        persist=persist
+                    )
+                finally:
+                    if paused:
+                        gc.enable()
+
+            inner_wrapper.map = map
             return inner_wrapper        
         return outer_wrapper
 
+    def memoize(self, maxsize=128, maxbytes=None, spill=False):
+        """Decorator that remembers the results of a helper function called inside Tasks. See Memo.py
+
+        Keyword arguments:
+        maxsize -- Maximum number of results kept in memory per process. None for no limit
+        maxbytes -- Maximum estimated size in bytes of the results kept in memory per process. None for no limit
+        spill -- If True, results pushed out of memory are written to the memo folder of the cache instead of being dropped
+        """
+        from .Memo import Memoized, MEMO_DIR, functionDigest
+
+        def wrapper(function):
+            spill_dir = None
+            if spill:
+                spill_dir = os.path.join(self.cache.path, MEMO_DIR, f"{function.__name__}-{functionDigest(function)}")
+
+            memoized = Memoized(function, maxsize=maxsize, maxbytes=maxbytes, spill_dir=spill_dir)
+            self.memos.append(memoized)
+            return memoized
+
+        return wrapper
+    # end memoize
+
     def _addTask(self, 
         user_function, 
         args, 
         kwargs,
-        rerun=False
+        rerun=False,
+        ranks=1,
+        cores=None,
+        artifacts=False,
+        persist=True
     ):
         """Factory function for creating all new Tasks
         
@@ -93,31 +250,168 @@ class Pipeline:
         args -- a list of positional arguments to pass to user_function
         kwargs -- a dictionary of keyword arguments to pass to user_function
         """
+        return self._addTasks(user_function, [(args, kwargs)], rerun=rerun, ranks=ranks, cores=cores, artifacts=artifacts, persist=persist)[0]
+
+    def _addTasks(self,
+        user_function,
+        calls,
+        rerun=False,
+        ranks=1,
+        cores=None,
+        artifacts=False,
+        persist=True
+    ):
+        """Creates a Task for every (args, kwargs) pair in calls and returns them in a list.
+
+        A call identical to one added before returns the existing Task. Tasks are tallied 
+        once per batch instead of once each.
+        """
+        is_root = self.isRoot()
+        debug = is_root and isEnabled(LEVEL_DEBUG)
+        name = user_function.__name__
+
+        tasks = []
+        added = hits = reused = 0
+        for args, kwargs in calls:
+
+            # the same function called with the same arguments again is the same computation.
+            # Looked up before the Task is created, so repeated calls don't probe the cache
+            with usingStore(self.cache.fingerprints):
+                hashcode = callHashCode(user_function, args, kwargs)
+            existing = self.findTask(hashcode)
+            if existing is not None:
+                # a result computed by this process is already fresh, only cached ones are redone
+                if rerun and existing.persist and not existing.rerun and not existing.running() and not existing.metrics.ran:
+                    existing.rerun = True
+                    existing.status = WAITING
+                    existing.metrics.cache_hit = False
+
+                reused += 1
+                if debug:
+                    log(f"[Reused Task] {existing.getString()} was already added", level=LEVEL_DEBUG)
+                tasks.append(existing)
+                continue
+
+            # create the new Task and append it to the Pipeline
+            new_task = Task(
+                len(self.Tasks),
+                user_function, 
+                args, 
+                kwargs, 
+                self,
+                rerun=rerun,
+                ranks=ranks,
+                cores=cores,
+                artifacts=artifacts,
+                persist=persist,
+                hashcode=hashcode)
+
+            self.Tasks.append(new_task)
+            self.TasksByHash[new_task.getHashCode()] = new_task
+            tasks.append(new_task)
+
+            # results that aren't persisted are dropped once their consumers are done
+            for dep in new_task.dependencies:
+                if not dep.persist:
+                    dep.consumers.append(new_task)
 
-        # create the new Task and append it to the Pipeline
-        new_task = Task(
-            len(self.Tasks),
-            user_function, 
-            args, 
-            kwargs, 
-            self,
-            rerun=rerun)
-        self.Tasks.append(new_task)
-
-        if self.isRoot(): 
             if new_task.done():
-                log(f"[Cache hit!] {new_task.getString()} can be skipped")
+                hits += 1
+                if debug:
+                    log(f"[Cache hit!] {new_task.getString()} can be skipped", level=LEVEL_DEBUG)
+            else:
+                added += 1
+                if debug:
+                    log(f"[Added Task] {new_task.getString()}", level=LEVEL_DEBUG)
+        # end for
+
+        # summarized instead of logged one by one, see Logger.tally
+        if is_root:
+            for category, count in [("[Reused Task]", reused), ("[Cache hit!]", hits), ("[Added Task]", added)]:
+                if count > 0:
+                    tally(category, name, count)
+
+        return tasks
+    # end _addTasks
+
+
+    def findTask(self, hashcode):
+        """Returns the Task in this Pipeline with the given hashcode, or None"""
+        task = self.TasksByHash.get(hashcode)
+
+        # Tasks may have been cleared out from under the index
+        if task is None or task.id >= len(self.Tasks) or self.Tasks[task.id] is not task:
+            return None
+        return task
+    # end findTask
+
+    def runTask(self, task, group, cpus=None):
+        """Runs a Task on this process, with the communicator of its group if it is a multi-rank Task 
+        and limited to its cores hint if it has one
+        """
+        comm = self.getSubComm(group) if task.ranks > 1 else None
+
+        try:
+            if task.cores is None:
+                task.run(comm=comm)
             else:
-                log(f"[Added Task] {new_task.getString()}")
-            # end if
-        # end if
+                with limitResources(task.cores, cpus):
+                    task.run(comm=comm)
+        except BaseException:
+            # the result is never going to be saved, let someone else try
+            self.cache.release(task)
+            raise
+    # end runTask
+
+    def claimTask(self, task):
+        """Claims a Task in the Cache before running it, see Cache.claim.
+
+        Returns True if this process should run the Task. Otherwise another process sharing the
+        cache is computing it, or already has, in which case the Task is marked done.
+        """
+        # nobody else is using the cache, or the processes of a group can't each decide for themselves
+        if not self.claims or task.ranks > 1:
+            return True
 
-        return new_task
+        for attempt in range(2):
+            if not task.rerun and self.cache.onDisk(task):
+                self.cache.release(task)
+                task.status = DONE
+                task.metrics.cache_hit = True
+                log(f"[Cache hit!] {task.getString()} was computed by another process")
+                return False
 
+            # checked again after claiming, in case the result was saved in between
+            if attempt == 0 and not self.cache.claim(task):
+                return False
+
+        return True
+    # end claimTask
 
     """
     Parallel utility functions
     """
+    def getSubComm(self, group):
+        """Returns a communicator for the processes in group, a tuple of ranks. 
+
+        Only the processes in the group take part in creating it. Serial Pipelines get 
+        MPI.COMM_SELF, or a SerialComm if mpi4py isn't installed.
+        """
+        if not self.parallel:
+            if group not in self.subcomms:
+                try:
+                    from mpi4py import MPI
+                    self.subcomms[group] = MPI.COMM_SELF
+                except ImportError:
+                    self.subcomms[group] = self.comm
+            return self.subcomms[group]
+
+        if group not in self.subcomms:
+            mpi_group = self.comm.Get_group().Incl(list(group))
+            self.subcomms[group] = self.comm.Create_group(mpi_group)
+            mpi_group.Free()
+        return self.subcomms[group]
+
     def getCommRank(self):
         """Convenience method to get MPI rank"""
         return self.comm.Get_rank()
@@ -133,7 +427,7 @@ class Pipeline:
     """
     The main Task running function
     """
-    def run(self, run_all=False): 
+    def run(self, run_all=False, targets=None, functions=None, partition=None, poll_interval=10): 
         """
         Runs a pipeline , composed of ndustria Tasks and Views
 
@@ -141,8 +435,22 @@ class Pipeline:
         Step 2. Decorate your functions with the addTask and addView decorators as appropriate
         Step 3. Call your decorated functions with desired arguments
         Step 4. Call this function to run the pipeline
+
+        Keyword arguments:
+        run_all -- If True, clears the cached results of every Task first
+        targets -- A Task or list of Tasks. If given, only the Tasks needed to produce these are run
+        functions -- A function or function name, or a list of them. Like targets, but selects every Task of these functions
+        partition -- Only run the Tasks assigned to this partition by `ndustria plan`, see Planner.py. Results of other partitions that these Tasks depend on are waited for
+        poll_interval -- Seconds between checks of the Cache for results of other partitions, or of other processes sharing the cache
         """
 
+        # `ndustria plan` only wants the DAG
+        if os.environ.get(PLAN_ENV):
+            self.plan(int(os.environ[PLAN_ENV]))
+            sys.exit(0)
+
+        if self.isRoot(): logTallies()
+
         if self.parallel:
             if self.isRoot(): log(f"Initializing parallel run with {self.getCommSize()} processes")
 
@@ -150,6 +458,7 @@ class Pipeline:
             self.clearCache()
 
         if self.memcheck:
+            import tracemalloc
             tracemalloc.start(25) # TODO: Move this to .env
 
         # if self.profiling:
@@ -157,53 +466,186 @@ class Pipeline:
 
         self.comm.Barrier()
 
+        selected = self.getSubDAG(targets, functions)
+
+        # results found remotely may make part of the sub-DAG unnecessary
+        if self.cache.remote is not None and not run_all:
+            if self.probeRemote(selected) > 0:
+                selected = self.getSubDAG(targets, functions)
+
+        # ids of Tasks another partition computes
+        self.partition = partition
+
+        # Tasks are claimed before they run if other jobs may be using the cache too
+        self.claims = self.shared_cache or partition is not None or (self.parallel and self.getCommSize() > 1)
+        foreign = set()
+        if partition is not None:
+            selected, foreign = self.selectPartition(selected, partition)
+
+        # backups of straggling Tasks need other processes to run on
+        if self.speculative and self.parallel and self.getCommSize() > 1:
+            from .Speculation import Speculator, canInterrupt
+            if canInterrupt():
+                self.speculator = Speculator(self, self.speculative_factor, self.speculative_min_seconds)
+            elif self.isRoot():
+                warn("Speculative execution needs signal.pthread_kill, which isn't available here. Running without it")
+
+        # which processes share a node, only needed to pack Tasks with cores hints. The processes 
+        # of a node synchronize around the steps those are on, see Scheduler.py
+        topology = (None, None)
+        node_comm = None
+        if any(task.cores is not None for task in selected):
+            topology = nodeTopology(self.comm)
+            if self.parallel and self.getCommSize() > 1:
+                node_comm = self.comm.Split(topology[0][self.getCommRank()], self.getCommRank())
+
         run_this_iteration = []
-        waiting = [task for task in self.Tasks if task.waiting()]
+        waiting = [task for task in selected if task.waiting()]
 
         num_waiting = len(waiting)
 
         if self.isRoot(): log(f"---\n Starting a run with {num_waiting} tasks.\n---\n")
 
-        MAX_ITERATIONS = 10000
+        # no cap on the number of iterations, a long chain of Tasks needs one per Task. 
+        # Every iteration either completes a Task, waits for another process or exits with an error
         iterations = 0
-        while num_waiting > 0 and iterations < MAX_ITERATIONS:
+        while num_waiting > 0:
             iterations+=1
 
-            run_this_iteration = [task for task in waiting if task.readyToRun()]
-
-            for i, task in enumerate(run_this_iteration):
-
-                if self.parallel:
-                    # round robin distribute Tasks to processes
-                    if i % self.getCommSize() == self.getCommRank():
-                        log(f"[Rank {self.getCommRank()}] running: " + task.getString())
-
-                        try:
-                            task.run()
-
-                        except Exception as e:
-                            ex_type, ex_value, ex_traceback = sys.exc_info()
-                            error(ex_type.__name__ +' '+ str(ex_value), 
-                                  fatal=False,
-                                  task=task
-                            )
-                            # TODO: Broadcast that this Task has failed to other processes
-
-                    else:
+            run_this_iteration = [task for task in waiting if task.id not in foreign and task.readyToRun()]
+
+            # ids of my Tasks other processes sharing the cache are computing
+            deferred = []
+
+            # ranks running each of my Tasks, the CPUs to run them on and the step of the schedule
+            groups = {}
+            cpus = {}
+            steps = {}
+
+            # steps the processes of this node may only start once all of them finished the one before
+            node_barriers = []
+            if self.parallel:
+                # round robin distribute Tasks to processes, packed around multi-rank Tasks
+                # and against the cores of each node
+                schedule = scheduleIteration(run_this_iteration, self.getCommSize(), *topology, report=self.isRoot())
+                my_tasks = []
+                for task, group, task_cpus, step in schedule[self.getCommRank()]:
+                    my_tasks.append(task)
+                    groups[task.id] = group
+                    cpus[task.id] = task_cpus
+                    steps[task.id] = step
+
+                # Tasks with cores hints share the cores of a node with the others on their step, 
+                # so the step they're on only starts once the processes of the node finished the 
+                # step before, and the next one once they finished it
+                if node_comm is not None:
+                    node_barriers = nodeBarriers(schedule, topology[0], self.getCommRank())
+
+                for task in run_this_iteration:
+                    if task.id not in groups:
                         # Mark this Task done on other processes
                         # TODO: Gather Task successes and failures at the
                         # current Barrier step
                         task.status = DONE
+            else:
+                my_tasks = run_this_iteration
+                for task in my_tasks:
+                    if task.ranks > 1:
+                        error(f"{task.getString()} asks for {task.ranks} ranks but the Pipeline isn't parallel. Running it on 1", fatal=False, task=task)
+                if topology[1] is not None:
+                    for task in my_tasks:
+                        if task.cores is not None:
+                            cpus[task.id] = topology[1][0][:task.cores]
+
+            passed = 0
+            for i, task in enumerate(my_tasks):
+
+                while passed < len(node_barriers) and node_barriers[passed] <= steps[task.id]:
+                    node_comm.Barrier()
+                    passed += 1
+
+                # start loading the dependencies of this and the next few Tasks
+                # while this one computes
+                if self.prefetcher is not None:
+                    # the previous Task is done with its dependencies
+                    if i > 0:
+                        self.prefetcher.release(my_tasks[i-1])
+                    for upcoming in my_tasks[i:i+1+self.prefetch_depth]:
+                        self.prefetcher.prefetch(upcoming)
+
+                # someone else sharing the cache is on it
+                if not self.claimTask(task):
+                    if not task.done():
+                        deferred.append(task.id)
+                    continue
+
+                if self.parallel:
+                    log(f"[Rank {self.getCommRank()}] running: " + task.getString())
+
+                    try:
+                        if self.speculator is not None and task.ranks == 1:
+                            self.speculator.run(task, functools.partial(self.runTask, task, groups[task.id], cpus.get(task.id)))
+                        else:
+                            self.runTask(task, groups[task.id], cpus.get(task.id))
+
+                    except Exception as e:
+                        ex_type, ex_value, ex_traceback = sys.exc_info()
+                        error(ex_type.__name__ +' '+ str(ex_value), 
+                              fatal=False,
+                              task=task
+                        )
+                        # TODO: Broadcast that this Task has failed to other processes
                 else:
-                    task.run()
+                    self.runTask(task, (0,), cpus.get(task.id))
 
-            self.comm.Barrier()
+            if self.prefetcher is not None and len(my_tasks) > 0:
+                self.prefetcher.release(my_tasks[-1])
+
+            # every process of the node meets the others at the same number of barriers
+            while passed < len(node_barriers):
+                node_comm.Barrier()
+                passed += 1
 
-            waiting = [task for task in self.Tasks if task.waiting()]
+            # other ranks may load these results in the next iteration
+            if self.parallel:
+                self.cache.wait()
+            else:
+                self.cache.syncDirectories()
+
+            # idle processes back up straggling Tasks while they wait for the others
+            if self.speculator is not None:
+                self.speculator.waitForOthers(self.comm, run_this_iteration)
+            else:
+                self.comm.Barrier()
+
+            # share the digests of the results computed here so the other ranks
+            # can derive cache keys without hashing the files themselves
+            if self.parallel and self.content_hash:
+                for digests in self.comm.allgather({t.id: t.digest for t in my_tasks if t.digest is not None}):
+                    for task_id, digest in digests.items():
+                        self.Tasks[task_id].digest = digest
+
+            # the other ranks assumed these got done
+            deferred = [task_id for ids in self.comm.allgather(deferred) for task_id in ids]
+            for task_id in deferred:
+                self.Tasks[task_id].status = WAITING
+
+            if len(foreign) > 0:
+                self.pollPartitions([task for task in selected if task.waiting() and task.id in foreign])
+
+            waiting = [task for task in selected if task.waiting()]
 
             log(f"[Rank {self.getCommRank()}] waiting on {len(waiting)} Tasks")
 
             if self.isRoot(): log(f"---\nIteration {iterations} finished. {len(waiting)} Tasks left\n---")
+
+            # nothing to do until another partition or process delivers
+            if len(waiting) != 0 and num_waiting <= len(waiting) and (len(deferred) > 0 or any(t.id in foreign for t in waiting)):
+                if self.isRoot(): log(f"Waiting for results of other partitions or processes")
+                time.sleep(poll_interval)
+                iterations -= 1
+                continue
+
             if len(waiting) != 0 and num_waiting <= len(waiting):
                 error("Looks like the last run didn't complete any Tasks. Use \"ndustria -l\" to see what went wrong. Exiting.", fatal=True)
 
@@ -211,6 +653,17 @@ class Pipeline:
             
         # end main while loop
 
+        if node_comm is not None:
+            node_comm.Free()
+
+        if self.speculator is not None:
+            self.speculator.close()
+
+        self.cache.wait()
+
+        if self.speculator is not None and self.speculator.launched > 0:
+            log(f"[Rank {self.getCommRank()}] started {self.speculator.launched} backup copies, {self.speculator.won} of which finished first")
+
         if self.isRoot(): log(f"Finished all tasks after {iterations} iterations")
 
         # TODO: Fix this so it works in parallel
@@ -231,13 +684,204 @@ class Pipeline:
             profiling_data_file = os.path.join(self.cache.path, f"{self.name}_profile.txt")
             with open(profiling_data_file, "w") as profile_data:
                 for task in self.Tasks:
+                    if task.line_profile is None:
+                        continue
                     output_stream = io.StringIO()
                     task.line_profile.print_stats(stream=output_stream)
                     profile_data.write(output_stream.getvalue())
 
+        self.gatherStats()
+
+        # every process has journaled its results by now, fold them into the table once
+        self.cache.fingerprints.flush()
+        if self.isRoot(): self.cache.writeCacheInfo()
+
         if self.isRoot(): log("All done.")
+
+        flush()
+        if self.parallel and self.getCommSize() > 1:
+            self.comm.Barrier()
+            if self.isRoot(): mergeLogs(self.getCommSize())
           
 
+    def probeRemote(self, tasks):
+        """Looks up the Tasks that aren't cached locally in the remote cache with batched queries 
+        and marks the ones found there done. Returns the number found
+        """
+        answer = None
+        if self.isRoot():
+            queried = [
+                t.getFilename() for t in tasks 
+                if not t.done() and not t.rerun and t.getFilename() is not None
+            ]
+            answer = (queried, self.cache.probeRemote(queried))
+        queried, names = self.comm.bcast(answer, root=0)
+
+        # the other ranks only learn the answers
+        self.cache.remote_deferred = False
+        self.cache.remote_checked.update(queried)
+        self.cache.remote_index.update(names)
+
+        found = 0
+        for t in tasks:
+            if not t.done() and not t.rerun and t.getFilename() in names:
+                t.status = DONE
+                t.metrics.cache_hit = True
+                found += 1
+
+        if self.isRoot() and found > 0:
+            log(f"Found {found} results in the remote cache {self.cache.remote}")
+
+        return found
+    # end probeRemote
+
+    def plan(self, num_partitions):
+        """Partitions the Tasks that aren't cached yet into num_partitions groups to be run as separate jobs with 
+        run(partition=i) and saves the plan to <name>_plan.json in the cache. See Planner.py
+        """
+        from .Planner import makePlan, savePlan, planFile, formatPlan
+
+        plan = makePlan(self, num_partitions)
+        if self.isRoot():
+            savePlan(planFile(self.cache.path, self.name), plan)
+            log(f"Saved plan to {planFile(self.cache.path, self.name)}\n{formatPlan(plan)}")
+            flush()
+        return plan
+    # end plan
+
+    def selectPartition(self, selected, partition):
+        """Narrows the selected Tasks down to those of a partition and the Tasks of other partitions they need.
+
+        Returns the new selection and the set of ids of the other partitions' Tasks.
+        """
+        from .Planner import loadPlan, planFile
+
+        try:
+            plan = loadPlan(planFile(self.cache.path, self.name))
+        except FileNotFoundError:
+            error(f"No plan found for {self.name}. Create one with \"ndustria plan <script> --partitions <number>\" first")
+
+        assignment = plan["tasks"]
+
+        def owner(task):
+            # Tasks added since the plan was made go to the first partition
+            return assignment.get(task.getHashCode(), 0)
+
+        mine = [t for t in selected if not t.done() and owner(t) == partition]
+        if len(mine) == 0:
+            return [], set()
+
+        selected = self.getSubDAG(targets=mine)
+        foreign = set(t.id for t in selected if not t.done() and owner(t) != partition)
+
+        if self.isRoot():
+            log(f"Running partition {partition} of {plan['partitions']}: {len(mine)} Tasks, waiting on {len(foreign)} from other partitions")
+
+        return selected, foreign
+    # end selectPartition
+
+    def pollPartitions(self, tasks):
+        """Marks the Tasks whose results another partition has saved to the Cache done"""
+        appeared = None
+        if self.isRoot():
+            appeared = [t.id for t in tasks if self.cache.onDisk(t)]
+        appeared = self.comm.bcast(appeared, root=0)
+
+        for task_id in appeared:
+            self.Tasks[task_id].status = DONE
+    # end pollPartitions
+
+    def getSubDAG(self, targets=None, functions=None, include_cached=False):
+        """Returns the Tasks needed to produce the targets, in the order they were added to the Pipeline.
+
+        Starting from the targets (and every Task of the given functions), walks back through the 
+        dependencies but stops at Tasks that are already done, so cached ancestors whose results 
+        aren't needed by anything that has to run are never touched. With include_cached=True
+        it returns every ancestor instead.
+        If no targets or functions are given, returns every Task in the Pipeline.
+        """
+
+        if targets is None and functions is None:
+            return list(self.Tasks)
+
+        if targets is None:
+            targets = []
+        elif Task.isTask(targets):
+            targets = [targets]
+
+        if functions is not None:
+            if not isinstance(functions, (list, tuple, set)):
+                functions = [functions]
+            names = set(f if isinstance(f, str) else f.__name__ for f in functions)
+            targets = list(targets) + [t for t in self.Tasks if t.user_function.__name__ in names]
+
+        needed = {}
+        stack = list(targets)
+        while len(stack) > 0:
+            task = stack.pop()
+            if id(task) in needed:
+                continue
+            needed[id(task)] = task
+
+            # Tasks that aren't persisted are done, but need their dependencies when they run
+            if include_cached or not task.done() or not task.persist:
+                stack.extend(task.dependencies)
+
+        return sorted(needed.values(), key=lambda t: t.id)
+
+    def gatherStats(self):
+        """Collects the phase metrics of every Task on the root process and saves them to <name>_stats.json in the cache"""
+
+        local_records = [
+            taskRecord(task, self.getCommRank()) 
+            for task in self.Tasks 
+            if task.metrics.touched() or task.metrics.cache_hit
+        ]
+
+        from .Memo import mergeMemoStats
+
+        local_memo = mergeMemoStats([{memoized.__name__: memoized.getStats()} for memoized in self.memos])
+
+        if self.parallel:
+            all_records = self.comm.gather(local_records, root=0)
+            all_memo = self.comm.gather(local_memo, root=0)
+        else:
+            all_records = [local_records]
+            all_memo = [local_memo]
+
+        if not self.isRoot():
+            return
+
+        self.stats = mergeRecords(all_records)
+        self.memo_stats = mergeMemoStats(all_memo)
+
+        # jobs of a partitioned run each keep their own stats
+        suffix = "" if self.partition is None else f".part{self.partition}"
+        stats_file = os.path.join(self.cache.path, f"{os.path.basename(self.name)}_stats{suffix}.json")
+        saveStats(stats_file, self.stats, self.memo_stats)
+
+    def getStats(self, per_task=False):
+        """Returns the cache probe, load, compute, serialize, write and upload timings of the last run.
+
+        By default the metrics are summarized per function (totals, percentiles, bytes and cache hits/misses).
+        If per_task is True, returns the raw record of every Task instead. 
+        Only available after run(), and only on the root process for parallel runs.
+        """
+        if self.stats is None:
+            return None
+
+        if per_task:
+            return self.stats
+
+        return summarize(self.stats)
+
+    def getMemoStats(self):
+        """Returns the hits, misses and compute time saved of every function decorated with memoize() during the last run, by name.
+
+        Only available after run(), and only on the root process for parallel runs.
+        """
+        return self.memo_stats
+
     def printCacheInfo(self):
         """Prints the cache info file to console. Not supported on Windows"""
 
@@ -245,7 +889,19 @@ class Pipeline:
         os.system(f"cat {self.cache.info_file}")
 
     def printLog(self):
-        """Prints the log file to console. Not supported on Windows"""
+        """Prints the log file to console. Not supported on Windows
+
+        In parallel runs every rank has to call this, since their buffered messages are merged into the log first.
+        """
+
+        # messages are buffered, and in parallel runs each rank has a file of its own
+        flush()
+        if self.parallel and self.getCommSize() > 1:
+            self.comm.Barrier()
+            if self.isRoot(): mergeLogs(self.getCommSize())
+
+        if not self.isRoot():
+            return
 
         # because windows users can fucking die
         os.system(f"cat {self.cache.log_file}")
@@ -305,35 +961,58 @@ class Pipeline:
         for task in self.Tasks:
             task.status = WAITING
             task.result = None
+            task.digest = None
 
         
-    def pack(self, save_to=""):
+    def pack(self, save_to="", targets=None, functions=None, workers=4, level=6):
+        """Packs cached results into an archive that can be unpacked into another cache with unpack() or `ndustria --unpack`
 
-        # gather list of file names from self.tasks
+        Keyword arguments:
+        save_to -- Path of the archive. Defaults to <name>.tar
+        targets, functions -- If given, only the results of these Tasks and everything they depend on are packed. See run()
+        workers -- Number of threads compressing the results
+        level -- gzip compression level, from 1 (fastest) to 9 (smallest)
 
-        task_cache_files = [
-            self.cache.getFullPathToTask(task) for task in self.Tasks
-        ]
+        In parallel runs every process must call it, the archive is written by the root process.
+        """
+        from .Archive import packArchive
 
-        # create a new temp folder in the cache directory
-        temp_dir = os.path.join(self.cache.path, "temp")
-        os.mkdir(temp_dir)
+        if save_to == "":
+            save_to = f"{self.name}.tar"
 
-        # move files into the temp folder
-        for fname in task_cache_files:
-            cp_cmd = f"cp {fname} {os.path.join(temp_dir, '.')}"
-            os.system(cp_cmd)
+        # wait for any results still being written, by every process
+        self.cache.wait()
+        self.comm.Barrier()
 
-        # compress the temp folder 
-        if save_to == "":
-            save_to = f"{self.name}.tar.gz"
+        if self.isRoot():
+            tasks = self.getSubDAG(targets, functions, include_cached=True)
+
+            start = time.perf_counter()
+            num_files = packArchive(self.cache, tasks, save_to, workers=workers, level=level)
+            log(f"Packed {num_files} files into {save_to} in {time.perf_counter() - start:.2f} seconds")
+
+        # the archive is complete before anyone uses it
+        self.comm.Barrier()
 
-        tar_cmd = f"tar -C {self.cache.path} -zcf {save_to} temp"
-        print(f"Running: {tar_cmd}")
-        os.system(tar_cmd)
+        return save_to
+    # end pack
 
-        # delete temp folder
-        rm_cmd = f"rm -r {temp_dir}"
-        os.system(rm_cmd)
+    def unpack(self, archive, workers=4):
+        """Adds the results in an archive made by pack() to the cache and marks the Tasks they belong to done.
+
+        Files already in the cache are skipped, so an interrupted unpack can simply be run again.
+        """
+        from .Archive import unpackArchive
+
+        if self.isRoot():
+            unpackArchive(self.cache, archive, workers=workers)
+        self.comm.Barrier()
+
+        self.cache.scan(self.comm if self.parallel else None)
+        for task in self.Tasks:
+            if not task.done():
+                task.probed = False
+                task.probeCache()
+    # end unpack
 
 
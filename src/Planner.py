@@ -0,0 +1,161 @@
+"""
+Offline partitioning of a Pipeline into independent jobs
+
+Instead of one big MPI run, a Pipeline can be split into K partitions that run as separate
+jobs, e.g. the elements of a batch job array:
+
+    ndustria plan my_pipeline.py --partitions 16
+
+builds the DAG of my_pipeline.py without running anything and writes a plan to the cache
+assigning every Task that isn't cached yet to one of the partitions. Each job then runs
+
+    pipe.run(partition=i)
+
+which runs the Tasks of partition i, waiting for results computed by other partitions to
+show up in the Cache.
+
+Partitions are balanced by the expected run time of their Tasks, taken from the compute times
+recorded in <name>_stats.json by earlier runs when available. Tasks are placed in the order
+they were added, each with the partition holding most of its dependencies unless that would
+make the partition too heavy, which keeps chains of Tasks together and the number of results
+that have to cross partitions low.
+"""
+
+import glob, json, os
+
+PLAN_ENV = "NDUSTRIA_PLAN_PARTITIONS"
+"""If set, Pipeline.run() writes a plan with this many partitions and exits instead of running"""
+
+BALANCE_SLACK = 0.1
+"""How much heavier than average a partition may get to keep a Task with its dependencies"""
+
+def planFile(cache_path, name):
+    return os.path.join(cache_path, f"{os.path.basename(name)}_plan.json")
+
+
+def statsFiles(cache_path, name):
+    """Stats of earlier runs, including the per partition files written by partitioned runs"""
+    base = os.path.join(cache_path, os.path.basename(name))
+    return glob.glob(f"{glob.escape(base)}_stats*.json")
+
+
+def historicalCosts(cache_path, name):
+    """Returns ({hashcode: seconds}, {function name: mean seconds}) of compute times recorded in earlier runs"""
+    from .Metrics import loadStats
+
+    by_hash = {}
+    by_function = {}
+    for fname in statsFiles(cache_path, name):
+        try:
+            records = loadStats(fname)["tasks"]
+        except (OSError, ValueError, KeyError):
+            continue
+
+        for r in records:
+            if r["ran"]:
+                by_hash[r["hash"]] = r["times"]["compute"]
+                by_function.setdefault(r["function"], []).append(r["times"]["compute"])
+
+    means = {f: sum(times) / len(times) for f, times in by_function.items()}
+    return by_hash, means
+
+
+def estimateCosts(tasks, by_hash, by_function):
+    """Expected compute time of each Task by id: its own last run time, else the mean of its
+    function, else the mean of everything recorded, else 1"""
+
+    if len(by_function) > 0:
+        default = sum(by_function.values()) / len(by_function)
+    else:
+        default = 1.0
+
+    costs = {}
+    for t in tasks:
+        cost = by_hash.get(t.getHashCode())
+        if cost is None:
+            cost = by_function.get(t.user_function.__name__, default)
+        # a Task always costs something, even if it ran in no time before
+        costs[t.id] = max(cost, 1e-6)
+    return costs
+
+
+def partitionTasks(tasks, costs, num_partitions, slack=BALANCE_SLACK):
+    """Greedily assigns Tasks (in the order they were added) to partitions. Returns {id: partition}"""
+
+    total = sum(costs[t.id] for t in tasks)
+    limit = (1 + slack) * total / num_partitions
+
+    load = [0.0] * num_partitions
+    assignment = {}
+
+    for t in sorted(tasks, key=lambda t: t.id):
+        cost = costs[t.id]
+
+        # number of dependencies already placed in each partition
+        affinity = [0.0] * num_partitions
+        for dep in t.dependencies:
+            p = assignment.get(dep.id)
+            if p is not None:
+                affinity[p] += 1
+
+        candidates = [p for p in range(num_partitions) if affinity[p] > 0 and load[p] + cost <= limit]
+        if len(candidates) > 0:
+            best = max(candidates, key=lambda p: (affinity[p], -load[p]))
+        else:
+            best = min(range(num_partitions), key=lambda p: load[p])
+
+        assignment[t.id] = best
+        load[best] += cost
+
+    return assignment
+
+
+def makePlan(pipeline, num_partitions):
+    """Partitions the uncached Tasks of a Pipeline. Returns the plan as a json friendly dictionary"""
+
+    tasks = [t for t in pipeline.Tasks if not t.done()]
+
+    by_hash, by_function = historicalCosts(pipeline.cache.path, pipeline.name)
+    costs = estimateCosts(tasks, by_hash, by_function)
+    assignment = partitionTasks(tasks, costs, num_partitions)
+
+    load = [0.0] * num_partitions
+    counts = [0] * num_partitions
+    for t in tasks:
+        load[assignment[t.id]] += costs[t.id]
+        counts[assignment[t.id]] += 1
+
+    cut = sum(
+        1 for t in tasks for dep in t.dependencies
+        if dep.id in assignment and assignment[dep.id] != assignment[t.id]
+    )
+
+    return {
+        "name": pipeline.name,
+        "partitions": num_partitions,
+        "historical_timing": len(by_function) > 0,
+        "tasks": {t.getHashCode(): assignment[t.id] for t in tasks},
+        "load": load,
+        "counts": counts,
+        "cut_edges": cut,
+    }
+
+
+def savePlan(filepath, plan):
+    with open(filepath, "w") as f:
+        json.dump(plan, f, indent=1)
+
+
+def loadPlan(filepath):
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def formatPlan(plan):
+    timing = "recorded compute times" if plan["historical_timing"] else "equal Task costs (no stats from earlier runs)"
+    out = f"{sum(plan['counts'])} Tasks in {plan['partitions']} partitions, balanced by {timing}\n"
+    out += f"{plan['cut_edges']} dependencies cross partitions\n\n"
+    out += "partition   tasks   expected time (s)\n"
+    for p in range(plan["partitions"]):
+        out += f"{p:9d}   {plan['counts'][p]:5d}   {plan['load'][p]:.3f}\n"
+    return out
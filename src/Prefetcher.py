@@ -0,0 +1,106 @@
+"""
+Prefetching of dependency results
+
+Normally a Task loads the results of its dependencies one after another when it starts
+running. With prefetch=True the Pipeline asks a Prefetcher to start loading the dependencies
+of the running Task and the next few Tasks assigned to the same process on a pool of
+background threads, so that large results are read in parallel and while other Tasks compute.
+
+To keep prefetching from blowing up memory, at most max_bytes worth of results (measured by
+their size in the cache) are loaded ahead of the Tasks that need them. Dependencies that don't
+fit in the budget are simply loaded the usual way when the Task runs. A prefetched result stays
+reserved until every Task it was prefetched for has finished, and is then dropped from memory.
+
+Prefetch threads only ever load results. A damaged result is left for the process to run
+again when a Task actually needs it, and failures are logged as warnings.
+"""
+
+import threading
+from .Logger import warn
+
+class Prefetcher:
+    """Loads dependency results from the Cache on background threads before they are needed"""
+
+    def __init__(self, max_workers=4, max_bytes=1024**3):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.max_bytes = max_bytes
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ndustria-prefetch")
+
+        # bytes reserved by each prefetched dependency, and the ids of the Tasks waiting for it
+        self.reserved = {}
+        self.holders = {}
+        self.reserved_bytes = 0
+        self.lock = threading.Lock()
+
+    def prefetch(self, task):
+        """Starts loading any dependencies of task that are done but not in memory yet"""
+
+        for dep in task.dependencies:
+
+            with self.lock:
+                # already on its way, task just waits for it too
+                if id(dep) in self.reserved:
+                    self.holders[id(dep)].add(task.id)
+                    continue
+
+            # results that aren't persisted are computed, not loaded
+            if not dep.done() or not dep.persist or dep.result is not None:
+                continue
+
+            nbytes = dep.pipeline.cache.sizeOf(dep)
+
+            with self.lock:
+                if self.reserved_bytes + nbytes > self.max_bytes:
+                    continue
+                self.reserved[id(dep)] = nbytes
+                self.holders[id(dep)] = {task.id}
+                self.reserved_bytes += nbytes
+
+            future = self.pool.submit(load, dep)
+            future.add_done_callback(lambda f, dep=dep: report(f, dep))
+    # end prefetch
+
+    def release(self, task):
+        """Called once a Task is done with its dependencies. Prefetched results no other upcoming Task
+        is waiting for are dropped from memory, they can be loaded again from the Cache, and their
+        budget is returned
+        """
+        dropped = []
+        with self.lock:
+            for dep in task.dependencies:
+                holders = self.holders.get(id(dep))
+                if holders is None:
+                    continue
+
+                holders.discard(task.id)
+                if len(holders) == 0:
+                    del self.holders[id(dep)]
+                    self.reserved_bytes -= self.reserved.pop(id(dep))
+                    dropped.append(dep)
+
+        for dep in dropped:
+            with dep.load_lock:
+                dep.result = None
+    # end release
+# end Prefetcher
+
+
+def load(dep):
+    """Loads a result without ever running its Task. A damaged result is left for the process to
+    run again once it actually needs it, see Task.getResult"""
+    from .Cache import CorruptResultError
+
+    with dep.load_lock:
+        if dep.result is not None or dep.load_error is not None:
+            return
+        try:
+            dep.result = dep.pipeline.cache.load(dep)
+        except CorruptResultError as e:
+            dep.load_error = e
+
+
+def report(future, dep):
+    e = future.exception()
+    if e is not None:
+        warn(f"Prefetching the result of {dep.getString()} failed: {type(e).__name__} {e}")
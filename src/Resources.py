@@ -0,0 +1,64 @@
+"""
+Limits on the threads and CPUs a Task uses while it runs
+
+NumPy's BLAS library (OpenBLAS, MKL, ...) and anything using OpenMP start one thread per core
+of the machine by default. With several ndustria processes on one node every one of them does
+so, and the node ends up running many times more threads than it has cores.
+
+For a Task added with AddFunction(cores=k), the Pipeline runs the Task inside limitResources,
+which for the duration of the Task
+- limits BLAS and OpenMP thread pools to k threads, with threadpoolctl if it is installed,
+  otherwise through the usual environment variables (which only affect libraries that haven't
+  started their thread pools yet)
+- pins the process to the k CPUs the scheduler gave the Task, where the OS supports it
+and puts everything back afterwards.
+"""
+
+import os
+from contextlib import contextmanager
+
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+@contextmanager
+def limitResources(cores, cpus=None):
+    """Limits thread pools to cores threads and pins the process to cpus (a list of CPU ids) while active"""
+
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(cores)
+
+    saved_affinity = None
+    if cpus is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            saved_affinity = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            # e.g. CPUs outside this process's cgroup
+            saved_affinity = None
+
+    try:
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            yield
+        else:
+            with threadpool_limits(limits=cores):
+                yield
+
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+        if saved_affinity is not None:
+            os.sched_setaffinity(0, saved_affinity)
+# end limitResources
@@ -0,0 +1,138 @@
+"""
+Assignment of ready Tasks to the processes of a parallel Pipeline
+
+Most Tasks run on a single process, but a Task added with AddFunction(ranks=N) is itself
+MPI parallel and runs on a group of N processes at once, sharing a sub-communicator.
+
+Each iteration of Pipeline.run(), the Tasks that are ready are laid out on a timeline of
+unit steps per process. Multi-rank Tasks are placed first, largest first, on the block of
+contiguous ranks that is free the earliest; single-rank Tasks then fill in around them on
+whichever process is least busy. Every process computes the same schedule, and runs its
+Tasks in the order of their start step, so the members of a group reach their shared Task
+in the same order and no group can wait on another in a cycle.
+
+Tasks added with AddFunction(cores=k) use k cores on each of their processes. Tasks placed
+on the same step of processes sharing a node may use at most as many cores as the node has,
+so a Task that needs more than is left waits for a later step (on any process), and every
+Task with a cores hint is given its own set of CPUs of the node to run on. Tasks take very
+different times, so this only holds if the processes of a node go through those steps together:
+Pipeline.run() has them meet at a barrier before and after each step holding a Task with a
+cores hint on their node. Other steps, and processes on other nodes, don't wait for each other.
+
+With only single-rank Tasks and no cores hints this reduces to the round robin assignment
+ndustria always used.
+
+A Task asking for more ranks than the Pipeline has runs on all of them, with a warning.
+"""
+
+from .Logger import error
+
+def groupStarts(size, ranks):
+    """First ranks of the blocks a Task needing ranks processes may use"""
+    if size % ranks == 0:
+        # aligned blocks, so different groups don't overlap partially
+        return range(0, size, ranks)
+    return range(0, size - ranks + 1)
+
+
+def scheduleIteration(tasks, size, nodes=None, node_cpus=None, report=True):
+    """Assigns Tasks to processes.
+
+    Keyword arguments:
+    nodes -- Index of the node each rank runs on. Defaults to all ranks sharing one node
+    node_cpus -- List of the CPU ids of each node. If None, cores are not limited
+    report -- If True, Tasks that ask for more ranks than there are get a warning. Every process computes the schedule, so only one should report
+
+    Returns {rank: [(task, group, cpus, step), ...]} where group is the tuple of ranks running 
+    the Task, cpus the list of CPUs this rank should run it on (None if the Task has no cores
+    hint) and step the step it was placed on. Each list is in the order the Tasks should be run.
+    CPUs are only shared out correctly if no process of a node starts a step with a cores hint
+    before the others have finished the previous one, or the step after before it's finished.
+    """
+    if nodes is None:
+        nodes = [0] * size
+
+    load = [0] * size
+    used = {}   # cores in use by (node, step)
+    placed = []
+
+    def cores(task):
+        return task.cores if task.cores is not None else 1
+
+    def fits(group, step, k):
+        for rank in group:
+            node = nodes[rank]
+            in_use = used.get((node, step), 0)
+            # a Task bigger than the node still runs, just on an otherwise empty step
+            if node_cpus is not None and in_use > 0 and in_use + k * group_count(group, node) > len(node_cpus[node]):
+                return False
+        return True
+
+    def group_count(group, node):
+        return sum(1 for rank in group if nodes[rank] == node)
+
+    def earliest(group, k):
+        step = max(load[rank] for rank in group)
+        while not fits(group, step, k):
+            step += 1
+        return step
+
+    def place(task, group, step):
+        k = cores(task)
+        cpus = {}
+        for rank in group:
+            node = nodes[rank]
+            offset = used.get((node, step), 0)
+            used[(node, step)] = offset + k
+            load[rank] = step + 1
+
+            if task.cores is not None and node_cpus is not None:
+                available = node_cpus[node]
+                cpus[rank] = [available[(offset + i) % len(available)] for i in range(k)]
+
+        placed.append((step, task.id, task, group, cpus))
+
+    multi = sorted([t for t in tasks if t.ranks > 1], key=lambda t: (-t.ranks, t.id))
+    single = [t for t in tasks if t.ranks <= 1]
+
+    for task in multi:
+        ranks = min(task.ranks, size)
+        if ranks < task.ranks and report:
+            error(f"{task.getString()} asks for {task.ranks} ranks but the Pipeline only has {size}. Running it on {size}", fatal=False, task=task)
+
+        best = None
+        for first in groupStarts(size, ranks):
+            block = range(first, first + ranks)
+            start = earliest(block, cores(task))
+            idle = sum(start - load[i] for i in block)
+            if best is None or (start, idle) < best[:2]:
+                best = (start, idle, first)
+
+        start, idle, first = best
+        place(task, tuple(range(first, first + ranks)), start)
+
+    for task in single:
+        start, rank = min((earliest((rank,), cores(task)), rank) for rank in range(size))
+        place(task, (rank,), start)
+
+    schedule = {rank: [] for rank in range(size)}
+    for step, task_id, task, group, cpus in sorted(placed, key=lambda p: p[:2]):
+        for rank in group:
+            schedule[rank].append((task, group, cpus.get(rank), step))
+
+    return schedule
+
+
+def nodeBarriers(schedule, nodes, rank):
+    """Steps of a schedule made by scheduleIteration that the processes on the node of rank may 
+    only start once all of them finished the step before: those holding a Task with a cores hint
+    on the node, and the steps right after them. Every process of the node gets the same list
+    """
+    on_node = [
+        entry for other, entries in schedule.items() if nodes[other] == nodes[rank] 
+        for entry in entries
+    ]
+    last = max((step for task, group, cpus, step in on_node), default=0)
+    hinted = set(step for task, group, cpus, step in on_node if task.cores is not None)
+
+    return sorted(set(s for s in hinted if s > 0) | set(s + 1 for s in hinted if s < last))
@@ -0,0 +1,339 @@
+"""
+Speculative backup copies of straggling Tasks
+
+On shared clusters a few Tasks can end up on slow or overloaded nodes and take many times
+longer than the same function usually does, while every other process sits idle at the end
+of the iteration waiting for them. With Pipeline(parallel=True, speculative=True)
+
+- Tasks run in the process itself, as they do without speculation. A single-rank Task that
+  could be backed up leaves a marker file in <cache>/running/ recording when it started
+- processes that are done with their Tasks for the iteration watch the markers while they
+  wait for the others. Once a Task has run speculative_factor times longer than expected
+  (its compute time in earlier runs, else the mean of its function, see Planner.historicalCosts)
+  and at least speculative_min_seconds, one idle process claims it and runs a backup copy
+- whichever copy finishes first creates the commit file <cache>/running/<result>.commit,
+  naming its process, and then links its result into the Cache, so the result is committed
+  exactly once. A watcher thread of the other copy notices and interrupts it with
+  BackupFinished, raised in the main thread by a signal handler
+
+Tasks of functions that have never been timed, Tasks expected to finish in less than
+min_seconds / factor, which a backup could never help much, Tasks whose results aren't
+saved and Tasks with an output directory (see Artifact.py) are never backed up.
+
+Python only runs signal handlers between bytecodes of the main thread, so a copy that is
+busy in a long call into compiled code (e.g. a large numpy operation) is interrupted once
+that call returns. A Task whose user_function catches BaseException, e.g. with a bare except:,
+can swallow the interruption and run to the end, losing the commit. Copies of Pipelines
+that don't run in the main thread can't be interrupted at all and always run to the end.
+
+Needs signal.pthread_kill, so not available on Windows.
+"""
+
+import json, os, signal, socket, threading, time
+from .Logger import log, warn
+from .Metrics import TaskMetrics
+from .Task import DONE, RUNNING
+
+RUNNING_DIR = "running"
+"""Subdirectory of the cache holding the markers of running Tasks and claims on their backups"""
+
+POLL_INTERVAL = 0.05
+"""Seconds between checks on running copies and markers"""
+
+INTERRUPT_SIGNAL = getattr(signal, "SIGUSR2", None)
+"""Signal the watcher thread sends to the main thread to interrupt a copy"""
+
+def canInterrupt():
+    return hasattr(signal, "pthread_kill") and INTERRUPT_SIGNAL is not None
+
+
+def commitFile(cache, cache_fname):
+    """File whose exclusive creation commits a result of a Task that may have another copy running"""
+    return os.path.join(cache.path, RUNNING_DIR, f"{os.path.basename(cache_fname)}.commit")
+
+
+def processName(pid):
+    """How commit files name the process that created them"""
+    return f"{socket.gethostname()}:{pid}"
+
+
+class BackupFinished(BaseException):
+    """Raised in a copy of a Task once another copy has committed its result.
+
+    Like KeyboardInterrupt, it isn't caught by except Exception clauses of the Pipeline or the user_function
+    """
+
+
+class Speculator:
+    """Runs the Tasks of one process and backs up the straggling Tasks of other processes"""
+
+    def __init__(self, pipeline, factor=3.0, min_seconds=10.0):
+        """Keyword arguments:
+        factor -- A Task is backed up once it has run this many times longer than expected
+        min_seconds -- Tasks are never backed up before they have run this many seconds
+        """
+        from .Planner import historicalCosts
+
+        self.pipeline = pipeline
+        self.cache = pipeline.cache
+        self.rank = pipeline.getCommRank()
+        self.factor = factor
+        self.min_seconds = min_seconds
+
+        costs = None
+        if pipeline.isRoot():
+            costs = historicalCosts(self.cache.path, pipeline.name)
+        self.by_hash, self.by_function = pipeline.comm.bcast(costs, root=0)
+
+        self.path = os.path.join(self.cache.path, RUNNING_DIR)
+        os.makedirs(self.path, exist_ok=True)
+
+        # the claim files this process made and the commit files of its Tasks
+        self.claims = []
+        self.commits = []
+
+        # the Task whose copy is running here, and the Task another copy finished first
+        self.current = None
+        self.finished_elsewhere = None
+
+        # signal handlers can only be installed, and only run, in the main thread
+        self.main_ident = None
+        self.previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            self.main_ident = threading.get_ident()
+            self.previous_handler = signal.signal(INTERRUPT_SIGNAL, self.interrupt)
+        elif pipeline.isRoot():
+            warn("Speculative copies of Tasks can only be interrupted if the Pipeline runs in the main thread. Copies that lose will run to the end")
+
+        self.launched = 0
+        self.won = 0
+
+    def close(self):
+        """Restores the signal handler that was there before"""
+        if self.main_ident is not None:
+            signal.signal(INTERRUPT_SIGNAL, self.previous_handler)
+            self.main_ident = None
+
+    def expectedTime(self, task):
+        """Expected compute time of a Task, None if it was never timed"""
+        expected = self.by_hash.get(task.getHashCode())
+        if expected is None:
+            expected = self.by_function.get(task.user_function.__name__)
+        return expected
+
+    def markerFile(self, task):
+        return os.path.join(self.path, task.getFilename())
+
+    def isCandidate(self, task):
+        """True if a Task may be backed up"""
+        # copies of Tasks with an output directory would write to the same files
+        if task.ranks > 1 or task.artifacts or not task.persist or task.getFilename() is None:
+            return False
+
+        # a Task expected to take far less than min_seconds would have to be slowed down
+        # enormously before a backup started, and then wouldn't gain much
+        expected = self.expectedTime(task)
+        return expected is not None and expected * self.factor >= self.min_seconds
+
+    def run(self, task, target):
+        """Runs a Task of this process with target(). If it may be backed up, its marker tells
+        idle processes since when, and it is interrupted if a backup copy commits the result first
+        """
+        if not self.isCandidate(task):
+            target()
+            return
+
+        # a result or commit of an earlier run would win the race before the Task even started
+        cache_fname = self.cache.getFullPathToTask(task)
+        stale = [commitFile(self.cache, cache_fname)]
+        if task.rerun:
+            stale.append(cache_fname)
+        for fname in stale:
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+        self.commits.append(stale[0])
+
+        marker = self.markerFile(task)
+        with open(marker, "w") as f:
+            json.dump({"start": time.time(), "rank": self.rank, "host": socket.gethostname()}, f)
+
+        try:
+            # nothing to watch for until an idle process claimed the backup
+            backed_up = lambda: os.path.exists(f"{marker}.backup")
+            if not self.runCopy(task, target, backed_up):
+                task.result = None
+                task.status = DONE
+                self.cache.onDisk(task)
+                log(f"[Rank {self.rank}] a backup copy of {task.getString()} finished first, interrupted this one")
+        finally:
+            try:
+                os.remove(marker)
+            except FileNotFoundError:
+                pass
+    # end run
+
+    def runCopy(self, task, target, raced):
+        """Runs one copy of a Task with target() while a watcher thread checks whether
+        another copy committed the result. raced() tells the watcher if there may be one.
+
+        Returns False if the copy was interrupted because the other one finished first
+        """
+        cache_fname = self.cache.getFullPathToTask(task)
+
+        # only the first copy to create the commit file saves its result, see Cache.storeBlob
+        self.cache.exclusive.add(cache_fname)
+
+        watcher = None
+        stop = threading.Event()
+        if self.main_ident is not None:
+            watcher = threading.Thread(target=self.watch, args=(task, cache_fname, raced, stop), daemon=True)
+
+        self.finished_elsewhere = None
+        interrupted = False
+        try:
+            self.current = task
+            if watcher is not None:
+                watcher.start()
+            target()
+        except BackupFinished:
+            interrupted = True
+        finally:
+            # a signal arriving from here on is ignored
+            self.current = None
+            stop.set()
+            if watcher is not None:
+                watcher.join()
+
+        return not interrupted
+    # end runCopy
+
+    def watch(self, task, cache_fname, raced, stop):
+        """Interrupts the copy of task running in the main thread once another copy committed it"""
+        commit = commitFile(self.cache, cache_fname)
+        me = processName(os.getpid())
+
+        while not stop.wait(POLL_INTERVAL):
+            if not raced():
+                continue
+
+            try:
+                with open(commit, "r") as f:
+                    committer = f.read()
+            except FileNotFoundError:
+                continue
+
+            # still being written
+            if committer == "":
+                continue
+
+            # this copy won, there's nothing left to interrupt
+            if committer == me:
+                return
+
+            # the other copy's result is linked into the Cache right after its commit
+            if os.path.exists(cache_fname):
+                self.finished_elsewhere = task
+                signal.pthread_kill(self.main_ident, INTERRUPT_SIGNAL)
+                return
+    # end watch
+
+    def interrupt(self, signum, frame):
+        """Signal handler raising BackupFinished in the copy of a Task that lost the race"""
+        task = self.current
+
+        # a copy that's done computing saves a result that loses the commit, which is harmless
+        if task is not None and task is self.finished_elsewhere and task.status == RUNNING:
+            self.current = None
+            raise BackupFinished()
+    # end interrupt
+
+    def waitForOthers(self, comm, tasks):
+        """Waits for the other processes at the end of an iteration, backing up their
+        straggling Tasks in the meantime. tasks are the Tasks of this iteration
+        """
+        request = comm.Ibarrier()
+        while not request.Test():
+            self.launchBackup(tasks)
+            time.sleep(POLL_INTERVAL)
+
+        # every process has stopped its backups once everyone got here, and won't look at
+        # the commit files any more
+        comm.Barrier()
+
+        for claim in self.claims + self.commits:
+            try:
+                os.remove(claim)
+            except FileNotFoundError:
+                pass
+        self.claims = []
+        self.commits = []
+        self.cache.exclusive.clear()
+    # end waitForOthers
+
+    def launchBackup(self, tasks):
+        """Runs a backup copy of the first straggling Task no other process has claimed yet"""
+        now = time.time()
+
+        for task in tasks:
+            if not self.isCandidate(task):
+                continue
+
+            expected = self.expectedTime(task)
+
+            marker = self.markerFile(task)
+            try:
+                with open(marker, "r") as f:
+                    started = json.load(f)
+            except (FileNotFoundError, ValueError):
+                # not started yet, finished, or the marker is still being written
+                continue
+
+            if started["rank"] == self.rank or now - started["start"] < max(self.min_seconds, self.factor * expected):
+                continue
+
+            if self.cache.onDisk(task):
+                continue
+
+            # only one process gets to back up each Task
+            claim = f"{marker}.backup"
+            try:
+                os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                continue
+            self.claims.append(claim)
+
+            log(f"[Rank {self.rank}] {task.getString()} has been running on rank {started['rank']} for {now - started['start']:.1f} seconds, {expected:.1f} expected. Starting a backup copy")
+            self.launched += 1
+            self.runBackup(task)
+            return
+    # end launchBackup
+
+    def runBackup(self, task):
+        """Runs a backup copy of a Task of another process until it or the original commits the result"""
+        # only a copy that wins reports its metrics, the original reports the others
+        status, metrics = task.status, task.metrics
+        task.metrics = TaskMetrics()
+
+        won = False
+        try:
+            if self.runCopy(task, lambda: self.pipeline.runTask(task, (self.rank,)), lambda: True):
+                self.cache.wait()
+                won = task.getFilename() not in self.cache.lost
+        except Exception as e:
+            warn(f"Backup copy of {task.getString()} failed: {type(e).__name__} {e}")
+
+        # the result stays in the Cache until something needs it
+        task.result = None
+
+        if won:
+            task.status = DONE
+            self.cache.onDisk(task)
+            self.won += 1
+            log(f"[Rank {self.rank}] backup copy of {task.getString()} finished first")
+        else:
+            task.status, task.metrics = status, metrics
+            log(f"[Rank {self.rank}] stopped the backup copy of {task.getString()}, the original finished first")
+    # end runBackup
+# end Speculator
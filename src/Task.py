@@ -30,9 +30,10 @@ or any of the dependencies change, the Cache will not be able to find a result f
 and the Task will be rerun. 
 """
 
-import inspect, hashlib, time, tracemalloc
-from line_profiler import LineProfiler
+import inspect, hashlib, time, threading, copy, weakref
 from .Logger import log, warn
+from .Metrics import TaskMetrics
+from .File import usingStore
 
 import sys
 
@@ -42,6 +43,11 @@ READY   = 1 # all dependencies finished, ready to execute
 RUNNING = 2 # currently running
 DONE    = 3 # finished running, result in memory
 
+# Longest str() of a Task before it is shortened to the function name and hashcode.
+# Tasks are part of the hashcodes of the Tasks that use them through their strings,
+# so this only changes the hashcodes of Tasks depending on a Task with a longer string
+MAX_STRING = 65536
+
 class Task:
     """A Task is a the smallest unit of work performed by an analysis Pipeline"""
     def __init__(self, id,
@@ -49,7 +55,12 @@ class Task:
         args, 
         kwargs, 
         pipeline,
-        rerun=False
+        rerun=False,
+        ranks=1,
+        cores=None,
+        artifacts=False,
+        persist=True,
+        hashcode=None
     ):
         """Initializes a new Task. Should not be called directly. Instead use the @AddTask decorator.
 
@@ -58,93 +69,118 @@ class Task:
         args -- A list of positional arguments to pass to the function. 
         kwargs -- A list of keyword arguments to pass to the function.
         pipeline -- A reference to the pipeline this Task belongs to. Not strictly necessary since the Pipeline is a static singleton but whatev
+        rerun -- If True, ignores any cached result
+        ranks -- Number of MPI processes that run this Task together, see run()
+        cores -- Number of cores this Task uses on each process, None if unknown. See Scheduler.py and Resources.py
+        artifacts -- If True, the function gets a directory in the Cache to write files to as the keyword argument output_dir. See Artifact.py
+        persist -- If False, the result is never saved to the Cache. It is computed when getResult() is first called and kept in memory until the consumers are done
+        hashcode -- The hashcode of the Task if the caller already computed it with callHashCode()
         """
         
+        self.id = id
         self.user_function = user_function
         self.args = args
         self.kwargs = kwargs
         self.pipeline = pipeline
+        self.rerun = rerun
+        self.ranks = ranks
+        self.cores = cores
+        self.artifacts = artifacts
+        self.persist = persist
+
+        # Tasks using the result of this one, only tracked if it isn't persisted
+        self.consumers = []
 
         # Run statistics i.e. wall clock time and memory
         self.wallTime = 0
         self.initial_mem = 0
         self.peak_mem = 0
         self.final_mem = 0
-        self.line_profile = LineProfiler()
+        self.line_profile = None
+
+        # Per phase timings and byte counts, see Metrics.py
+        self.metrics = TaskMetrics()
 
         # True if the Task has no dependencies
         self.indepedent = True
 
-        # any arguments that are Task objects are dependencies that need to be
-        # tracked by the dependencies list
-        # TODO: May want to check for kwargs as well
+        # any Task objects in the arguments, including inside lists, tuples and dicts 
+        # and in keyword arguments, are dependencies that need to be tracked by the 
+        # dependencies list, in the order they appear. with_tasks records which arguments
+        # contain them, so only those need to be resolved when the Task runs
         self.dependencies = []
-        for a in self.args:
+        self.with_tasks = set()
+        for i, a in enumerate(self.args):
+            if findTasks(a, self.dependencies):
+                self.with_tasks.add(i)
+
+        for k, v in self.kwargs.items():
+            if findTasks(v, self.dependencies):
+                self.with_tasks.add(k)
 
-            if Task.isTask(a):
-                self.indepedent = False
-                self.dependencies.append(a)
-            elif Task.isListOfTasks(a): 
-                self.indepedent = False
-                for t in a:
-                    self.dependencies.append(t)
+        if len(self.dependencies) > 0:
+            self.indepedent = False
 
         # name of the file or files where this Task's data is stored
         self.filename = None
 
+        # str() of this Task, built when it's first needed
+        self.display_string = None
+
         # assign this Task its hashcode
-        self.hashcode = ""
+        self.hashcode = hashcode if hashcode is not None else ""
         self.getHashCode()
 
+        # In content hash mode, the key this Task is cached under is derived from the
+        # digests of its dependencies' results, which may not be known yet. See getCacheKey
+        self.cachekey = None
+
+        # digest of the pickled result, see getDigest
+        self.digest = None
+
         # reference to the data product this Task makes
         self.result = None
+
+        # guards loading the result, which may happen on a prefetch thread
+        self.load_lock = threading.Lock()
+
+        # CorruptResultError a prefetch thread ran into while loading the result
+        self.load_error = None
+
         self.status = WAITING
 
-        # figure out if this Task has a result in cache already and load it
-        if rerun != True and self.pipeline.cache.exists(self):
+        # figure out if this Task has a result in cache already. The result itself
+        # is only loaded once something asks for it with getResult()
+        self.probed = False
+        self.probeCache()
+
+        # never scheduled on their own, but run by getResult() whenever a consumer needs them
+        if not self.persist:
             self.status = DONE
-            self.getResult()
             
     # end __init__      
         
 
     def __str__(self):
-        """Returns the Task name, arguments, and dependencies as a string.
-        
-            Also encodes the Task's current status like so:
-            W = Waiting on dependencies
-            P = Dependencies complete, ready to be run
-            R = Running
-            D = Done
-        """
-        status_codes = {
-            WAITING: "W",
-            READY: "P",
-            RUNNING : "R",
-            DONE : "D"
-        }
-        debug_string = f"{self.user_function.__name__}("
-        for i, a in enumerate(self.args):
-            debug_string += str(a)
-
-            if i == len(self.args)-1 and len(self.kwargs) == 0:
-                debug_string += ")"
-            else:
-                debug_string += ", "
+        """Returns the Task name and arguments, with the strings of any dependencies, as a string.
 
-        i = 0
-        for k,v in self.kwargs.items():
-            debug_string += f"{str(k)}={str(v)}"
+        Strings longer than MAX_STRING characters are replaced by the name and the hashcode.
+        """
+        if self.display_string is not None:
+            return self.display_string
 
-            if i == len(self.kwargs.items())-1:
-                debug_string += ")"
-            else:
-                debug_string += ", "
-            i+=1
+        with usingStore(self.pipeline.cache.fingerprints):
+            parts = [str(a) for a in self.args]
+            parts.extend(f"{str(k)}={str(v)}" for k,v in self.kwargs.items())
+        debug_string = f"{self.user_function.__name__}(" + ", ".join(parts) + ")"
 
-        if not debug_string.endswith(")"):
-            debug_string += ")"
+        # the arguments of a Task are part of the strings of the Tasks that use it, 
+        # which would grow exponentially through DAGs that split and join again
+        if len(debug_string) > MAX_STRING:
+            debug_string = f"{self.user_function.__name__}<{self.getHashCode()}>"
 
+        # arguments can't change, so this is only built once, when it's first needed
+        self.display_string = debug_string
         return debug_string
 
     def __repr__(self):
@@ -173,18 +209,35 @@ class Task:
 
         return self.getResult().__iter__()
 
-    def run(self):
-        """Runs the Task by calling its user_function with the supplied arguments and any dependency data"""
+    def run(self, comm=None):
+        """Runs the Task by calling its user_function with the supplied arguments and any dependency data
+
+        Multi-rank Tasks are run by every process of a group. comm is the group's communicator, 
+        which is passed on to the user_function as the keyword argument comm. Only the result
+        of rank 0 of the group is saved.
+        """
         self.status = RUNNING
-        arguments, kwarguments = Task.parseArgs(self.args, self.kwargs)
+        arguments, kwarguments = Task.parseArgs(self.args, self.kwargs, self.with_tasks)
+
+        if self.ranks > 1:
+            kwarguments["comm"] = comm
+
+        if self.artifacts:
+            # the processes of a group share the directory, only one of them empties it
+            is_first = comm is None or comm.Get_rank() == 0
+            kwarguments["output_dir"] = self.pipeline.cache.artifactDir(self, clear=is_first)
+            if comm is not None:
+                comm.Barrier()
 
         if self.pipeline.timeit: 
             start = time.time()
 
         if self.pipeline.memcheck:
+            import tracemalloc
             self.initial_mem, self.peak_mem = tracemalloc.get_traced_memory()
         
         if self.pipeline.profiling:
+            from line_profiler import LineProfiler
             lp = LineProfiler()
             lp_wrapper = lp(self.user_function)
             lp_wrapper(*arguments, **kwarguments)
@@ -194,15 +247,16 @@ class Task:
         # Run the actual function
         ###################################################################
 
+        compute_start = time.perf_counter()
         self.result = self.user_function(*arguments, **kwarguments)   
+        self.metrics.add("compute", time.perf_counter() - compute_start)
+        self.metrics.ran = True
 
         ###################################################################
-        # If the result is a string, assume its a filename
+        # Results are saved under the hashcode, including paths of files 
+        # the Task wrote, see File.py
         ###################################################################
-        if type(self.result) == str:
-            self.filename = self.result
-
-        elif self.result is None:
+        if self.result is None:
             warn("A Task was run but did not return a result.")
             self.result = "no_result"
             self.filename = self.result
@@ -211,23 +265,107 @@ class Task:
             self.wallTime = time.time() - start
 
         if self.pipeline.memcheck:
+            import tracemalloc
             self.final_mem, self.peak_mem = tracemalloc.get_traced_memory()
             
         ###################################################################
         # Save the result
         ###################################################################
         self.status = DONE
-        self.pipeline.cache.save(self)
+        self.releaseDependencies()
+
+        if not self.persist:
+            # kept in memory for the consumers only
+            return
+
+        if comm is None or comm.Get_rank() == 0:
+            self.pipeline.cache.save(self)
+        else:
+            # loaded from the Cache if this process needs it later
+            self.result = None
 
 
+    def releaseDependencies(self):
+        """Drops the results of dependencies that aren't persisted once all of their consumers are done"""
+        for dep in self.dependencies:
+            if not dep.persist and all(task.done() for task in dep.consumers):
+                dep.result = None
+
+    def probeCache(self):
+        """Marks this Task done if its result is already in the Cache. 
+
+        Only probes once, and only once the key the result would be cached under is known.
+        Returns True if the result was found.
+        """
+        if self.probed or not self.persist or self.getFilename() is None:
+            return False
+
+        self.probed = True
+        if self.rerun != True and self.pipeline.cache.exists(self):
+            self.status = DONE
+            self.metrics.cache_hit = True
+            return True
+
+        return False
+
     def getFilename(self):
         """Returns the filename in the cache that this Task saves to. May not necessarily be the same as the Task hashcode.
+
+        Returns None in content hash mode while the results of the dependencies are still unknown.
         """
         if self.filename == None:
-            return self.getHashCode()
+            return self.getCacheKey()
         
         return self.filename
 
+    def getCacheKey(self):
+        """Returns the key this Task's result is cached under.
+
+        Normally this is just the hashcode. If the Pipeline was created with content_hash=True,
+        dependent Tasks are keyed by the digests of their dependencies' results instead of their
+        hashcodes. A dependency that is rerun but produces byte-identical output then leaves the key 
+        of everything downstream unchanged, which cuts off the recomputation of the whole subtree.
+        Returns None if the digest of a dependency isn't known yet.
+        """
+
+        if not self.pipeline.content_hash or self.indepedent:
+            return self.getHashCode()
+
+        if self.cachekey is not None:
+            return self.cachekey
+
+        digests = ""
+        for task in self.dependencies:
+            digest = task.getDigest()
+            if digest is None:
+                return None
+            digests += digest
+
+        self.cachekey = hashlib.md5(self.hashTarget(digests).encode()).hexdigest()
+        return self.cachekey
+
+    def getDigest(self):
+        """Returns the digest of this Task's pickled result, or None if it isn't done yet"""
+
+        if self.digest is not None:
+            return self.digest
+
+        # there's no result to hash, but what it was computed from identifies it just as well
+        if not self.persist:
+            return self.getCacheKey()
+
+        if not self.done():
+            return None
+
+        # the result may still be queued for writing on this process
+        if self.metrics.ran:
+            self.pipeline.cache.wait()
+            if self.digest is not None:
+                return self.digest
+
+        self.digest = self.pipeline.cache.getDigest(self)
+        return self.digest
+
     def getResult(self):
         """ Gets the result of this task if one exists. Will return None if no result exists.
         """
@@ -238,8 +376,24 @@ class Task:
 
         if(self.result is not None):
             return self.result
-        else:
-            self.result = self.pipeline.cache.load(self)
+
+        with self.load_lock:
+            if self.result is None and not self.persist:
+                self.run()
+
+            elif self.load_error is not None:
+                # found damaged by a prefetch thread, which leaves running the Task to this one
+                e, self.load_error = self.load_error, None
+                warn(f"{e}. Running {self.getString()} again")
+                self.run()
+
+            elif self.result is None:
+                from .Cache import CorruptResultError
+                try:
+                    self.result = self.pipeline.cache.load(self)
+                except CorruptResultError as e:
+                    warn(f"{e}. Running {self.getString()} again")
+                    self.run()
 
         return self.result
 
@@ -255,6 +409,12 @@ class Task:
     def waiting(self):
         return self.status == WAITING
 
+    def available(self):
+        """True if the result can be had, either because the Task is done or because it isn't persisted and can be run right away"""
+        if self.persist:
+            return self.done()
+        return all(task.available() for task in self.dependencies)
+
     def readyToRun(self):
         """Determines whether or not this Task is ready to be run by running through its dependencies and return true if they are all marked "done"
 
@@ -266,9 +426,16 @@ class Task:
             return True
         
         for task in self.dependencies:
-            if not task.done():
+            if not task.available():
                 self.status = WAITING
                 return False
+
+        # in content hash mode the cache key is only known once the dependencies are done
+        if self.probeCache():
+            if self.pipeline.isRoot():
+                log(f"[Early cutoff] {self.getString()} is unchanged and can be skipped")
+            return False
+
         self.status = READY
         return True
 
@@ -282,59 +449,14 @@ class Task:
         if self.hashcode != "":
             return self.hashcode
 
-        # get the source code of the operation
-        source = inspect.getsource(self.user_function)
-
-        #TODO: Finish function that removes lines with comments
-        def remove_all_comments(str):
-            pass
-
-        def remove_all_whitespace(str):
-            ws_chars = [' ', '\t', '\n']
-            for char in ws_chars:
-                str = str.replace(char, '')
-            return str
-
-        # TODO: Perform a check to see if any arguments 
-        # are missing a str implementation, if possible
-        # any arguments that are pointers to objects 
-        # will cause cache invalidation due to the default
-        # str representation including the address to the object
-        # which is almost certainly going to be unique to a 
-        # given run of the code
-        # For that reason, arguments passed in to an ndustria task
-        # must be able to be uniquely represented by a call to str()
-        def append_args(target, args, kwargs):
-            for a in args:
-                target += str(a)
-
-            for k,v in kwargs.items():
-                target += str(k)+str(v)
-            return target
-
-        # Q: Is this actually a good idea? Whitespace changes code behavior in python
-        # scrap the whitespace to prevent unnecessary 
-        # re-queries
-        source_no_ws = remove_all_whitespace(source)
+        with usingStore(self.pipeline.cache.fingerprints):
+            self.hashcode = dependencyHashCode(self.user_function, self.args, self.kwargs, self.dependencies)
+        return self.hashcode
 
-        # concatenate it with the arguments
-        if self.indepedent:
-            target = append_args(source_no_ws, self.args, self.kwargs)
-        # if we have dependencies, add the hashcodes/filenames of those dependencies
-        else:
-            add_hashes = ""
-            for task in self.dependencies:
-                add_hashes += task.getHashCode()
-            
-            target = append_args(source_no_ws+add_hashes, self.args, self.kwargs)
-        
-        
-        # convert string to a hash
-        hash = hashlib.md5(target.encode()).hexdigest()
-        self.hashcode = hash
-
-        #debug(f"Created hash {hash} for {self} from string {target}")
-        return hash
+    def hashTarget(self, dependency_string):
+        """Builds the string that gets hashed, see callHashTarget"""
+        with usingStore(self.pipeline.cache.fingerprints):
+            return callHashTarget(self.user_function, self.args, self.kwargs, dependency_string)
     
     @staticmethod
     def isTask(arg):
@@ -350,33 +472,144 @@ class Task:
             and all([Task.isTask(x) for x in arg])
         )
         
-    def parseArgs(unparsed_args, unparsed_kwargs):
+    def parseArgs(unparsed_args, unparsed_kwargs, with_tasks=None):
+        """Replaces every Task in the arguments with its result. 
+
+        with_tasks -- Positions and keys of the arguments that contain Tasks. If given, the others are passed on as they are without being searched
+        """
 
         parsed_arguments = []
-        for arg in unparsed_args:
+        for i, arg in enumerate(unparsed_args):
 
-            if Task.isTask(arg):
-                parsed_arguments.append(arg.getResult())
-            elif Task.isListOfTasks(arg): 
-                new_list = [t.getResult() for t in arg]
-                parsed_arguments.append(new_list)
+            if with_tasks is None or i in with_tasks:
+                parsed_arguments.append(resolveTasks(arg))
             else:
                 parsed_arguments.append(arg)
 
         parsed_kwargs = {}
         for key, kwarg in unparsed_kwargs.items():
 
-            if Task.isTask(kwarg):
-                parsed_kwargs[key] = kwarg.getResult()
-            elif Task.isListOfTasks(kwarg): 
-                new_list = [t.getResult() for t in kwarg]
-                parsed_kwargs[key] = new_list
+            if with_tasks is None or key in with_tasks:
+                parsed_kwargs[key] = resolveTasks(kwarg)
             else:
                 parsed_kwargs[key] = kwarg
 
         
         return parsed_arguments, parsed_kwargs
     
+def callHashTarget(user_function, args, kwargs, dependency_string):
+    """Builds the string that gets hashed: the source code of the function, followed by 
+    whatever identifies the dependencies (hashcodes, or result digests in content hash mode)
+    and the arguments.
+    """
+
+    # get the source code of the operation, without whitespace
+    parts = [functionSource(user_function), dependency_string]
+
+    # TODO: Perform a check to see if any arguments 
+    # are missing a str implementation, if possible
+    # any arguments that are pointers to objects 
+    # will cause cache invalidation due to the default
+    # str representation including the address to the object
+    # which is almost certainly going to be unique to a 
+    # given run of the code
+    # For that reason, arguments passed in to an ndustria task
+    # must be able to be uniquely represented by a call to str()
+    for a in args:
+        parts.append(str(a))
+
+    for k,v in kwargs.items():
+        parts.append(str(k))
+        parts.append(str(v))
+
+    # concatenate it with the arguments
+    return "".join(parts)
+
+def dependencyHashCode(user_function, args, kwargs, dependencies):
+    """Hashcode of a call whose dependencies were already found with findTasks"""
+
+    # if we have dependencies, add the hashcodes/filenames of those dependencies
+    add_hashes = ""
+    for task in dependencies:
+        add_hashes += task.getHashCode()
+
+    # convert string to a hash
+    return hashlib.md5(callHashTarget(user_function, args, kwargs, add_hashes).encode()).hexdigest()
+
+def callHashCode(user_function, args, kwargs):
+    """Hashcode the Task calling user_function with args and kwargs would have, without creating it"""
+    dependencies = []
+    for a in args:
+        findTasks(a, dependencies)
+    for v in kwargs.values():
+        findTasks(v, dependencies)
+    return dependencyHashCode(user_function, args, kwargs, dependencies)
+
+def findTasks(arg, found):
+    """Appends every Task in arg to found, looking inside lists, tuples and the values of dicts. 
+
+    Returns True if there were any.
+    """
+    if Task.isTask(arg):
+        found.append(arg)
+        return True
+
+    if isinstance(arg, (list, tuple)):
+        items = arg
+    elif isinstance(arg, dict):
+        items = arg.values()
+    else:
+        return False
+
+    any_found = False
+    for item in items:
+        if findTasks(item, found):
+            any_found = True
+    return any_found
+
+def resolveTasks(arg):
+    """Returns a copy of arg with every Task in it, found like findTasks does, replaced by its result"""
+    if Task.isTask(arg):
+        return arg.getResult()
+
+    if isinstance(arg, list):
+        return [resolveTasks(item) for item in arg]
+
+    if isinstance(arg, tuple):
+        items = [resolveTasks(item) for item in arg]
+        if hasattr(arg, "_fields"):
+            # namedtuple
+            return type(arg)(*items)
+        return type(arg)(items)
+
+    if isinstance(arg, dict):
+        resolved = copy.copy(arg)
+        for k, v in arg.items():
+            resolved[k] = resolveTasks(v)
+        return resolved
+
+    return arg
+
+# normalized source code of each user_function, since inspect.getsource is by far the
+# slowest part of creating a Task
+_sources = weakref.WeakKeyDictionary()
+
+def functionSource(function):
+    """Source code of a function with all whitespace removed, as used in Task hashcodes"""
+    source = _sources.get(function)
+    if source is None:
+        source = inspect.getsource(function)
+
+        #TODO: Finish function that removes lines with comments
+        # Q: Is this actually a good idea? Whitespace changes code behavior in python
+        # scrap the whitespace to prevent unnecessary 
+        # re-queries
+        for char in [' ', '\t', '\n']:
+            source = source.replace(char, '')
+
+        _sources[function] = source
+    return source
+
 class TaskNotReadyError(Exception):
 
     def __init__(self, task):
@@ -0,0 +1,99 @@
+"""
+Background writer for Task results
+
+When a Pipeline is created with async_writes=True, Cache.save hands finished Tasks to an
+AsyncWriter instead of pickling them to disk right away. A background thread does the
+writing while the process moves on to its next Task, and consumers on the same process
+keep using the result that is still in memory.
+
+The writer holds at most max_pending Tasks and roughly max_bytes worth of results at a time.
+Once either limit is reached, submit() blocks until enough writes have finished, which keeps
+a fast producer from piling up unbounded amounts of memory.
+
+Since the result is pickled while the next Task is already running, Tasks should not modify
+the results of their dependencies in place when async writes are turned on.
+"""
+
+import queue, sys, threading
+
+def estimateSize(obj, _seen=None):
+    """Rough estimate of the memory held by a result, in bytes. Counts numpy buffers and containers recursively."""
+
+    if _seen is None:
+        _seen = set()
+
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    # numpy arrays and anything else exposing a buffer size
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += estimateSize(k, _seen) + estimateSize(v, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += estimateSize(v, _seen)
+    elif hasattr(obj, "__dict__"):
+        size += estimateSize(vars(obj), _seen)
+
+    return size
+
+
+class AsyncWriter:
+    """Writes Task results to the Cache on a background thread"""
+
+    def __init__(self, write_function, max_pending=4, max_bytes=2*1024**3):
+        """Keyword arguments:
+        write_function -- Called with each submitted Task on the writer thread, i.e. Cache.write
+        max_pending -- Maximum number of Tasks waiting to be written
+        max_bytes -- Maximum estimated size of all results waiting to be written. A single result larger than this is still accepted once the queue is empty
+        """
+        self.write_function = write_function
+        self.max_bytes = max_bytes
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.pending_bytes = 0
+        self.budget = threading.Condition()
+        self.errors = []
+
+        self.thread = threading.Thread(target=self._writeLoop, name="ndustria-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, task):
+        """Queues a Task to be written. Blocks while the queue or byte budget is full"""
+        nbytes = estimateSize(task.result)
+
+        with self.budget:
+            while self.pending_bytes > 0 and self.pending_bytes + nbytes > self.max_bytes:
+                self.budget.wait()
+            self.pending_bytes += nbytes
+
+        self.queue.put((task, nbytes))
+
+    def wait(self):
+        """Blocks until every queued Task has been written. Returns the (task, exception) pairs of failed writes"""
+        self.queue.join()
+
+        errors = self.errors
+        self.errors = []
+        return errors
+
+    def _writeLoop(self):
+        while True:
+            task, nbytes = self.queue.get()
+            try:
+                self.write_function(task)
+            except Exception as e:
+                self.errors.append((task, e))
+            finally:
+                with self.budget:
+                    self.pending_bytes -= nbytes
+                    self.budget.notify_all()
+                self.queue.task_done()
+# end AsyncWriter
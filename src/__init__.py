@@ -2,6 +2,7 @@ from . import Logger
 from .Task import Task
 from .Cache import Cache
 from .Pipeline import Pipeline
+from .File import File
 
 import os
 
@@ -0,0 +1,68 @@
+"""
+Shared setup of the tests
+
+The repository is the ndustria package itself, meant to be cloned as ~/ndustria, so it is
+imported here under that name wherever it was checked out. Run the tests from the top of
+the repository with
+
+    python -m pytest tests
+"""
+
+import importlib.util, os, shutil, subprocess, sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "ndustria" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        "ndustria", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["ndustria"] = module
+    spec.loader.exec_module(module)
+
+from ndustria import Pipeline
+
+
+@pytest.fixture(autouse=True)
+def freshTasks():
+    """Tasks are kept on the Pipeline class, so every test starts without any"""
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+    yield
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+
+@pytest.fixture
+def makePipeline(tmp_path):
+    """Returns a function creating serial Pipelines with their cache in tmp_path"""
+    def make(cache="cache", **kwargs):
+        kwargs.setdefault("name", "test")
+        return Pipeline(cache_dir=str(tmp_path / cache), **kwargs)
+    return make
+
+
+def runMPI(tmp_path, script, args, processes=2):
+    """Runs one of the scripts in tests on several processes with mpirun. Skips the test without mpirun"""
+    pytest.importorskip("mpi4py")
+    mpirun = shutil.which("mpirun")
+    if mpirun is None:
+        pytest.skip("needs mpirun")
+
+    # the repository is imported as ndustria by the processes mpirun starts
+    link = tmp_path / "ndustria"
+    if not link.exists():
+        link.symlink_to(ROOT)
+    env = dict(os.environ, PYTHONPATH=str(tmp_path))
+
+    command = [mpirun, "-n", str(processes)]
+    if "Open MPI" in subprocess.run([mpirun, "--version"], capture_output=True, text=True).stdout:
+        command += ["--oversubscribe"] + (["--allow-run-as-root"] if os.geteuid() == 0 else [])
+
+    done = subprocess.run(
+        command + [sys.executable, os.path.join(ROOT, "tests", script)] + list(args),
+        capture_output=True, text=True, env=env, timeout=120
+    )
+    assert done.returncode == 0, done.stdout + done.stderr
+    return done.stdout
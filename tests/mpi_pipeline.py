@@ -0,0 +1,27 @@
+"""Pipeline run by test_mpi.py on several processes: python mpi_pipeline.py <cache directory>"""
+
+import sys
+from ndustria import Pipeline
+
+pipe = Pipeline(name="mpi", cache_dir=sys.argv[1], parallel=True)
+
+@pipe.AddFunction()
+def square(x):
+    return x * x
+
+@pipe.AddFunction(ranks=2)
+def spread(values, comm=None):
+    # every rank of the group adds up its share
+    return comm.allreduce(sum(values[comm.Get_rank()::comm.Get_size()]))
+
+@pipe.AddFunction()
+def total(values):
+    return sum(values)
+
+squares = [square(x) for x in range(8)]
+result = total([spread(squares)] + squares)
+pipe.run()
+pipe.printLog()
+
+if pipe.isRoot():
+    print("RESULT", result.getResult(), flush=True)
@@ -0,0 +1,29 @@
+"""Pipeline run by test_ranks.py on three processes: python mpi_ranks.py <cache directory>"""
+
+import sys
+from ndustria import Pipeline
+
+pipe = Pipeline(name="ranks", cache_dir=sys.argv[1], parallel=True)
+
+@pipe.AddFunction()
+def part(i):
+    return i
+
+@pipe.AddFunction(ranks=2)
+def pair(value, comm=None):
+    # the world ranks of the group, which must be a block of neighbours
+    ranks = comm.allgather(pipe.getCommRank())
+    return (comm.Get_size(), comm.allreduce(value), ranks)
+
+@pipe.AddFunction(ranks=5)
+def everyone(values, comm=None):
+    return (comm.Get_size(), comm.allreduce(len(values)))
+
+pairs = [pair(part(i)) for i in range(3)]
+result = everyone(pairs)
+pipe.run()
+
+if pipe.isRoot():
+    for p in pairs:
+        print("PAIR", *p.getResult(), flush=True)
+    print("EVERYONE", *result.getResult(), flush=True)
@@ -0,0 +1,38 @@
+"""Pipeline run by test_speculation.py on two processes: python mpi_speculation.py <cache directory> fast|slow
+
+The fast run records how long the Tasks take. In the slow run, the first copy of work(4)
+straggles and has to be overtaken by a backup copy on the other process.
+"""
+
+import os, sys, time
+from ndustria import Pipeline
+
+cache_dir = sys.argv[1]
+slow = sys.argv[2] == "slow"
+pipe = Pipeline(name="speculation", cache_dir=cache_dir, parallel=True,
+                speculative=True, speculative_factor=3, speculative_min_seconds=0.5)
+
+def straggles():
+    # only the first copy, whichever process it runs on
+    try:
+        os.close(os.open(os.path.join(cache_dir, "straggled"), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+@pipe.AddFunction(rerun=slow)
+def work(i):
+    time.sleep(60 if slow and i == 4 and straggles() else 0.3)
+    return i * i
+
+@pipe.AddFunction(rerun=slow)
+def total(values):
+    return sum(values)
+
+result = total([work(i) for i in range(6)])
+start = time.time()
+pipe.run()
+
+if pipe.isRoot():
+    print("RESULT", result.getResult(), flush=True)
+    print("SECONDS", time.time() - start, flush=True)
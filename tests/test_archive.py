@@ -0,0 +1,111 @@
+"""Packing cached results into an archive and unpacking them into another cache"""
+
+import os, tarfile
+
+from ndustria import Pipeline
+
+
+def build(make_pipeline, cache, computed):
+    pipe = make_pipeline(cache)
+
+    @pipe.AddFunction()
+    def make(n):
+        computed.append(n)
+        return list(range(n))
+
+    @pipe.AddFunction()
+    def total(values):
+        computed.append("total")
+        return sum(sum(v) for v in values)
+
+    return pipe, total([make(n) for n in (10, 20, 30)])
+
+
+def packed(make_pipeline, tmp_path):
+    """Runs the Pipeline in siteA and packs its results. Returns the path of the archive"""
+    pipe, task = build(make_pipeline, "siteA", [])
+    pipe.run()
+    archive = pipe.pack(str(tmp_path / "results.tar"))
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+    return archive
+
+
+def test_unpacked_results_are_not_computed(makePipeline, tmp_path):
+    archive = packed(makePipeline, tmp_path)
+    with tarfile.open(archive) as tar:
+        assert len([m for m in tar.getnames() if m.startswith("results/")]) == 4
+
+    computed = []
+    pipe, task = build(makePipeline, "siteB", computed)
+    pipe.unpack(archive)
+    assert task.done()
+
+    pipe.run()
+    assert task.getResult() == sum(range(10)) + sum(range(20)) + sum(range(30))
+    assert computed == []
+
+
+def test_unpacking_again_skips_everything(makePipeline, tmp_path):
+    from ndustria.src.Archive import unpackArchive
+
+    archive = packed(makePipeline, tmp_path)
+    pipe, task = build(makePipeline, "siteB", [])
+
+    assert unpackArchive(pipe.cache, archive) == (4, 0, 0)
+    assert unpackArchive(pipe.cache, archive) == (0, 4, 0)
+
+
+def test_damaged_results_are_not_unpacked(makePipeline, tmp_path):
+    archive = packed(makePipeline, tmp_path)
+
+    with tarfile.open(archive) as tar:
+        member = next(m for m in tar.getmembers() if m.name.startswith("results/"))
+    with open(archive, "r+b") as f:
+        f.seek(member.offset_data + member.size // 2)
+        byte = f.read(1)
+        f.seek(-1, 1)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    computed = []
+    pipe, task = build(makePipeline, "siteB", computed)
+    pipe.unpack(archive)
+    pipe.run()
+
+    # only the damaged result is computed again
+    assert task.getResult() == sum(range(10)) + sum(range(20)) + sum(range(30))
+    assert len(computed) == 1
+
+
+def test_identical_results_are_packed_once(makePipeline, tmp_path):
+    def build(cache):
+        pipe = makePipeline(cache)
+
+        @pipe.AddFunction()
+        def make(n):
+            return list(range(1000))
+
+        return pipe, [make(n) for n in range(3)]
+
+    pipe, tasks = build("siteA")
+    pipe.run()
+    archive = pipe.pack(str(tmp_path / "results.tar"))
+
+    with tarfile.open(archive) as tar:
+        members = [m for m in tar.getmembers() if m.name.startswith("results/")]
+    assert len(members) == 3
+    assert [m.size > 0 for m in members] == [True, False, False]
+    assert all(m.pax_headers["ndustria.same_as"] == members[0].name for m in members[1:])
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    pipe, tasks = build("siteB")
+    pipe.unpack(archive)
+    assert all(t.done() for t in tasks)
+    assert all(t.getResult() == list(range(1000)) for t in tasks)
+
+    # they're links to a single blob
+    inodes = set(os.stat(pipe.cache.getFullPathToTask(t)).st_ino for t in tasks)
+    assert len(inodes) == 1
@@ -0,0 +1,59 @@
+"""Output directories of Tasks added with artifacts=True"""
+
+import os, shutil
+
+
+def test_artifacts(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction(artifacts=True)
+    def simulate(n, output_dir):
+        path = os.path.join(output_dir, "snapshot.txt")
+        with open(path, "w") as f:
+            f.write("x" * n)
+        return path
+
+    @pipe.AddFunction()
+    def size(path):
+        return os.path.getsize(path)
+
+    snapshot = simulate(10)
+    task = size(snapshot)
+    pipe.run()
+
+    assert task.getResult() == 10
+    path = snapshot.getResult()
+    assert path.startswith(os.path.join(pipe.cache.path, "artifacts"))
+
+    entry = pipe.cache.table[snapshot.getFilename()]
+    assert list(entry[4]) == ["snapshot.txt"]
+    assert entry[4]["snapshot.txt"][0] == 10
+
+
+def test_caches_resolve_their_own_paths(makePipeline, tmp_path):
+    from ndustria import Cache
+
+    pipe = makePipeline()
+
+    @pipe.AddFunction(artifacts=True)
+    def simulate(n, output_dir):
+        path = os.path.join(output_dir, "snapshot.txt")
+        with open(path, "w") as f:
+            f.write("x" * n)
+        return path
+
+    snapshot = simulate(10)
+    pipe.run()
+
+    # creating another cache in the same process doesn't redirect this one
+    other = Cache(str(tmp_path / "other"), reset_log=False)
+    assert other.fingerprints is not pipe.cache.fingerprints
+
+    snapshot.result = None
+    assert snapshot.getResult().startswith(os.path.join(pipe.cache.path, "artifacts"))
+    assert pipe.cache.fileUnchanged(snapshot)
+
+    # a copy of the cache elsewhere resolves the paths into itself
+    shutil.copytree(pipe.cache.path, str(tmp_path / "moved"))
+    moved = Cache(str(tmp_path / "moved"), reset_log=False)
+    assert moved.load(snapshot).startswith(os.path.join(moved.path, "artifacts"))
@@ -0,0 +1,61 @@
+"""Large arrays stored in chunks and loaded lazily through ChunkedArray proxies"""
+
+import os
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ndustria import Pipeline
+from ndustria.src.Chunked import ChunkedArray
+
+
+def build(make_pipeline):
+    pipe = make_pipeline(chunk_bytes=8000)
+
+    @pipe.AddFunction()
+    def simulate(steps):
+        return {"pos": np.arange(steps * 100, dtype=float).reshape(steps, 100), "steps": steps}
+
+    return pipe, simulate(50)
+
+
+def test_arrays_are_stored_in_chunks(makePipeline):
+    pipe, task = build(makePipeline)
+    pipe.run()
+
+    # the Task that made it keeps the array itself
+    assert isinstance(task.getResult()["pos"], np.ndarray)
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    pipe, task = build(makePipeline)
+    pos = task.getResult()["pos"]
+    assert isinstance(pos, ChunkedArray)
+    assert pos.shape == (50, 100) and len(pos.digests) == 5
+    assert os.path.isdir(os.path.join(pipe.cache.path, pos.directory))
+
+
+def test_indexing_reads_only_the_chunks_needed(makePipeline, monkeypatch):
+    pipe, task = build(makePipeline)
+    pipe.run()
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    pipe, task = build(makePipeline)
+    pos = task.getResult()["pos"]
+    expected = np.arange(5000, dtype=float).reshape(50, 100)
+
+    read = []
+    readChunks = ChunkedArray.readChunks
+    monkeypatch.setattr(ChunkedArray, "readChunks", lambda self, c: read.extend(c) or readChunks(self, c))
+
+    assert np.array_equal(pos[-1], expected[-1])
+    assert np.array_equal(pos[12:25:3, 5], expected[12:25:3, 5])
+    assert read == [4, 1, 2]
+
+    # anything else loads the whole array once
+    assert np.array_equal(pos + 1, expected + 1)
+    assert pos.sum() == expected.sum()
+    assert read == [4, 1, 2, 0, 1, 2, 3, 4]
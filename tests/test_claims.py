@@ -0,0 +1,122 @@
+"""Sharing a cache between processes: claims and their leases, and the table journal"""
+
+import os, sys, time
+
+from ndustria import Pipeline, Cache
+from ndustria.src.Cache import LEASE_SECONDS
+
+
+def makeTask(pipe):
+    @pipe.AddFunction()
+    def work(x):
+        return x
+
+    return work(1)
+
+
+def test_claims_exclude_other_processes(makePipeline, tmp_path):
+    pipe = makePipeline()
+    task = makeTask(pipe)
+
+    other = Cache(pipe.cache.path, reset_log=False)
+    assert pipe.cache.claim(task)
+    assert not other.claim(task)
+
+    pipe.cache.release(task)
+    assert other.claim(task)
+    other.release(task)
+
+
+def test_stale_claims_are_taken_over(makePipeline):
+    pipe = makePipeline()
+    task = makeTask(pipe)
+
+    other = Cache(pipe.cache.path, reset_log=False)
+    assert pipe.cache.claim(task)
+
+    # the holder stopped refreshing its lease
+    claim_fname = os.path.join(pipe.cache.claim_path, task.getFilename())
+    stale = time.time() - LEASE_SECONDS - 1
+    os.utime(claim_fname, (stale, stale))
+
+    assert other.claim(task)
+
+    # releasing a claim that was taken over leaves the new holder's alone
+    pipe.cache.release(task)
+    assert os.path.exists(claim_fname)
+    other.release(task)
+    assert not os.path.exists(claim_fname)
+
+
+def test_journal_is_replayed_and_compacted(tmp_path):
+    cache = Cache(str(tmp_path / "cache"))
+    with cache.table_lock:
+        cache.recordEntry("a", ("a()", 1, "digest-a"))
+        cache.recordEntry("b", ("b()", 2, "digest-b"))
+
+    # a crash in the middle of appending an entry
+    with open(cache.journal_file, "ab") as f:
+        f.write((100).to_bytes(8, "little") + b"cut off")
+
+    reopened = Cache(cache.path, reset_log=False)
+    assert sorted(reopened.table) == ["a", "b"]
+
+    reopened.writeCacheInfo()
+    assert os.path.getsize(reopened.journal_file) == 0
+    assert sorted(Cache(cache.path, reset_log=False).table) == ["a", "b"]
+
+    with open(reopened.info_file) as f:
+        assert "b()" in f.read()
+
+
+
+def claimed(pipe, monkeypatch):
+    """Records the Tasks pipe claims"""
+    names = []
+    claim = pipe.cache.claim
+    monkeypatch.setattr(pipe.cache, "claim", lambda task: names.append(task.getFilename()) or claim(task))
+    return names
+
+
+def test_serial_runs_claim_only_shared_caches(makePipeline, monkeypatch):
+    pipe = makePipeline()
+    task = makeTask(pipe)
+    names = claimed(pipe, monkeypatch)
+    pipe.run()
+    assert names == []
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    pipe = makePipeline(shared_cache=True)
+
+    @pipe.AddFunction()
+    def other(x):
+        return x
+
+    task = other(2)
+    names = claimed(pipe, monkeypatch)
+    pipe.run()
+    assert names == [task.getFilename()]
+    assert os.listdir(pipe.cache.claim_path) == []
+
+
+def test_directory_is_flushed_once_per_iteration(makePipeline, monkeypatch):
+    # the module, which the Cache class shadows as an attribute of ndustria.src
+    CacheModule = sys.modules["ndustria.src.Cache"]
+
+    pipe = makePipeline()
+
+    @pipe.AddFunction()
+    def work(x):
+        return x
+
+    tasks = [work(i) for i in range(5)]
+
+    synced = []
+    syncFile = CacheModule.syncFile
+    monkeypatch.setattr(CacheModule, "syncFile", lambda path: synced.append(path) or syncFile(path))
+    pipe.run()
+
+    assert all(pipe.cache.exists(t) for t in tasks)
+    assert synced.count(pipe.cache.path) == 1
@@ -0,0 +1,76 @@
+"""Packing Tasks with cores hints against the cores of each node"""
+
+from ndustria.src.Scheduler import scheduleIteration, nodeBarriers
+
+
+def build(make_pipeline):
+    pipe = make_pipeline()
+
+    @pipe.AddFunction(cores=3)
+    def heavy(i):
+        return i
+
+    @pipe.AddFunction(cores=2)
+    def medium(i):
+        return i
+
+    @pipe.AddFunction()
+    def light(i):
+        return i
+
+    return pipe, heavy, medium, light
+
+
+def placement(schedule):
+    """{task: (rank, cpus, step)} of a schedule of single-rank Tasks"""
+    return {task: (rank, cpus, step) for rank, entries in schedule.items() for task, group, cpus, step in entries}
+
+
+def test_tasks_fit_the_cores_of_their_node(makePipeline):
+    pipe, heavy, medium, light = build(makePipeline)
+    tasks = [heavy(0), heavy(1), medium(2), medium(3)]
+
+    # two processes on one node with 4 CPUs
+    placed = placement(scheduleIteration(tasks, 2, nodes=[0, 0], node_cpus=[[0, 1, 2, 3]]))
+
+    # the heavy Tasks don't fit next to each other
+    assert placed[tasks[0]][2] != placed[tasks[1]][2]
+
+    # the medium ones do, on CPUs of their own
+    assert placed[tasks[2]][2] == placed[tasks[3]][2]
+    assert set(placed[tasks[2]][1]).isdisjoint(placed[tasks[3]][1])
+    assert all(len(placed[t][1]) == t.cores for t in tasks)
+
+
+def test_nodes_are_packed_separately(makePipeline):
+    pipe, heavy, medium, light = build(makePipeline)
+    tasks = [heavy(0), heavy(1)]
+
+    # one process on each of two nodes
+    placed = placement(scheduleIteration(tasks, 2, nodes=[0, 1], node_cpus=[[0, 1, 2, 3], [0, 1, 2, 3]]))
+    assert placed[tasks[0]][2] == placed[tasks[1]][2] == 0
+
+
+def test_only_hinted_steps_are_synchronized(makePipeline):
+    pipe, heavy, medium, light = build(makePipeline)
+    tasks = [light(i) for i in range(8)] + [heavy(0)]
+
+    # two processes on each of two nodes
+    nodes = [0, 0, 1, 1]
+    schedule = scheduleIteration(tasks, 4, nodes=nodes, node_cpus=[[0, 1, 2, 3], [0, 1, 2, 3]])
+    step = placement(schedule)[tasks[-1]][2]
+    node = nodes[placement(schedule)[tasks[-1]][0]]
+
+    barriers = {rank: nodeBarriers(schedule, nodes, rank) for rank in range(4)}
+
+    # the processes of the heavy Task's node meet around its step, the others never do
+    hinted = [rank for rank in range(4) if nodes[rank] == node]
+    assert barriers[hinted[0]] == barriers[hinted[1]]
+    assert set(barriers[hinted[0]]) <= {step, step + 1} and len(barriers[hinted[0]]) > 0
+    assert all(barriers[rank] == [] for rank in range(4) if nodes[rank] != node)
+
+
+def test_schedules_without_hints_need_no_barriers(makePipeline):
+    pipe, heavy, medium, light = build(makePipeline)
+    schedule = scheduleIteration([light(i) for i in range(8)], 2, nodes=[0, 0], node_cpus=[[0, 1]])
+    assert nodeBarriers(schedule, [0, 0], 0) == []
@@ -0,0 +1,35 @@
+"""Early cutoff: Tasks depending on results that were recomputed to the same bytes stay cached"""
+
+from ndustria import Pipeline
+
+
+def test_early_cutoff(makePipeline):
+    computed = []
+
+    def build(rerun):
+        pipe = makePipeline(content_hash=True)
+
+        @pipe.AddFunction(rerun=rerun)
+        def parameters():
+            computed.append("parameters")
+            return [1, 2, 3]
+
+        @pipe.AddFunction()
+        def analysis(values):
+            computed.append("analysis")
+            return sum(values)
+
+        return pipe, analysis(parameters())
+
+    pipe, task = build(rerun=False)
+    pipe.run()
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    # the rerun produces the same bytes, so the analysis is still cached
+    pipe, task = build(rerun=True)
+    pipe.run()
+
+    assert computed == ["parameters", "analysis", "parameters"]
+    assert task.getResult() == 6
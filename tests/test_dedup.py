@@ -0,0 +1,57 @@
+"""Calls with the same function and arguments sharing a single Task"""
+
+from ndustria import Pipeline
+
+
+def test_duplicate_calls_share_a_task(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction()
+    def load(i):
+        return i
+
+    @pipe.AddFunction()
+    def add(a, b):
+        return a + b
+
+    x, y = load(1), load(1)
+    assert x is y
+    assert add(x, load(2)) is add(y, load(2))
+    assert len(pipe.Tasks) == 3
+
+    # the same batch through map() is deduplicated too
+    assert load.map([1, 1, 3]) == [x, x, load(3)]
+
+
+
+def test_duplicate_rerun_calls(makePipeline):
+    computed = []
+
+    def build():
+        pipe = makePipeline()
+
+        def load(i):
+            computed.append(i)
+            return i
+
+        return pipe, pipe.AddFunction()(load), pipe.AddFunction(rerun=True)(load)
+
+    pipe, cached, fresh = build()
+    task = cached(1)
+    pipe.run()
+
+    # the result was just computed, asking for a rerun afterwards doesn't redo it
+    assert fresh(1) is task and task.done()
+    pipe.run()
+    assert computed == [1]
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    # a result only loaded from the cache is redone
+    pipe, cached, fresh = build()
+    task = cached(1)
+    assert task.done()
+    assert fresh(1) is task and not task.done()
+    pipe.run()
+    assert computed == [1, 1]
@@ -0,0 +1,60 @@
+"""Finding the Tasks a Task depends on in its arguments"""
+
+from collections import namedtuple
+
+Pair = namedtuple("Pair", ["first", "second"])
+
+
+def test_keyword_and_nested_dependencies(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction()
+    def value(i):
+        return i
+
+    @pipe.AddFunction()
+    def combine(values, pair, scale=1, options=None):
+        return (values[0] + values[1][0] + pair.first * pair.second) * scale + options["offset"]
+
+    a, b, c, d, e = [value(i) for i in range(1, 6)]
+    task = combine([a, (b,)], Pair(c, 10), scale=d, options={"offset": e, "name": "x"})
+
+    assert task.dependencies == [a, b, c, d, e]
+    assert task.with_tasks == {0, 1, "scale", "options"}
+
+    pipe.run()
+    assert task.getResult() == (1 + 2 + 3 * 10) * 4 + 5
+
+
+def test_arguments_without_tasks_are_passed_as_they_are(makePipeline):
+    pipe = makePipeline()
+    settings = {"nested": [1, 2]}
+
+    @pipe.AddFunction()
+    def value(i):
+        return i
+
+    @pipe.AddFunction()
+    def check(v, settings):
+        return settings
+
+    task = check(value(1), settings)
+    assert task.with_tasks == {0}
+
+    pipe.run()
+    assert task.getResult() == settings
+
+
+def test_dependencies_change_the_hashcode(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction()
+    def value(i):
+        return i
+
+    @pipe.AddFunction()
+    def total(values=None):
+        return sum(values)
+
+    assert total(values=[value(1), value(2)]) is not total(values=[value(1), value(3)])
+    assert total(values=[value(1), value(2)]) is total(values=[value(1), value(2)])
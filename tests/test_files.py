@@ -0,0 +1,98 @@
+"""Files as results and arguments of Tasks, tracked by their fingerprints"""
+
+import os
+
+from ndustria import Pipeline, File
+
+
+def test_file_results_are_fingerprinted(makePipeline, tmp_path):
+    path = tmp_path / "out.txt"
+    computed = []
+
+    def build():
+        pipe = makePipeline()
+
+        @pipe.AddFunction()
+        def write():
+            computed.append("write")
+            path.write_text("data")
+            return File(str(path))
+
+        @pipe.AddFunction()
+        def text():
+            return str(path)
+
+        return pipe, write(), text()
+
+    pipe, written, named = build()
+    pipe.run()
+    assert pipe.cache.table[written.getFilename()][3][0] == str(path)
+
+    # a str result naming the same file is just a str
+    assert pipe.cache.table[named.getFilename()][3] is None
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    # deleting the file invalidates the result
+    os.remove(path)
+    pipe, written, named = build()
+    pipe.run()
+    assert computed == ["write", "write"]
+    assert path.read_text() == "data"
+
+
+def test_file_arguments_hash_by_content(makePipeline, tmp_path):
+    path = tmp_path / "in.txt"
+    path.write_text("one")
+
+    pipe = makePipeline()
+
+    @pipe.AddFunction()
+    def read(f):
+        with open(f) as handle:
+            return handle.read()
+
+    first = read(File(str(path))).getHashCode()
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    # a fresh stat of a rewritten file, with a different size
+    path.write_text("three")
+    assert read(File(str(path))).getHashCode() != first
+
+
+def test_fingerprints_are_saved_once_per_run(makePipeline, tmp_path, monkeypatch):
+    from ndustria.src.File import FingerprintStore
+
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"in{i}.txt"
+        path.write_text(str(i))
+        # old enough to be remembered
+        os.utime(path, (1, 1))
+        paths.append(path)
+
+    pipe = makePipeline()
+
+    saved = []
+    replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda a, b: saved.append(b) or replace(a, b))
+
+    @pipe.AddFunction()
+    def read(f):
+        with open(f) as handle:
+            return handle.read()
+
+    store = pipe.cache.fingerprints
+    tasks = [read(File(str(p))) for p in paths]
+    assert store.path not in saved
+
+    pipe.run()
+    assert saved.count(store.path) == 1
+
+    # another process finds them all
+    other = FingerprintStore(store.path)
+    other.refresh()
+    assert len(other.entries) == 5
@@ -0,0 +1,30 @@
+"""Log files written by each rank and merged by the root"""
+
+import os
+
+from ndustria.src import Logger
+
+
+def test_rank_logs_are_merged_in_order(tmp_path):
+    log_file = str(tmp_path / "last_run.log")
+    previous = Logger.LOG_FILE
+    try:
+        Logger.setLogFile(log_file)
+        Logger.setLogRank(0)
+        Logger.log("from rank 0\nwith a second line")
+        Logger.flush()
+
+        # rank 1 logged before and after rank 0
+        stamp = float(open(f"{log_file}.rank0").readline().split(" ")[0])
+        with open(f"{log_file}.rank1", "w") as f:
+            f.write(f"{stamp - 1:.6f} before\n{stamp + 1:.6f} after\n")
+
+        Logger.mergeLogs(2)
+    finally:
+        Logger.LOG_RANK = None
+        Logger.LOG_FILE = previous
+
+    with open(log_file) as f:
+        assert f.read().splitlines() == ["before", "from rank 0", "with a second line", "after"]
+    assert not os.path.exists(f"{log_file}.rank0")
+    assert not os.path.exists(f"{log_file}.rank1")
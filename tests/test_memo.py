@@ -0,0 +1,26 @@
+"""Helper functions memoized by the Pipeline"""
+
+
+def test_memoize(makePipeline):
+    calls = []
+    pipe = makePipeline()
+
+    @pipe.memoize(maxsize=2, spill=True)
+    def helper(x):
+        calls.append(x)
+        return x * 10
+
+    @pipe.AddFunction()
+    def work(xs):
+        return [helper(x) for x in xs]
+
+    task = work([1, 2, 1, 3, 1, 2])
+    pipe.run()
+
+    assert task.getResult() == [10, 20, 10, 30, 10, 20]
+    assert calls == [1, 2, 3]
+
+    stats = pipe.getMemoStats()["helper"]
+    assert stats["misses"] == 3
+    assert stats["hits"] + stats["spill_hits"] == 3
+    assert stats["spill_hits"] == 1
@@ -0,0 +1,66 @@
+"""Phase metrics of Tasks"""
+
+import os
+
+from ndustria import Pipeline
+from ndustria.src.Metrics import PHASES, mergeRecords, summarize, formatSummary
+
+
+def test_phases_are_recorded(makePipeline):
+    def build():
+        pipe = makePipeline()
+
+        @pipe.AddFunction()
+        def make(n):
+            return list(range(n))
+
+        @pipe.AddFunction()
+        def total(values):
+            return sum(values)
+
+        return pipe, total(make(1000))
+
+    pipe, task = build()
+    pipe.run()
+
+    make = task.dependencies[0]
+    assert make.metrics.ran and task.metrics.ran
+    assert make.metrics.bytes["serialize"] > 0
+    assert make.metrics.times["compute"] > 0
+
+    summary = pipe.getStats()
+    assert summary["[total]"]["tasks"] == 2
+    assert summary["[total]"]["misses"] == 2
+    assert os.path.isfile(os.path.join(pipe.cache.path, "test_stats.json"))
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    pipe, task = build()
+    pipe.run()
+    assert pipe.getStats()["total"]["hits"] == 1
+
+
+def record(hash, ran, seconds, rank=0):
+    times = dict.fromkeys(PHASES, 0.0)
+    times["compute"] = seconds
+    return {
+        "function": "f", "task": "f()", "hash": hash, "rank": rank,
+        "cache_hit": False, "ran": ran,
+        "times": times, "bytes": dict.fromkeys(PHASES, 0),
+    }
+
+
+def test_records_of_ranks_are_merged():
+    merged = mergeRecords([
+        [record("a", True, 1.0), record("b", False, 0.0)],
+        [record("a", False, 0.5, rank=1), record("b", True, 2.0, rank=1)],
+    ])
+    by_hash = {r["hash"]: r for r in merged}
+
+    assert by_hash["a"]["times"]["compute"] == 1.5
+    assert by_hash["b"]["rank"] == 1
+
+    summary = summarize(merged)
+    assert summary["f"]["phases"]["compute"]["total"] == 3.5
+    assert "compute" in formatSummary(summary)
@@ -0,0 +1,15 @@
+"""Smoke test of a parallel run on two processes with mpirun"""
+
+from conftest import runMPI
+
+
+def test_two_processes(tmp_path):
+    cache = str(tmp_path / "cache")
+
+    for attempt in ["computed", "cached"]:
+        output = runMPI(tmp_path, "mpi_pipeline.py", [cache])
+        assert "RESULT 280" in output, attempt
+        assert "parallel run with 2 processes" in output
+
+    # the second run found everything in the cache
+    assert "Starting a run with 0 tasks" in output
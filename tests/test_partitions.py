@@ -0,0 +1,72 @@
+"""Splitting a Pipeline into partitions run as separate jobs"""
+
+from ndustria import Pipeline
+from ndustria.src.Planner import partitionTasks
+
+
+def build(make_pipeline, computed):
+    pipe = make_pipeline()
+
+    @pipe.AddFunction()
+    def load(name):
+        computed.append(f"load {name}")
+        return name
+
+    @pipe.AddFunction()
+    def analyse(data):
+        computed.append(f"analyse {data}")
+        return data.upper()
+
+    @pipe.AddFunction()
+    def combine(results):
+        computed.append("combine")
+        return "".join(results)
+
+    chains = [analyse(load(name)) for name in ("a", "b")]
+    return pipe, chains, combine(chains)
+
+
+def test_chains_stay_together(makePipeline):
+    pipe, chains, combined = build(makePipeline, [])
+    plan = pipe.plan(2)
+
+    assert plan["counts"] == [3, 2]
+    assert not plan["historical_timing"]
+
+    # only the combined result needs something from the other partition
+    assert plan["cut_edges"] == 1
+    owners = [plan["tasks"][t.getHashCode()] for t in chains]
+    assert sorted(owners) == [0, 1]
+
+
+def test_partitions_run_as_separate_jobs(makePipeline):
+    computed = []
+    pipe, chains, combined = build(makePipeline, computed)
+    plan = pipe.plan(2)
+
+    # the partition without the combined Task goes first, like a job started earlier
+    first = 1 - plan["tasks"][combined.getHashCode()]
+    for partition in (first, 1 - first):
+        Pipeline.Tasks.clear()
+        Pipeline.TasksByHash.clear()
+
+        pipe, chains, combined = build(makePipeline, computed)
+        pipe.run(partition=partition, poll_interval=0.1)
+
+    assert combined.getResult() == "AB"
+    assert sorted(computed) == ["analyse a", "analyse b", "combine", "load a", "load b"]
+
+
+def test_costs_balance_partitions(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction()
+    def work(i):
+        return i
+
+    tasks = [work(i) for i in range(4)]
+    costs = {tasks[0].id: 3.0, tasks[1].id: 1.0, tasks[2].id: 1.0, tasks[3].id: 1.0}
+
+    assignment = partitionTasks(tasks, costs, 2)
+    assert assignment[tasks[0].id] != assignment[tasks[1].id]
+    assert len(set(assignment[t.id] for t in tasks[1:])) == 1
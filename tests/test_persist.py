@@ -0,0 +1,30 @@
+"""Results of Tasks added with persist=False, kept in memory instead of the cache"""
+
+
+def test_results_not_persisted(makePipeline):
+    computed = []
+    pipe = makePipeline()
+
+    @pipe.AddFunction(persist=False)
+    def separations(n):
+        computed.append(n)
+        return list(range(n))
+
+    @pipe.AddFunction()
+    def count(values):
+        return len(values)
+
+    @pipe.AddFunction()
+    def largest(values):
+        return max(values)
+
+    source = separations(5)
+    tasks = [count(source), largest(source)]
+    pipe.run()
+
+    assert [t.getResult() for t in tasks] == [5, 4]
+    assert computed == [5]
+    assert not pipe.cache.exists(source)
+
+    # dropped once the Tasks using it were done
+    assert source.result is None
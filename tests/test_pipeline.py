@@ -0,0 +1,36 @@
+"""Serial runs and their cached results"""
+
+from ndustria import Pipeline
+
+
+def test_serial_run_caches_results(makePipeline):
+    computed = []
+
+    def build():
+        pipe = makePipeline()
+
+        @pipe.AddFunction()
+        def square(x):
+            computed.append(x)
+            return x * x
+
+        @pipe.AddFunction()
+        def total(values):
+            return sum(values)
+
+        return pipe, total([square(x) for x in range(4)])
+
+    pipe, task = build()
+    pipe.run()
+    assert task.getResult() == 14
+    assert sorted(computed) == [0, 1, 2, 3]
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    # everything is found in the cache the second time
+    pipe, task = build()
+    assert task.done()
+    pipe.run()
+    assert task.getResult() == 14
+    assert len(computed) == 4
@@ -0,0 +1,71 @@
+"""Loading dependency results on background threads before the Tasks that need them run"""
+
+import os
+
+from ndustria import Pipeline
+
+
+def build(make_pipeline, computed, **kwargs):
+    pipe = make_pipeline(**kwargs)
+
+    @pipe.AddFunction()
+    def make(n):
+        computed.append(n)
+        return list(range(n))
+
+    @pipe.AddFunction(rerun=True)
+    def total(values):
+        return sum(sum(v) for v in values)
+
+    return pipe, total([make(n) for n in (100, 200, 300)])
+
+
+def reload(make_pipeline, computed, **kwargs):
+    """Runs the Pipeline once, then sets it up again with the make results only in the cache"""
+    pipe, task = build(make_pipeline, computed)
+    pipe.run()
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+    return build(make_pipeline, computed, **kwargs)
+
+
+def test_prefetched_results_are_dropped_when_released(makePipeline):
+    pipe, task = reload(makePipeline, [], prefetch=True)
+    assert all(dep.done() and dep.result is None for dep in task.dependencies)
+
+    prefetcher = pipe.prefetcher
+    prefetcher.prefetch(task)
+    prefetcher.pool.shutdown(wait=True)
+
+    assert all(dep.result is not None for dep in task.dependencies)
+    assert prefetcher.reserved_bytes == sum(pipe.cache.sizeOf(dep) for dep in task.dependencies)
+
+    prefetcher.release(task)
+    assert prefetcher.reserved_bytes == 0
+    assert all(dep.result is None for dep in task.dependencies)
+
+
+def test_budget_limits_prefetching(makePipeline):
+    pipe, task = reload(makePipeline, [], prefetch=True, prefetch_bytes=1)
+
+    pipe.prefetcher.prefetch(task)
+    pipe.prefetcher.pool.shutdown(wait=True)
+
+    # nothing fits, everything is loaded when the Task runs instead
+    assert all(dep.result is None for dep in task.dependencies)
+    pipe.run()
+    assert task.getResult() == sum(range(100)) + sum(range(200)) + sum(range(300))
+
+
+def test_damaged_results_are_run_again(makePipeline):
+    computed = []
+    pipe, task = reload(makePipeline, computed, prefetch=True)
+
+    damaged = task.dependencies[1]
+    with open(os.path.join(pipe.cache.path, damaged.getFilename()), "r+b") as f:
+        f.truncate(10)
+
+    pipe.run()
+    assert task.getResult() == sum(range(100)) + sum(range(200)) + sum(range(300))
+    assert computed == [100, 200, 300, 200]
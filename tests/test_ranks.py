@@ -0,0 +1,65 @@
+"""Multi-rank Tasks, run by a group of processes sharing a sub-communicator"""
+
+from conftest import runMPI
+from ndustria.src.Scheduler import scheduleIteration
+
+
+def test_serial_pipelines_run_groups_alone(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction(ranks=4)
+    def spread(values, comm=None):
+        return (comm.Get_size(), comm.allreduce(sum(values)))
+
+    task = spread([1, 2, 3])
+    pipe.run()
+    assert task.getResult() == (1, 6)
+
+
+def test_groups_are_aligned_blocks(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction(ranks=2)
+    def pair(i, comm=None):
+        return i
+
+    @pipe.AddFunction()
+    def single(i):
+        return i
+
+    tasks = [single(0), pair(1), pair(2), single(3), single(4), pair(5)]
+    schedule = scheduleIteration(tasks, 4)
+
+    groups = set(group for entries in schedule.values() for task, group, cpus, step in entries)
+    assert groups <= {(0, 1), (2, 3), (0,), (1,), (2,), (3,)}
+
+    # the members of a group reach their shared Tasks in the same order
+    for first, second in [(0, 1), (2, 3)]:
+        shared = lambda rank: [t for t, group, cpus, step in schedule[rank] if len(group) > 1]
+        assert shared(first) == shared(second)
+
+    # every member of a group runs its Task
+    assert sum(len(entries) for entries in schedule.values()) == 3 + 3 * 2
+
+
+def test_groups_larger_than_the_pipeline(makePipeline):
+    pipe = makePipeline()
+
+    @pipe.AddFunction(ranks=8)
+    def wide(comm=None):
+        return 0
+
+    task = wide()
+    schedule = scheduleIteration([task], 3, report=False)
+    assert all(entries == [(task, (0, 1, 2), None, 0)] for entries in schedule.values())
+
+
+def test_groups_on_three_processes(tmp_path):
+    output = runMPI(tmp_path, "mpi_ranks.py", [str(tmp_path / "cache")], processes=3)
+
+    pairs = [line.split()[1:] for line in output.splitlines() if line.startswith("PAIR")]
+    assert [p[:2] for p in pairs] == [["2", "0"], ["2", "2"], ["2", "4"]]
+    assert all(p[2:] in (["[0,", "1]"], ["[1,", "2]"]) for p in pairs)
+
+    # the group asking for more ranks than there are runs on all three
+    assert "EVERYONE 3 9" in output
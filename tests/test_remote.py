@@ -0,0 +1,165 @@
+"""Sharing results through a remote cache, with the File and HTTP backends"""
+
+import pytest
+
+from ndustria.src.Backend import FileBackend, HTTPBackend, MockCacheServer
+from ndustria.src.Metrics import PHASES, mergeRecords, summarize
+
+
+@pytest.fixture(params=["file", "http"])
+def backend(request, tmp_path):
+    """Returns a function creating a backend on the same store every time it's called"""
+    if request.param == "file":
+        yield lambda: FileBackend(str(tmp_path / "shared"))
+        return
+
+    with MockCacheServer() as server:
+        # small parts, so results are downloaded with ranged requests
+        yield lambda: HTTPBackend(server.url, part_bytes=1000)
+
+
+def build(make_pipeline, cache, remote, computed, **kwargs):
+    pipe = make_pipeline(cache, remote_cache=remote, **kwargs)
+
+    @pipe.AddFunction()
+    def make(n):
+        computed.append("make")
+        return list(range(n))
+
+    @pipe.AddFunction()
+    def total(values):
+        computed.append("total")
+        return sum(values)
+
+    return pipe, total(make(2000))
+
+
+def test_miss_computes_and_uploads(makePipeline, backend):
+    computed = []
+    remote = backend()
+    pipe, task = build(makePipeline, "siteA", remote, computed)
+    pipe.run()
+
+    assert sorted(computed) == ["make", "total"]
+    assert task.getResult() == sum(range(2000))
+    assert remote.exists(task.getFilename())
+
+    # uploads are timed on their own, not as part of saving the result locally
+    assert task.metrics.times["upload"] > 0
+    assert task.metrics.bytes["upload"] == task.metrics.bytes["serialize"]
+
+
+def test_hit_downloads_instead_of_computing(makePipeline, backend):
+    pipe, task = build(makePipeline, "siteA", backend(), [])
+    pipe.run()
+
+    pipe.Tasks.clear()
+    pipe.TasksByHash.clear()
+
+    computed = []
+    pipe, task = build(makePipeline, "siteB", backend(), computed)
+    pipe.run()
+
+    assert computed == []
+    assert task.getResult() == sum(range(2000))
+
+
+def test_content_hash_with_remote_results(makePipeline, backend):
+    pipe, task = build(makePipeline, "siteA", backend(), [], content_hash=True)
+    pipe.run()
+
+    pipe.Tasks.clear()
+    pipe.TasksByHash.clear()
+
+    # the key of total depends on the digest of a result that's only in the remote cache
+    computed = []
+    pipe, task = build(makePipeline, "siteB", backend(), computed, content_hash=True)
+    pipe.run()
+
+    assert computed == []
+    assert task.getResult() == sum(range(2000))
+    assert not pipe.cache.onDisk(task.dependencies[0])
+
+
+def test_file_results_stay_local(makePipeline, backend, tmp_path):
+    from ndustria import File
+
+    def build(cache, computed):
+        pipe = makePipeline(cache, remote_cache=backend())
+
+        @pipe.AddFunction()
+        def write():
+            computed.append("write")
+            path = tmp_path / cache / "out.txt"
+            path.write_text("data")
+            return File(str(path))
+
+        return pipe, write()
+
+    pipe, task = build("siteA", [])
+    pipe.run()
+    assert not pipe.cache.remote.exists(task.getFilename())
+
+    pipe.Tasks.clear()
+    pipe.TasksByHash.clear()
+
+    # the file is written again where it's needed
+    computed = []
+    pipe, task = build("siteB", computed)
+    pipe.run()
+    assert computed == ["write"]
+    assert task.getResult().path == str(tmp_path / "siteB" / "out.txt")
+
+
+def test_ranged_download(makePipeline, tmp_path):
+    with MockCacheServer() as server:
+        pipe, task = build(makePipeline, "siteA", HTTPBackend(server.url, part_bytes=1000), [])
+        pipe.run()
+
+        # the intermediate result is larger than a part
+        remote = HTTPBackend(server.url, part_bytes=1000)
+        path = str(tmp_path / "download")
+        remote.load(task.dependencies[0].getFilename(), path)
+
+        size = len(server.blobs[server.refs[task.dependencies[0].getFilename()]])
+        assert size > 1000
+        assert server.requests[("GET", "blobs")] >= (size + 999) // 1000
+
+        with open(path, "rb") as f:
+            assert len(f.read()) == size
+
+
+def test_failed_upload_keeps_local_result(makePipeline, backend):
+    remote = backend()
+
+    def refuse(key, path, digest):
+        raise OSError("no space left on the remote")
+    remote.save = refuse
+
+    computed = []
+    pipe, task = build(makePipeline, "siteA", remote, computed)
+    pipe.run()
+
+    assert sorted(computed) == ["make", "total"]
+    assert task.getResult() == sum(range(2000))
+    assert pipe.cache.exists(task)
+    assert not remote.exists(task.getFilename())
+    assert task.metrics.times["upload"] == 0
+
+
+def test_stats_recorded_before_uploads():
+    def record(ran, rank):
+        times = dict.fromkeys(PHASES, 0.0)
+        times["compute"] = 1.0 if ran else 0.0
+        return {
+            "function": "f", "task": "f()", "hash": "a", "rank": rank,
+            "cache_hit": False, "ran": ran,
+            "times": times, "bytes": dict.fromkeys(PHASES, 0),
+        }
+
+    # stats files written before there was an upload phase
+    old = record(True, 0)
+    del old["times"]["upload"], old["bytes"]["upload"]
+
+    merged = mergeRecords([[old], [record(False, 1)]])
+    assert summarize(merged)["f"]["phases"]["upload"]["total"] == 0
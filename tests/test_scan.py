@@ -0,0 +1,56 @@
+"""Probing the cache through the index of its directory listed once by scan()"""
+
+import os
+
+from ndustria import Pipeline, Cache
+
+
+def build(make_pipeline):
+    pipe = make_pipeline()
+
+    @pipe.AddFunction()
+    def square(x):
+        return x * x
+
+    return pipe, [square(x) for x in range(5)]
+
+
+def test_probes_are_set_lookups(makePipeline, monkeypatch):
+    pipe, tasks = build(makePipeline)
+    pipe.run()
+    assert all(t.getFilename() in pipe.cache.index for t in tasks)
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    # new Tasks are found in the cache without a stat each
+    stats = []
+    exists = os.path.exists
+    monkeypatch.setattr(os.path, "exists", lambda path: stats.append(path) or exists(path))
+
+    pipe, tasks = build(makePipeline)
+    assert all(t.done() for t in tasks)
+    assert not any(t.getFilename() in path for t in tasks for path in stats)
+
+
+def test_results_saved_elsewhere_are_found_on_disk(makePipeline):
+    pipe, tasks = build(makePipeline)
+    assert not any(pipe.cache.exists(t) for t in tasks)
+
+    # another job saves a result after this cache was scanned
+    other = Cache(pipe.cache.path, reset_log=False)
+    tasks[0].result = 0
+    other.save(tasks[0])
+
+    assert not pipe.cache.exists(tasks[0])
+    assert pipe.cache.onDisk(tasks[0])
+    assert pipe.cache.exists(tasks[0])
+
+
+def test_removed_results_leave_the_index(makePipeline):
+    pipe, tasks = build(makePipeline)
+    pipe.run()
+
+    pipe.cache.remove(tasks[0])
+    assert not pipe.cache.exists(tasks[0])
+    assert pipe.cache.exists(tasks[1])
@@ -0,0 +1,122 @@
+"""Backup copies of straggling Tasks, see Speculation.py"""
+
+import functools, json, os, pickle, threading, time
+
+from conftest import runMPI
+from ndustria.src.Speculation import Speculator, commitFile
+
+
+def build(make_pipeline, calls, seconds=0.0):
+    pipe = make_pipeline()
+
+    @pipe.AddFunction()
+    def work(i):
+        calls.append(os.getpid())
+        time.sleep(seconds)
+        return i * i
+
+    return pipe, work(3)
+
+
+def speculator(pipe, expected):
+    """A Speculator of a serial Pipeline, which expects every work() to take expected seconds"""
+    speculator = Speculator(pipe, factor=3.0, min_seconds=1.0)
+    speculator.by_hash, speculator.by_function = {}, {"work": expected}
+    return speculator
+
+
+def test_candidates(makePipeline):
+    pipe, task = build(makePipeline, [])
+    spec = speculator(pipe, 0.5)
+    assert spec.isCandidate(task)
+
+    # would never gain much from a backup
+    spec.by_function["work"] = 0.1
+    assert not spec.isCandidate(task)
+
+    # never timed
+    spec.by_function = {}
+    assert not spec.isCandidate(task)
+    spec.close()
+
+
+def test_tasks_run_in_process(makePipeline, monkeypatch):
+    def refuse():
+        raise AssertionError("forked a child process")
+    monkeypatch.setattr(os, "fork", refuse)
+
+    calls = []
+    pipe, task = build(makePipeline, calls)
+    spec = speculator(pipe, 0.5)
+    spec.run(task, functools.partial(pipe.runTask, task, (0,)))
+    spec.close()
+
+    assert calls == [os.getpid()]
+    assert task.getResult() == 9
+    assert pipe.cache.onDisk(task)
+    assert not os.path.exists(spec.markerFile(task))
+
+
+def test_backups_wait_for_the_threshold(makePipeline):
+    calls = []
+    pipe, task = build(makePipeline, calls)
+    spec = speculator(pipe, 0.5)
+
+    # work(3) running on another process
+    marker = spec.markerFile(task)
+    with open(marker, "w") as f:
+        json.dump({"start": time.time(), "rank": 1, "host": "elsewhere"}, f)
+
+    spec.launchBackup([task])
+    assert spec.launched == 0 and calls == []
+
+    # three times longer than expected
+    with open(marker, "w") as f:
+        json.dump({"start": time.time() - 2.0, "rank": 1, "host": "elsewhere"}, f)
+
+    spec.launchBackup([task])
+    spec.close()
+
+    assert (spec.launched, spec.won) == (1, 1)
+    assert calls == [os.getpid()]
+    assert task.done() and task.metrics.ran
+    assert pipe.cache.onDisk(task)
+
+
+def test_losing_copy_is_interrupted(makePipeline):
+    pipe, task = build(makePipeline, [], seconds=30)
+    spec = speculator(pipe, 0.5)
+    cache_fname = pipe.cache.getFullPathToTask(task)
+
+    def backup():
+        # another process claims the backup and commits its result first
+        time.sleep(0.2)
+        open(f"{spec.markerFile(task)}.backup", "w").close()
+        with open(commitFile(pipe.cache, cache_fname), "w") as f:
+            f.write("elsewhere:1")
+        with open(cache_fname, "wb") as f:
+            pickle.dump(42, f)
+
+    thread = threading.Thread(target=backup)
+    thread.start()
+
+    start = time.time()
+    spec.run(task, functools.partial(pipe.runTask, task, (0,)))
+    thread.join()
+    spec.close()
+
+    assert time.time() - start < 10
+    assert task.done() and not task.metrics.ran
+    assert task.getResult() == 42
+
+
+def test_straggler_is_overtaken(tmp_path):
+    cache = str(tmp_path / "cache")
+    runMPI(tmp_path, "mpi_speculation.py", [cache, "fast"])
+    output = runMPI(tmp_path, "mpi_speculation.py", [cache, "slow"])
+
+    lines = dict(line.split(maxsplit=1) for line in output.splitlines() if line.startswith(("RESULT", "SECONDS")))
+    assert lines["RESULT"] == "55"
+
+    # the first copy of work(4) would have slept for a minute
+    assert float(lines["SECONDS"]) < 30
@@ -0,0 +1,63 @@
+"""Running only the part of the Pipeline needed for some targets"""
+
+from ndustria import Pipeline
+
+
+def build(make_pipeline, computed):
+    pipe = make_pipeline()
+
+    @pipe.AddFunction()
+    def load(name):
+        computed.append(f"load {name}")
+        return name
+
+    @pipe.AddFunction()
+    def analyse(data):
+        computed.append(f"analyse {data}")
+        return data.upper()
+
+    @pipe.AddFunction()
+    def plot(result):
+        computed.append(f"plot {result}")
+        return len(result)
+
+    tasks = {}
+    for name in ("a", "b"):
+        tasks[name] = analyse(load(name))
+        tasks[f"plot {name}"] = plot(tasks[name])
+    return pipe, tasks
+
+
+def test_targets_run_only_their_ancestors(makePipeline):
+    computed = []
+    pipe, tasks = build(makePipeline, computed)
+
+    pipe.run(targets=tasks["a"])
+    assert computed == ["load a", "analyse a"]
+    assert tasks["a"].getResult() == "A"
+    assert not tasks["b"].done() and not tasks["plot a"].done()
+
+
+def test_functions_select_every_task(makePipeline):
+    computed = []
+    pipe, tasks = build(makePipeline, computed)
+
+    pipe.run(functions="analyse")
+    assert sorted(computed) == ["analyse a", "analyse b", "load a", "load b"]
+    assert not tasks["plot a"].done()
+
+
+def test_cached_ancestors_are_not_needed(makePipeline):
+    computed = []
+    pipe, tasks = build(makePipeline, computed)
+    pipe.run(targets=tasks["a"])
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    pipe, tasks = build(makePipeline, computed)
+    assert pipe.getSubDAG(tasks["plot a"]) == [tasks["a"], tasks["plot a"]]
+    assert len(pipe.getSubDAG(tasks["plot a"], include_cached=True)) == 3
+
+    pipe.run(targets=tasks["plot a"])
+    assert computed == ["load a", "analyse a", "plot A"]
@@ -0,0 +1,29 @@
+"""Writing results to the cache in the background"""
+
+from ndustria import Pipeline
+
+
+def test_async_writes(makePipeline):
+    def build():
+        pipe = makePipeline(async_writes=True, write_queue=2)
+
+        @pipe.AddFunction()
+        def block(i):
+            return [i] * 1000
+
+        @pipe.AddFunction()
+        def total(blocks):
+            return sum(sum(b) for b in blocks)
+
+        return pipe, total([block(i) for i in range(6)])
+
+    pipe, task = build()
+    pipe.run()
+    assert task.getResult() == 15000
+    assert all(pipe.cache.exists(t) for t in pipe.Tasks)
+
+    Pipeline.Tasks.clear()
+    Pipeline.TasksByHash.clear()
+
+    pipe, task = build()
+    assert all(t.done() for t in pipe.Tasks)